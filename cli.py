@@ -0,0 +1,489 @@
+"""
+命令行入口：无界面批处理功能（批量导出、监视文件夹、分片作业、HTTP 服务等）。
+用法示例：
+    python main.py watch --input ./inbox --output ./out --template 00
+依赖：core.*
+"""
+import argparse
+import os
+import sys
+import time
+from core.template_manager import TemplateManager
+from core.export_pipeline import normalize_settings
+
+
+# ---------- 公共参数 ----------
+def _add_settings_args(parser):
+    parser.add_argument("--template", help="使用的模板名称")
+    parser.add_argument("--templates-file", default="templates.json", help="模板文件路径")
+    parser.add_argument("--text", help="水印文字（覆盖模板中的文字）")
+    parser.add_argument("--size-ratio", type=float,
+                        help="字号为图片短边的百分比（覆盖模板字号，例如 5 表示 5%%）")
+    parser.add_argument("--auto-contrast", action="store_true",
+                        help="按水印下方区域的亮度自动选择白字/黑字/描边")
+    parser.add_argument("--auto-position", action="store_true",
+                        help="按画面内容把水印放在细节最少的位置（覆盖模板位置）")
+    parser.add_argument("--mark", help="嵌入的隐形水印内容（如 客户ID:作业ID，最多 24 字节）")
+    parser.add_argument("--mark-key", help="隐形水印密钥（检测时需使用相同密钥）")
+
+
+def _add_export_args(parser):
+    parser.add_argument("--prefix", default="wm_", help="输出文件名前缀")
+    parser.add_argument("--suffix", default="_watermarked", help="输出文件名后缀")
+    parser.add_argument("--format", default="PNG", choices=["PNG", "JPEG"], help="输出格式")
+    parser.add_argument("--partial-jpeg", action="store_true",
+                        help="JPEG 源导出为 JPEG 时只重编码水印区域（需要源文件带重启间隔）")
+    parser.add_argument("--color", default="keep", choices=["keep", "srgb"],
+                        help="带 ICC 配置文件的图片：keep 保留配置文件，srgb 转换到 sRGB")
+
+
+def _add_metrics_args(parser):
+    parser.add_argument("--metrics-dir",
+                        help="定期把吞吐指标写到该目录（watermark_<作业>.prom 与 .json，供本机监控采集）")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="指标写出间隔（秒）")
+
+
+def _open_metrics(args, job, total=None):
+    """按 --metrics-dir 创建批次指标，未指定时返回 None"""
+    if not args.metrics_dir:
+        return None
+    from core.batch_metrics import BatchMetrics
+    return BatchMetrics.for_directory(args.metrics_dir, job, total, args.metrics_interval)
+
+
+def load_settings(args):
+    """从模板和命令行参数得到水印设置，失败时返回 None"""
+    settings = {}
+    if args.template:
+        settings = TemplateManager(args.templates_file).get_template(args.template)
+        if settings is None:
+            print(f"模板不存在: {args.template}")
+            return None
+    settings = dict(settings)
+    if args.text:
+        settings["text"] = args.text
+    if args.size_ratio:
+        settings["font_size_ratio"] = args.size_ratio / 100.0
+    if args.auto_contrast:
+        settings["auto_contrast"] = True
+    if args.auto_position:
+        settings["auto_position"] = True
+    if args.mark:
+        settings["invisible_mark"] = args.mark
+    if args.mark_key:
+        settings["invisible_key"] = args.mark_key
+    if settings.get("invisible_mark"):
+        from core.invisible_watermark import encode_payload
+        try:
+            encode_payload(settings["invisible_mark"])
+        except ValueError as e:
+            print(e)
+            return None
+    if not settings.get("text"):
+        print("请通过 --template 或 --text 设置水印文字")
+        return None
+    return normalize_settings(settings)
+
+
+# ---------- 子命令 ----------
+def cmd_watch(args):
+    from core.hot_folder import HotFolderWatcher
+    from core.export_pipeline import ExportPipeline
+
+    settings = load_settings(args)
+    if settings is None:
+        return 1
+
+    watcher = HotFolderWatcher(
+        args.input, args.output, settings,
+        pipeline=ExportPipeline(partial_jpeg=args.partial_jpeg, color_policy=args.color),
+        prefix=args.prefix, suffix=args.suffix, fmt=args.format,
+        poll_interval=args.interval, settle_time=args.settle,
+        queue_size=args.queue_size, workers=args.workers,
+        process_existing=not args.skip_existing,
+        on_processed=lambda src, dst: print(f"已导出: {src} -> {dst}"),
+        on_error=lambda src, msg: print(f"处理失败: {src}: {msg}"),
+    )
+    watcher.start()
+    print(f"正在监视: {', '.join(watcher.input_folders)}（Ctrl+C 退出）")
+    try:
+        while watcher.is_running():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+    return 0
+
+
+def cmd_export(args):
+    from core.export_pipeline import ExportPipeline
+    from core.staged_pipeline import StagedExportPipeline
+
+    if not args.output and not args.archive:
+        print("请通过 --output 或 --archive 指定输出位置")
+        return 1
+    if args.processes > 1 and (args.archive or args.dedupe or args.partial_jpeg):
+        print("--processes 不能与 --archive / --dedupe / --partial-jpeg 同时使用")
+        return 1
+    settings = load_settings(args)
+    if settings is None:
+        return 1
+    paths = _collect_paths(args.input)
+    if args.marked != "process":
+        paths = _filter_marked(paths, settings, args.marked, args.workers)
+    if args.archive:
+        os.makedirs(os.path.dirname(os.path.abspath(args.archive)), exist_ok=True)
+    else:
+        os.makedirs(args.output, exist_ok=True)
+
+    budget = int(args.memory_budget * 2 ** 20) if args.memory_budget else None
+    staged = StagedExportPipeline(ExportPipeline(partial_jpeg=args.partial_jpeg, color_policy=args.color),
+                                  read_depth=args.read_depth, write_depth=args.write_depth,
+                                  compute_workers=args.workers, memory_budget=budget)
+    plan = staged.plan(paths, args.format)
+    print(f"规划: {plan.summary()}")
+    if args.plan_only:
+        return 0
+
+    metrics = _open_metrics(args, "export", len(paths))
+    if args.processes > 1:
+        from core.process_pipeline import ProcessExportPipeline
+        results = ProcessExportPipeline(staged.pipeline, args.processes).run(
+            plan.order, settings, args.output, args.prefix, args.suffix, args.format, metrics=metrics)
+        if metrics is not None:
+            results = metrics.track(results)
+        return _print_summary(*_count_results(results))
+
+    sink = None
+    if args.archive:
+        volume_size = int(args.volume_size * 2 ** 20) if args.volume_size else None
+        sink = staged.pipeline.exporter.open_archive(args.archive, volume_size=volume_size)
+
+    results = staged.run(paths, settings, args.output, args.prefix, args.suffix, args.format,
+                         dedupe=args.dedupe, plan=plan, sink=sink, metrics=metrics)
+    if metrics is not None:
+        results = metrics.track(results)
+    ok, failed = _count_results(results)
+    if sink is not None:
+        try:
+            volumes = sink.close()
+        except Exception as e:
+            print(f"写入归档失败: {e}")
+            return 1
+        print(f"已写入归档: {', '.join(volumes)}")
+    return _print_summary(ok, failed)
+
+
+def _filter_marked(paths, settings, mode, workers):
+    """检查源图是否已带有当前水印：skip 时从列表中去掉，flag 时只列出"""
+    from core.mark_detection import MarkDetector
+    from core.watermark_engine import WatermarkEngine
+
+    kept = []
+    marked = 0
+    for path, score, is_marked in MarkDetector(WatermarkEngine()).scan(paths, settings, workers=max(2, workers)):
+        if is_marked:
+            marked += 1
+            print(f"{'跳过' if mode == 'skip' else '已有水印'}: {path}（匹配度 {score:.2f}）")
+            if mode == "skip":
+                continue
+        kept.append(path)
+    if marked:
+        print(f"{marked} 张图片已带有当前水印")
+    return kept
+
+
+def _count_results(results):
+    ok = failed = 0
+    for src, dst in results:
+        if dst:
+            ok += 1
+        else:
+            failed += 1
+            print(f"处理失败: {src}")
+    return ok, failed
+
+
+def _print_summary(ok, failed):
+    print(f"导出完成: {ok} 张成功, {failed} 张失败")
+    return 0 if failed == 0 else 1
+
+
+def _collect_paths(inputs):
+    from core.export_pipeline import is_image_file
+
+    paths = []
+    for root in inputs:
+        if os.path.isfile(root):
+            paths.append(root)
+            continue
+        for dirpath, _, filenames in os.walk(root):
+            paths.extend(os.path.join(dirpath, f) for f in sorted(filenames) if is_image_file(f))
+    return paths
+
+
+def cmd_renditions(args):
+    from core.renditions import RenditionExporter, load_profile
+
+    settings = load_settings(args)
+    if settings is None:
+        return 1
+    renditions = None
+    if args.profile:
+        renditions = load_profile(args.profile)
+        if not renditions:
+            return 1
+    exporter = RenditionExporter(renditions)
+    failed = 0
+    paths = _collect_paths(args.input)
+    for path in paths:
+        for name, dst in exporter.export(path, settings, args.output, args.prefix, args.suffix):
+            if not dst:
+                failed += 1
+                print(f"处理失败: {path} ({name})")
+    print(f"导出完成: {len(paths)} 张源图, {failed} 个规格失败")
+    return 0 if failed == 0 else 1
+
+
+def cmd_proofs(args):
+    from core.proof_sheet import ProofSheetBuilder, ProofSheetLayout
+
+    settings = load_settings(args)
+    if settings is None:
+        return 1
+    layout = ProofSheetLayout(columns=args.columns, rows=args.rows, tile=args.tile,
+                              label_size=0 if args.no_labels else 14)
+    paths = _collect_paths(args.input)
+    start = time.monotonic()
+    pages = failed = 0
+    for page, members in ProofSheetBuilder(layout).build(paths, settings, args.output, args.prefix,
+                                                         args.format, workers=args.workers):
+        if page:
+            pages += 1
+            print(f"已生成: {page}（{len(members)} 张）")
+        else:
+            failed += 1
+            print(f"写入小样页失败: {members[0]} 等 {len(members)} 张")
+    elapsed = time.monotonic() - start
+    print(f"小样完成: {len(paths)} 张图片, {pages} 页, {failed} 页失败, 用时 {elapsed:.1f} 秒")
+    return 0 if failed == 0 else 1
+
+
+def cmd_shard_create(args):
+    from core.shard_job import create_job
+
+    settings = load_settings(args)
+    if settings is None:
+        return 1
+    try:
+        manifest = create_job(args.job, args.input, args.output, settings,
+                              shard_size=args.shard_size, prefix=args.prefix,
+                              suffix=args.suffix, fmt=args.format,
+                              partial_jpeg=args.partial_jpeg, color_policy=args.color)
+    except FileExistsError as e:
+        print(e)
+        return 1
+    print(f"已创建作业: {manifest['total']} 张图片，{len(manifest['shards'])} 个分片")
+    return 0
+
+
+def cmd_shard_work(args):
+    from core.shard_job import ShardWorker, run_local_workers
+
+    if args.processes > 1:
+        counts = run_local_workers(args.job, args.processes)
+        print(f"本机 {args.processes} 个 worker 共处理 {sum(counts)} 个分片")
+        return 0
+    worker = ShardWorker(args.job, worker_id=args.worker_id, lease_timeout=args.lease_timeout)
+    count = worker.run(on_shard_done=lambda sid, n, failed: print(
+        f"分片 {sid} 完成: {n} 张成功, {len(failed)} 张失败"))
+    print(f"worker {worker.worker_id} 共处理 {count} 个分片")
+    return 0
+
+
+def cmd_shard_status(args):
+    from core.shard_job import job_status
+
+    status = job_status(args.job)
+    print(f"分片: {status['done']}/{status['shards']} 已完成, {status['in_progress']} 处理中, "
+          f"{status['pending']} 待处理")
+    print(f"图片: {status['processed']}/{status['images']} 已处理, {status['failed']} 失败")
+    return 0
+
+
+def cmd_job(args):
+    from core.job_spec import assign_files, load_job_spec, run_job
+
+    spec = load_job_spec(args.spec)
+    if spec is None:
+        return 1
+    if args.dry_run:
+        assigned, unmatched = assign_files(spec)
+        for rule in spec.rules:
+            print(f"{rule.describe()}: {len(assigned[rule.index])} 张 -> {rule.output}")
+        print(f"未匹配任何规则: {len(unmatched)} 张")
+        return 0
+
+    def on_result(rule, src, dst):
+        if not dst:
+            print(f"处理失败: {src}（{rule.describe()}）")
+
+    result = run_job(spec, workers=args.workers, dedupe=args.dedupe, on_result=on_result,
+                     metrics=_open_metrics(args, "job"))
+    print(f"作业完成: {result['processed']} 张成功, {result['failed']} 张失败, "
+          f"{result['unmatched']} 张未匹配任何规则")
+    return 0 if result["failed"] == 0 else 1
+
+
+def cmd_templates_import(args):
+    source = TemplateManager(args.source).templates
+    if not source:
+        print(f"没有可导入的模板: {args.source}")
+        return 1
+    if not TemplateManager(args.dest).import_templates(source):
+        return 1
+    print(f"已导入 {len(source)} 个模板到 {args.dest}")
+    return 0
+
+
+def cmd_serve(args):
+    from core.http_service import serve
+
+    serve(args.host, args.port, args.templates_file, args.workers, args.verbose)
+    return 0
+
+
+def cmd_detect(args):
+    from core.invisible_watermark import batch_detect
+
+    paths = _collect_paths(args.input)
+    found = 0
+    start = time.monotonic()
+    for path, payload, confidence in batch_detect(paths, args.key, args.workers):
+        if payload is not None:
+            found += 1
+            print(f"{path}\t{payload}\t置信度 {confidence:.2f}")
+        elif confidence is not None and args.verbose:
+            print(f"{path}\t未检测到\t置信度 {confidence:.2f}")
+    elapsed = max(time.monotonic() - start, 1e-6)
+    print(f"检测完成: {len(paths)} 张中 {found} 张带隐形水印（{len(paths) / elapsed * 60:.0f} 张/分钟）")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py", description="图片水印工具命令行")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("watch", help="监视文件夹，自动为新图片加水印")
+    p.add_argument("--input", action="append", required=True, help="监视的输入文件夹（可多次指定）")
+    p.add_argument("--output", required=True, help="输出文件夹")
+    p.add_argument("--interval", type=float, default=1.0, help="扫描间隔（秒）")
+    p.add_argument("--settle", type=float, default=2.0, help="文件保持不变多少秒后视为写入完成")
+    p.add_argument("--queue-size", type=int, default=16, help="工作队列容量")
+    p.add_argument("--workers", type=int, default=2, help="处理线程数")
+    p.add_argument("--skip-existing", action="store_true", help="忽略启动时已存在的文件")
+    _add_settings_args(p)
+    _add_export_args(p)
+    p.set_defaults(func=cmd_watch)
+
+    p = sub.add_parser("export", help="批量导出（读取/计算/写入流水线）")
+    p.add_argument("--input", action="append", required=True, help="输入文件或文件夹（可多次指定）")
+    p.add_argument("--output", help="输出文件夹")
+    p.add_argument("--archive", help="直接写入 ZIP/TAR 归档（.zip/.tar/.tar.gz），代替输出文件夹")
+    p.add_argument("--volume-size", type=float, help="归档分卷大小（MB）")
+    p.add_argument("--read-depth", type=int, default=4, help="读取阶段预读队列深度")
+    p.add_argument("--write-depth", type=int, default=4, help="写入阶段队列深度")
+    p.add_argument("--workers", type=int, default=1, help="计算阶段线程数")
+    p.add_argument("--processes", type=int, default=1,
+                   help="使用多进程（大于 1 时生效），像素经共享内存在解码/合成/编码进程间传递")
+    p.add_argument("--dedupe", action="store_true", help="内容相同的图片只处理一次")
+    p.add_argument("--marked", choices=["process", "skip", "flag"], default="process",
+                   help="源图已带有当前水印时：照常处理 / 跳过 / 只列出")
+    p.add_argument("--memory-budget", type=float, help="计算阶段内存预算（MB），超出时等待")
+    p.add_argument("--plan-only", action="store_true", help="只预扫描并输出耗时/内存估计，不导出")
+    _add_settings_args(p)
+    _add_export_args(p)
+    _add_metrics_args(p)
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("renditions", help="一次解码输出多个规格（原图/网页图/缩略图）")
+    p.add_argument("--input", action="append", required=True, help="输入文件或文件夹（可多次指定）")
+    p.add_argument("--output", required=True, help="输出文件夹，每个规格一个子文件夹")
+    p.add_argument("--profile", help="导出配置 JSON，默认 full / web(2048) / thumb(400)")
+    p.add_argument("--prefix", default="wm_", help="输出文件名前缀")
+    p.add_argument("--suffix", default="_watermarked", help="输出文件名后缀")
+    _add_settings_args(p)
+    p.set_defaults(func=cmd_renditions)
+
+    p = sub.add_parser("proofs", help="生成带水印缩略图的小样页（联系表）")
+    p.add_argument("--input", action="append", required=True, help="输入文件或文件夹（可多次指定）")
+    p.add_argument("--output", required=True, help="输出文件夹")
+    p.add_argument("--columns", type=int, default=6, help="每页列数")
+    p.add_argument("--rows", type=int, default=5, help="每页行数")
+    p.add_argument("--tile", type=int, default=320, help="缩略图格子边长（像素）")
+    p.add_argument("--prefix", default="proof_", help="页面文件名前缀")
+    p.add_argument("--format", default="JPEG", choices=["JPEG", "PNG"], help="页面格式")
+    p.add_argument("--no-labels", action="store_true", help="不在缩略图下标注文件名")
+    p.add_argument("--workers", type=int, help="缩略图解码线程数，默认 CPU 核数")
+    _add_settings_args(p)
+    p.set_defaults(func=cmd_proofs)
+
+    p = sub.add_parser("shard-create", help="创建分片批处理作业")
+    p.add_argument("--job", required=True, help="作业目录（位于共享文件系统）")
+    p.add_argument("--input", required=True, help="输入根目录")
+    p.add_argument("--output", required=True, help="输出根目录")
+    p.add_argument("--shard-size", type=int, default=1000, help="每个分片的图片数")
+    _add_settings_args(p)
+    _add_export_args(p)
+    p.set_defaults(func=cmd_shard_create)
+
+    p = sub.add_parser("shard-work", help="认领并处理分片，直到作业完成")
+    p.add_argument("--job", required=True, help="作业目录")
+    p.add_argument("--worker-id", help="worker 标识，默认 主机名-进程号")
+    p.add_argument("--lease-timeout", type=float, default=600, help="锁超时秒数，超时后可被其他 worker 接管")
+    p.add_argument("--processes", type=int, default=1, help="在本机启动的 worker 进程数")
+    p.set_defaults(func=cmd_shard_work)
+
+    p = sub.add_parser("shard-status", help="查看分片作业进度")
+    p.add_argument("--job", required=True, help="作业目录")
+    p.set_defaults(func=cmd_shard_status)
+
+    p = sub.add_parser("job", help="按作业文件把不同文件集套用不同模板，一次完成")
+    p.add_argument("--spec", required=True, help="作业文件（JSON）")
+    p.add_argument("--workers", type=int, default=1, help="计算阶段线程数")
+    p.add_argument("--dedupe", action="store_true", help="内容相同的图片只处理一次")
+    p.add_argument("--dry-run", action="store_true", help="只列出各规则匹配到的图片数量")
+    _add_metrics_args(p)
+    p.set_defaults(func=cmd_job)
+
+    p = sub.add_parser("templates-import", help="在模板存储之间复制模板（如 JSON → SQLite）")
+    p.add_argument("--from", dest="source", required=True, help="源模板文件（.json/.db）")
+    p.add_argument("--to", dest="dest", required=True, help="目标模板文件，.db/.sqlite 使用 SQLite 索引存储")
+    p.set_defaults(func=cmd_templates_import)
+
+    p = sub.add_parser("serve", help="启动本地 HTTP 水印服务")
+    p.add_argument("--host", default="127.0.0.1", help="监听地址")
+    p.add_argument("--port", type=int, default=8765, help="监听端口")
+    p.add_argument("--workers", type=int, default=4, help="常驻工作线程数")
+    p.add_argument("--templates-file", default="templates.json", help="模板文件路径")
+    p.add_argument("--verbose", action="store_true", help="输出每个请求的访问日志")
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser("detect", help="批量检测可疑图片中的隐形水印")
+    p.add_argument("--input", action="append", required=True, help="输入文件或文件夹（可多次指定）")
+    p.add_argument("--key", help="隐形水印密钥（与导出时的 --mark-key 相同）")
+    p.add_argument("--workers", type=int, help="检测进程数，默认 CPU 核数")
+    p.add_argument("--verbose", action="store_true", help="同时列出未检测到水印的图片")
+    p.set_defaults(func=cmd_detect)
+
+    return parser
+
+
+def run_cli(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(run_cli())
@@ -0,0 +1,190 @@
+"""
+多帧图片模块：动图 GIF / WebP 与多页 TIFF 逐帧加水印，边解码边写出。
+- 按需 seek 逐帧解码，Pillow 会按帧的处置方式（disposal）和调色板合成出完整画面
+- 每帧都贴同一个缓存的水印图层（位置相同，只渲染一次）
+- GIF：自带流式写出器，每帧单独量化为局部调色板后立即写入，透明像素映射为透明色索引
+- WebP / TIFF：把“源图 + 水印”包装成惰性多帧图像交给 Pillow 编码器，编码器每次 seek 时才生成该帧
+内存占用只与少数几帧相关，与总帧数无关。
+依赖：PIL.Image, core.watermark_engine
+"""
+import io
+import struct
+from PIL import Image
+
+# 保持动画/多页的输出格式 → 扩展名
+ANIMATED_FORMATS = {"GIF": ".gif", "WEBP": ".webp", "TIFF": ".tif"}
+
+GIF_TRANSPARENT_INDEX = 255
+GIF_ALPHA_THRESHOLD = 128
+# 整张画面输出，下一帧绘制前恢复为背景，透明区域不会残留上一帧的内容
+GIF_DISPOSAL_RESTORE_BACKGROUND = 2
+
+
+def frame_count(img):
+    return getattr(img, "n_frames", 1)
+
+
+def is_multi_frame(img):
+    """是否为需要逐帧处理的动图/多页图（is_animated 只检查是否存在第二帧，不遍历全部帧）"""
+    return getattr(img, "is_animated", False) and img.format in ANIMATED_FORMATS
+
+
+class StreamingGifWriter:
+    """
+    逐帧写出 GIF89a。Pillow 的 GIF 保存会先把所有帧留在内存里做帧间差分，这里每帧只编码一次即写出：
+    借用 Pillow 把单帧编码为 GIF，取出其中的 LZW 图像数据，并把全局调色板改写为该帧的局部调色板。
+    """
+
+    def __init__(self, fp, size, loop=0):
+        self.fp = fp
+        self.size = size
+        self.frames = 0
+        width, height = size
+        # 逻辑屏幕描述：无全局调色板，颜色深度 8 位
+        fp.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0x70, 0, 0))
+        if loop is not None:
+            fp.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+
+    @staticmethod
+    def _quantize(frame):
+        """RGBA → 最多 255 色的调色板图，半透明以下的像素映射到透明色索引"""
+        rgb = frame.convert("RGB")
+        alpha = frame.getchannel("A") if frame.mode == "RGBA" else None
+        transparent = alpha is not None and alpha.getextrema()[0] < GIF_ALPHA_THRESHOLD
+        pal = rgb.quantize(colors=255 if transparent else 256)
+        if transparent:
+            mask = alpha.point(lambda a: 255 if a < GIF_ALPHA_THRESHOLD else 0, "1")
+            pal.paste(GIF_TRANSPARENT_INDEX, (0, 0), mask)
+        return pal, transparent
+
+    @staticmethod
+    def _image_block(pal, transparent):
+        """用 Pillow 编码单帧，返回 (调色板字节, 调色板大小位, 交错标志, LZW 数据)"""
+        buf = io.BytesIO()
+        params = {"transparency": GIF_TRANSPARENT_INDEX} if transparent else {}
+        pal.save(buf, "GIF", optimize=False, **params)
+        data = buf.getvalue()
+        packed = data[10]
+        pos = 13
+        color_table = b""
+        table_bits = 0
+        if packed & 0x80:
+            table_bits = packed & 0x07
+            size = 3 * (2 ** (table_bits + 1))
+            color_table = data[pos:pos + size]
+            pos += size
+        while data[pos] == 0x21:  # 跳过扩展块（透明色等由本写出器重新生成）
+            pos += 2
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+        if data[pos] != 0x2C:
+            raise ValueError("无法解析 GIF 帧数据")
+        descriptor = data[pos:pos + 10]
+        pos += 10
+        if descriptor[9] & 0x80:  # Pillow 写出的是局部调色板
+            table_bits = descriptor[9] & 0x07
+            size = 3 * (2 ** (table_bits + 1))
+            color_table = data[pos:pos + size]
+            pos += size
+        start = pos
+        pos += 1  # LZW 最小码长
+        while data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+        return color_table, table_bits, descriptor[9] & 0x40, data[start:pos]
+
+    def add_frame(self, frame, duration=100):
+        if frame.size != self.size:
+            frame = frame.resize(self.size)
+        pal, transparent = self._quantize(frame)
+        color_table, table_bits, interlace, lzw = self._image_block(pal, transparent)
+        fp = self.fp
+        # 图形控制扩展：处置方式、延时（1/100 秒）、透明色
+        flags = (GIF_DISPOSAL_RESTORE_BACKGROUND << 2) | (1 if transparent else 0)
+        fp.write(struct.pack("<BBBBHBB", 0x21, 0xF9, 4, flags, max(0, round(duration / 10)),
+                             GIF_TRANSPARENT_INDEX if transparent else 0, 0))
+        # 图像描述符 + 局部调色板
+        fp.write(struct.pack("<BHHHHB", 0x2C, 0, 0, self.size[0], self.size[1],
+                             0x80 | interlace | table_bits))
+        fp.write(color_table)
+        fp.write(lzw)
+        self.frames += 1
+
+    def close(self):
+        self.fp.write(b"\x3b")
+
+
+class _WatermarkedFrames(Image.Image):
+    """
+    惰性的多帧图像：编码器 seek 到第 i 帧时才解码源图该帧并贴上水印。
+    durations 在 seek 时逐帧补齐，供 WebP 编码器读取每帧时长。
+    """
+
+    def __init__(self, source, render_frame):
+        super().__init__()
+        self._source = source
+        self._render_frame = render_frame
+        self.n_frames = frame_count(source)
+        self.durations = []
+        self._frame_index = -1
+        self.seek(0)
+
+    def seek(self, frame):
+        if frame == self._frame_index:
+            return
+        self._source.seek(frame)
+        # 先渲染（解码该帧）再读时长：WebP 插件在 load() 时才更新 info["duration"]
+        rendered = self._render_frame(self._source)
+        while len(self.durations) <= frame:
+            self.durations.append(self._source.info.get("duration", 100))
+        self.im = rendered.im
+        self._mode = rendered.mode
+        self._size = rendered.size
+        self._frame_index = frame
+
+    def tell(self):
+        return self._frame_index
+
+
+def iter_watermarked_frames(img, render_frame):
+    """逐帧产出 (加水印后的帧, 时长毫秒)，同一时刻只保留当前帧"""
+    i = 0
+    while True:
+        try:
+            img.seek(i)
+        except EOFError:
+            return
+        frame = render_frame(img)  # 解码后 info["duration"] 才是本帧的时长（WebP）
+        yield frame, img.info.get("duration", 100)
+        i += 1
+
+
+def save_watermarked_frames(img, fp, render_frame, fmt=None, **params):
+    """
+    把多帧源图逐帧加水印后写到 fp（文件路径或二进制文件对象）。
+    render_frame(当前帧) 返回加水印的 RGBA 图像；fmt 默认沿用源格式。
+    """
+    fmt = (fmt or img.format).upper()
+    loop = img.info.get("loop")  # 源文件没有循环设置（只播放一次）时为 None，GIF 不写 NETSCAPE 扩展
+    if fmt == "GIF":
+        close = isinstance(fp, str)
+        f = open(fp, "wb") if close else fp
+        try:
+            writer = StreamingGifWriter(f, img.size, loop)
+            for frame, duration in iter_watermarked_frames(img, render_frame):
+                writer.add_frame(frame, duration)
+            writer.close()
+        finally:
+            if close:
+                f.close()
+        return
+    frames = _WatermarkedFrames(img, render_frame)
+    if fmt == "WEBP":
+        params.setdefault("duration", frames.durations)
+        if loop is not None:
+            params.setdefault("loop", loop)
+    try:
+        frames.save(fp, format=fmt, save_all=True, **params)
+    finally:
+        img.seek(0)
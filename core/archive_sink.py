@@ -0,0 +1,162 @@
+"""
+归档输出模块：把已编码的图片字节直接流式写入 ZIP / TAR，不生成中间文件。
+- 多个编码线程并行调用 add()，由单独的写线程按顺序写入归档；条目真正写入（或失败）后，
+  在写线程中回调 on_written 报告最终位置，flush() 等待已提交的条目全部写完
+- 可按固定大小分卷，每一卷都是独立完整的归档（out.001.zip、out.002.zip ...）
+- 图片本身已压缩，ZIP 使用 STORED 方式避免无意义的二次压缩
+依赖：zipfile, tarfile
+"""
+import io
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+
+_CLOSE = object()
+
+
+def archive_kind(path):
+    """根据扩展名判断归档类型"""
+    lower = path.lower()
+    if lower.endswith(".zip"):
+        return "zip"
+    if lower.endswith((".tar", ".tar.gz", ".tgz")):
+        return "tar"
+    return None
+
+
+class ArchiveSink:
+    def __init__(self, path, kind=None, volume_size=None, queue_size=16):
+        self.path = path
+        self.kind = kind or archive_kind(path) or "zip"
+        self.volume_size = volume_size  # 字节，None 表示不分卷
+        self.volumes = []
+        self._queue = queue.Queue(max(1, queue_size))
+        self._error = None
+        self._names = set()
+        self._archive = None
+        self._volume_bytes = 0
+        self._thread = threading.Thread(target=self._writer_loop, name="archive-writer", daemon=True)
+        self._thread.start()
+
+    # ---------- 对外接口（任意线程） ----------
+    def add(self, name, data, on_written=None):
+        """
+        提交一个条目，队列满时阻塞（背压）。返回是否已提交（写线程已出错时为 False）。
+        条目写入后在写线程中调用 on_written("分卷路径:条目名")，写入失败或被丢弃时调用 on_written(None)。
+        """
+        if self._error is not None:
+            if on_written is not None:
+                on_written(None)
+            return False
+        self._queue.put((name, data, on_written))
+        return True
+
+    def flush(self):
+        """等待已提交的条目全部写完（各自的 on_written 都已调用）"""
+        if self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        """写完所有条目并关闭归档，返回各分卷路径；写入出错时抛出异常"""
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return list(self.volumes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ---------- 写线程 ----------
+    def _volume_path(self, index):
+        if self.volume_size is None:
+            return self.path
+        for ext in (".tar.gz", ".tgz", ".zip", ".tar"):
+            if self.path.lower().endswith(ext):
+                return f"{self.path[:-len(ext)]}.{index:03d}{self.path[-len(ext):]}"
+        return f"{self.path}.{index:03d}"
+
+    def _open_volume(self):
+        path = self._volume_path(len(self.volumes) + 1)
+        if self.kind == "zip":
+            self._archive = zipfile.ZipFile(path, "w", zipfile.ZIP_STORED, allowZip64=True)
+        else:
+            mode = "w:gz" if path.lower().endswith((".tar.gz", ".tgz")) else "w"
+            self._archive = tarfile.open(path, mode)
+        self.volumes.append(path)
+        self._volume_bytes = 0
+        self._names = set()
+
+    def _close_volume(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def _unique_name(self, name):
+        """同一卷内条目重名时追加序号"""
+        if name not in self._names:
+            return name
+        stem, ext = os.path.splitext(name)
+        i = 1
+        while f"{stem}_{i}{ext}" in self._names:
+            i += 1
+        return f"{stem}_{i}{ext}"
+
+    def _write_entry(self, name, data):
+        if self._archive is None:
+            self._open_volume()
+        elif (self.volume_size is not None and self._volume_bytes > 0
+              and self._volume_bytes + len(data) > self.volume_size):
+            self._close_volume()
+            self._open_volume()
+        name = self._unique_name(name)
+        self._names.add(name)
+        location = f"{self.volumes[-1]}:{name}"
+        now = time.time()
+        if self.kind == "zip":
+            info = zipfile.ZipInfo(name, time.localtime(now)[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            self._archive.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = now
+            self._archive.addfile(info, io.BytesIO(data))
+        self._volume_bytes += len(data)
+        return location
+
+    def _writer_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                self._queue.task_done()
+                break
+            name, data, on_written = item
+            location = None
+            # 出错后丢弃剩余条目，但继续消费队列避免生产者阻塞
+            if self._error is None:
+                try:
+                    location = self._write_entry(name, data)
+                except Exception as e:
+                    print(f"写入归档失败: {e}")
+                    self._error = e
+            try:
+                if on_written is not None:
+                    on_written(location)
+            finally:
+                self._queue.task_done()
+        try:
+            if self._archive is None and self._error is None:
+                self._open_volume()  # 没有任何条目时也生成一个空归档
+            self._close_volume()
+        except Exception as e:
+            print(f"关闭归档失败: {e}")
+            if self._error is None:
+                self._error = e
@@ -0,0 +1,257 @@
+"""
+批处理指标模块：批量导出（GUI 或命令行）运行期间定期把吞吐指标写成文件，供本机监控采集，
+应用内不开任何网络服务。
+- Prometheus 文本格式（.prom，可直接交给 node_exporter 的 textfile collector）与 JSON 摘要
+- 指标：已处理/失败张数、图片/秒、读写字节/秒（最近一段时间的速率与全程平均）、各队列深度、
+  各工作线程利用率、预计剩余时间
+- 文件先写临时文件再替换，采集方不会读到写了一半的内容
+- 流水线只做计数（加锁的整数加法），格式化与写文件都在单独的后台线程中按间隔进行
+依赖：threading, json
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_INTERVAL = 5.0
+RATE_WINDOW = 30.0  # 计算“当前速率”所用的时间窗口（秒）
+METRIC_PREFIX = "watermark"
+
+
+def default_metrics_dir():
+    """GUI 等未指定输出位置时使用的目录（可用环境变量 WATERMARK_METRICS_DIR 覆盖）"""
+    return os.environ.get("WATERMARK_METRICS_DIR", "metrics")
+
+
+def _write_atomic(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+        return True
+    except OSError as e:
+        print(f"写入指标文件失败: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class BatchMetrics:
+    def __init__(self, total=None, prom_path=None, json_path=None, interval=DEFAULT_INTERVAL, job="export"):
+        self.total = total
+        self.prom_path = prom_path
+        self.json_path = json_path
+        self.interval = interval
+        self.job = job
+        self._lock = threading.Lock()
+        self._processed = 0
+        self._failed = 0
+        self._bytes_read = 0
+        self._bytes_written = 0
+        self._gauges = {}       # 队列名 → 返回当前深度的函数
+        self._busy = {}         # 工作线程名 → 累计忙碌秒数
+        self._busy_since = {}   # 工作线程名 → 当前这次忙碌的开始时间
+        self._samples = deque()  # (时间, 已处理, 读字节, 写字节)，用于窗口速率
+        self._started = None
+        self._finished = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def for_directory(cls, folder, job="export", total=None, interval=DEFAULT_INTERVAL):
+        """在 folder 下写 watermark_<job>.prom 与 watermark_<job>.json"""
+        os.makedirs(folder, exist_ok=True)
+        base = os.path.join(folder, f"{METRIC_PREFIX}_{job}")
+        return cls(total, base + ".prom", base + ".json", interval, job)
+
+    # ---------- 计数（流水线各阶段调用） ----------
+    def add_read(self, n):
+        with self._lock:
+            self._bytes_read += n
+
+    def add_written(self, n):
+        with self._lock:
+            self._bytes_written += n
+
+    def record(self, dst):
+        """一张图片完成，dst 为输出路径或 None（失败）"""
+        with self._lock:
+            if dst:
+                self._processed += 1
+            else:
+                self._failed += 1
+
+    def add_total(self, n):
+        with self._lock:
+            self.total = (self.total or 0) + n
+
+    def gauge(self, name, fn):
+        """登记一个队列深度（fn 返回当前值）"""
+        with self._lock:
+            self._gauges[name] = fn
+
+    def remove_gauge(self, name):
+        with self._lock:
+            self._gauges.pop(name, None)
+
+    @contextmanager
+    def busy(self, worker):
+        """with 块内计为该工作线程忙碌"""
+        start = time.monotonic()
+        with self._lock:
+            self._busy.setdefault(worker, 0.0)
+            self._busy_since[worker] = start
+        try:
+            yield
+        finally:
+            end = time.monotonic()
+            with self._lock:
+                self._busy[worker] += end - start
+                self._busy_since.pop(worker, None)
+
+    # ---------- 汇总 ----------
+    def snapshot(self):
+        """当前全部指标（dict）"""
+        now = time.monotonic()
+        with self._lock:
+            started = self._started if self._started is not None else now
+            end = self._finished if self._finished is not None else now
+            elapsed = max(end - started, 1e-6)
+            done = self._processed + self._failed
+            counters = (self._processed, self._bytes_read, self._bytes_written)
+            self._samples.append((now, *counters))
+            while len(self._samples) > 2 and now - self._samples[0][0] > RATE_WINDOW:
+                self._samples.popleft()
+            first = self._samples[0]
+            window = now - first[0]
+            utilization = {}
+            for worker, busy in self._busy.items():
+                since = self._busy_since.get(worker)
+                busy += (now - since) if since is not None else 0.0
+                utilization[worker] = min(1.0, busy / elapsed)
+            gauges = dict(self._gauges)
+            finished = self._finished is not None
+            total = self.total
+            failed = self._failed
+        queues = {}
+        for name, fn in gauges.items():
+            try:
+                queues[name] = fn()
+            except Exception:
+                continue
+        if window >= 1.0 and not finished:
+            rates = [(c - f) / window for c, f in zip(counters, first[1:])]
+        else:
+            rates = [c / elapsed for c in counters]
+        eta = None
+        if total is not None and not finished:
+            remaining = max(0, total - done)
+            eta = remaining / rates[0] if rates[0] > 0 else None
+        return {
+            "job": self.job,
+            "running": not finished,
+            "elapsed_seconds": round(elapsed, 3),
+            "images_total": total,
+            "images_processed": counters[0],
+            "images_failed": failed,
+            "bytes_read": counters[1],
+            "bytes_written": counters[2],
+            "images_per_second": round(rates[0], 3),
+            "read_bytes_per_second": round(rates[1], 1),
+            "written_bytes_per_second": round(rates[2], 1),
+            "average_images_per_second": round(counters[0] / elapsed, 3),
+            "queue_depth": queues,
+            "worker_utilization": {k: round(v, 3) for k, v in utilization.items()},
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "updated_at": time.time(),
+        }
+
+    def prometheus_text(self, snap=None):
+        """Prometheus 文本格式"""
+        snap = snap or self.snapshot()
+        job = f'job="{_escape_label(snap["job"])}"'
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            full = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f"{full}{{{','.join([job, *labels])}}} {value}")
+
+        metric("images_processed_total", "counter", "Images exported successfully.",
+               [((), snap["images_processed"])])
+        metric("images_failed_total", "counter", "Images that failed to export.", [((), snap["images_failed"])])
+        metric("images_planned", "gauge", "Images in the batch.", [((), snap["images_total"])])
+        metric("bytes_read_total", "counter", "Source bytes read.", [((), snap["bytes_read"])])
+        metric("bytes_written_total", "counter", "Output bytes written.", [((), snap["bytes_written"])])
+        metric("images_per_second", "gauge", "Recent export rate.", [((), snap["images_per_second"])])
+        metric("read_bytes_per_second", "gauge", "Recent read throughput.", [((), snap["read_bytes_per_second"])])
+        metric("written_bytes_per_second", "gauge", "Recent write throughput.",
+               [((), snap["written_bytes_per_second"])])
+        metric("queue_depth", "gauge", "Items waiting in each pipeline queue.",
+               [((f'queue="{_escape_label(k)}"',), v) for k, v in snap["queue_depth"].items()])
+        metric("worker_utilization", "gauge", "Fraction of batch time each worker was busy.",
+               [((f'worker="{_escape_label(k)}"',), v) for k, v in snap["worker_utilization"].items()])
+        metric("eta_seconds", "gauge", "Estimated seconds until the batch finishes.", [((), snap["eta_seconds"])])
+        metric("elapsed_seconds", "gauge", "Seconds since the batch started.", [((), snap["elapsed_seconds"])])
+        metric("batch_running", "gauge", "1 while the batch is running.", [((), int(snap["running"]))])
+        metric("last_update_timestamp_seconds", "gauge", "Unix time of this snapshot.",
+               [((), round(snap["updated_at"], 3))])
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """立即写出一次指标文件"""
+        if not self.prom_path and not self.json_path:
+            return
+        snap = self.snapshot()
+        if self.prom_path:
+            _write_atomic(self.prom_path, self.prometheus_text(snap))
+        if self.json_path:
+            _write_atomic(self.json_path, json.dumps(snap, ensure_ascii=False, indent=2))
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        """开始计时并启动定期写出线程"""
+        with self._lock:
+            if self._started is None:
+                self._started = time.monotonic()
+        if self._thread is None and (self.prom_path or self.json_path):
+            self._thread = threading.Thread(target=self._loop, name="batch-metrics", daemon=True)
+            self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        """结束批次：停止后台线程并写出最终结果"""
+        with self._lock:
+            if self._finished is None:
+                self._finished = time.monotonic()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def track(self, results):
+        """包装 (源路径, 输出路径) 结果迭代器：逐张计数，迭代结束时写出最终结果"""
+        self.start()
+        try:
+            for item in results:
+                self.record(item[1])
+                yield item
+        finally:
+            self.stop()
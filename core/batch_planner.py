@@ -0,0 +1,129 @@
+"""
+批处理规划模块：只读取图片文件头（尺寸、模式、格式），不解码像素，
+估算每张图片的峰值内存与处理耗时，在内存预算下安排并行处理顺序，
+并在导出开始前给出总耗时和峰值内存的估计。
+依赖：PIL.Image
+"""
+import threading
+from PIL import Image
+
+# PIL 内部每像素字节数（RGB 也按 4 字节存储）
+MODE_BYTES = {"1": 1, "L": 1, "P": 1, "LA": 4, "PA": 4, "I;16": 2, "I": 4, "F": 4,
+              "RGB": 4, "RGBA": 4, "RGBX": 4, "CMYK": 4, "YCbCr": 4, "LAB": 4, "HSV": 4}
+
+# 加水印流程中同时存在的 RGBA 整图：转换结果、副本、文字图层、合成结果
+PIPELINE_BYTES_PER_PIXEL = 16
+
+# 经验耗时（秒 / 百万像素），包含解码、合成与编码
+SECONDS_PER_MEGAPIXEL = {"PNG": 0.12, "JPEG": 0.05}
+SECONDS_PER_IMAGE = 0.005
+
+
+def scan_header(path):
+    """只读文件头，返回 {path, width, height, mode, format}，失败返回 None"""
+    try:
+        with Image.open(path) as im:
+            return {"path": path, "width": im.width, "height": im.height,
+                    "mode": im.mode, "format": im.format}
+    except Exception as e:
+        print(f"读取图片信息失败: {path}: {e}")
+        return None
+
+
+def estimate_job(header, fmt="PNG"):
+    """估算单张图片的峰值内存（字节）与耗时（秒）"""
+    pixels = header["width"] * header["height"]
+    memory = pixels * (MODE_BYTES.get(header["mode"], 4) + PIPELINE_BYTES_PER_PIXEL)
+    seconds = SECONDS_PER_IMAGE + pixels / 1e6 * SECONDS_PER_MEGAPIXEL.get(fmt, 0.1)
+    return memory, seconds
+
+
+class BatchPlan:
+    """规划结果：处理顺序（大图优先）、各任务估计，以及总耗时/峰值内存估计"""
+
+    def __init__(self, jobs, unreadable, workers, memory_budget, total_seconds, peak_memory):
+        self.jobs = jobs              # [{path, width, height, mode, format, memory, seconds}]
+        self.unreadable = unreadable  # 无法读取文件头的路径
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.total_seconds = total_seconds
+        self.peak_memory = peak_memory
+
+    @property
+    def order(self):
+        return [job["path"] for job in self.jobs] + self.unreadable
+
+    def summary(self):
+        return (f"{len(self.jobs)} 张图片，预计耗时 {self.total_seconds:.1f} 秒，"
+                f"峰值内存约 {self.peak_memory / 2 ** 20:.0f} MB")
+
+
+def plan_batch(paths, workers=1, memory_budget=None, fmt="PNG", progress=None):
+    """
+    预扫描并规划批处理（progress 为每读完一个文件头调用一次的 progress(已扫描张数)，供界面刷新）：
+    - 任务按峰值内存从大到小排序（大图先跑，避免最后只剩一张大图单独拖尾）
+    - 模拟 workers 个并行槽位在 memory_budget（字节，None 表示不限）下的调度，
+      得到总耗时与峰值内存估计
+    """
+    jobs = []
+    unreadable = []
+    for i, path in enumerate(paths, start=1):
+        header = scan_header(path)
+        if progress is not None:
+            progress(i)
+        if header is None:
+            unreadable.append(path)
+            continue
+        header["memory"], header["seconds"] = estimate_job(header, fmt)
+        jobs.append(header)
+    jobs.sort(key=lambda j: (j["memory"], j["seconds"]), reverse=True)
+
+    workers = max(1, workers)
+    pending = list(jobs)
+    running = []  # [(结束时间, 内存)]
+    now = 0.0
+    used = peak = 0
+    while pending or running:
+        # 按顺序启动放得下的任务；没有任务在运行时超预算的大图也允许单独运行
+        i = 0
+        while i < len(pending) and len(running) < workers:
+            job = pending[i]
+            if memory_budget is None or used + job["memory"] <= memory_budget or not running:
+                running.append((now + job["seconds"], job["memory"]))
+                used += job["memory"]
+                peak = max(peak, used)
+                pending.pop(i)
+            else:
+                i += 1
+        running.sort()
+        end, memory = running.pop(0)
+        now = end
+        used -= memory
+    return BatchPlan(jobs, unreadable, workers, memory_budget, now, peak)
+
+
+class MemoryBudget:
+    """
+    运行时内存预算：处理前 acquire 估计的内存，处理完 release。
+    预算不足时等待；单个任务超过整个预算时等到没有其他任务在运行再执行。
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, amount, stop_event=None):
+        with self._cond:
+            while self.used > 0 and self.used + amount > self.budget:
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                self._cond.wait(0.2)
+            self.used += amount
+            return True
+
+    def release(self, amount):
+        with self._cond:
+            self.used -= amount
+            self._cond.notify_all()
+
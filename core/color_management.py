@@ -0,0 +1,169 @@
+"""
+色彩管理模块：按嵌入的 ICC 配置文件处理广色域（Adobe RGB / Display P3 等）图片。
+- keep：保留原配置文件与像素，导出时写回配置文件；水印颜色（按 sRGB 选取）换算到图片的色彩空间
+- srgb：把像素转换到 sRGB 并标记 sRGB 配置文件，水印颜色直接使用
+- 带配置文件的 CMYK / 灰度图片加载时按配置文件转换到 sRGB，而不是 PIL 的简单公式
+  （像素统一为 RGBA 后无法再保留非 RGB 的配置文件）；导出时只写入与输出模式色彩空间一致的配置文件
+ImageCms 变换构建开销较大，按 (源配置文件, 目标配置文件, 输入模式, 输出模式) 缓存，
+同一相机拍摄的一批照片每种变换只构建一次；构建失败的结果同样缓存，不会对每张图片重复尝试和报错。
+依赖：PIL.ImageCms
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageCms
+
+COLOR_POLICIES = ("keep", "srgb")
+TRANSFORM_CACHE_SIZE = 32
+
+_SRGB_PROFILE = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB"))
+SRGB_ICC = _SRGB_PROFILE.tobytes()
+
+
+# 图片模式 → 配置文件应有的色彩空间
+MODE_COLOR_SPACES = {"L": "GRAY", "LA": "GRAY", "RGB": "RGB", "RGBA": "RGB", "P": "RGB", "CMYK": "CMYK"}
+
+_FAILED = object()
+_color_spaces = {}
+
+
+def _profile_id(icc):
+    return hashlib.sha1(icc).digest()
+
+
+def profile_color_space(icc):
+    """配置文件描述的色彩空间（"RGB" / "GRAY" / "CMYK" 等），无法解析时返回 None"""
+    pid = _profile_id(icc)
+    space = _color_spaces.get(pid, _FAILED)
+    if space is _FAILED:
+        try:
+            space = ImageCms.ImageCmsProfile(io.BytesIO(icc)).profile.xcolor_space.strip() or None
+        except Exception:
+            space = None
+        _color_spaces[pid] = space
+    return space
+
+
+def icc_matches_mode(icc, mode):
+    """配置文件能否随该模式的像素写出（色彩空间一致）"""
+    return MODE_COLOR_SPACES.get(mode) == profile_color_space(icc)
+
+
+class ColorManager:
+    def __init__(self, policy="keep"):
+        if policy not in COLOR_POLICIES:
+            raise ValueError(f"未知的色彩策略: {policy}")
+        self.policy = policy
+        self._profiles = {}
+        self._transforms = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0  # 实际构建的变换数（用于确认缓存命中）
+
+    # ---------- 配置文件与变换缓存 ----------
+    def _profile(self, icc):
+        pid = _profile_id(icc)
+        profile = self._profiles.get(pid)
+        if profile is None:
+            profile = ImageCms.ImageCmsProfile(io.BytesIO(icc))
+            self._profiles[pid] = profile
+        return pid, profile
+
+    def transform(self, src_icc, dst_icc, in_mode, out_mode):
+        """获取（缓存的）变换；配置文件无效时返回 None"""
+        key = (_profile_id(src_icc), _profile_id(dst_icc), in_mode, out_mode)
+        with self._lock:
+            cached = self._transforms.get(key)
+            if cached is not None:
+                self._transforms.move_to_end(key)
+                return None if cached is _FAILED else cached
+        try:
+            _, src = self._profile(src_icc)
+            _, dst = self._profile(dst_icc)
+            built = ImageCms.buildTransform(src, dst, in_mode, out_mode)
+        except Exception as e:
+            print(f"构建色彩变换失败: {e}")
+            built = _FAILED
+        with self._lock:
+            self._transforms[key] = built
+            self.builds += 1
+            while len(self._transforms) > TRANSFORM_CACHE_SIZE:
+                self._transforms.popitem(last=False)
+        return None if built is _FAILED else built
+
+    # ---------- 像素与颜色 ----------
+    def to_srgb(self, img, icc=None):
+        """按配置文件把图片转换到 sRGB 并标记 sRGB；没有配置文件或转换失败时原样返回"""
+        icc = icc or img.info.get("icc_profile")
+        if not icc or icc == SRGB_ICC:
+            return img
+        space = profile_color_space(icc)
+        alpha = img.getchannel("A") if "A" in img.getbands() else None
+        if space == "GRAY":
+            # 灰度配置文件只能变换单通道像素（已转为 RGB(A) 的灰度图三个通道相同，取亮度即可）
+            in_mode, out_mode = "L", "RGB"
+        elif space == "CMYK":
+            in_mode, out_mode = "CMYK", "RGB"
+        else:
+            in_mode = out_mode = "RGBA" if alpha is not None else "RGB"
+            alpha = None
+        src = img if img.mode == in_mode else img.convert(in_mode)
+        t = self.transform(icc, SRGB_ICC, in_mode, out_mode)
+        if t is None:
+            return img
+        converted = ImageCms.applyTransform(src, t)
+        if alpha is not None:
+            converted.putalpha(alpha)
+        converted.info = dict(img.info)
+        converted.info["icc_profile"] = SRGB_ICC
+        return converted
+
+    def color_in_profile(self, color, icc):
+        """把 sRGB 颜色 (r, g, b[, a]) 换算到 icc 所描述的色彩空间，alpha 不变"""
+        if not icc or icc == SRGB_ICC or color is None:
+            return color
+        t = self.transform(SRGB_ICC, icc, "RGB", "RGB")
+        if t is None:
+            return color
+        r, g, b = ImageCms.applyTransform(Image.new("RGB", (1, 1), tuple(color[:3])), t).getpixel((0, 0))
+        return (r, g, b, *color[3:])
+
+    def adjust_settings(self, settings, icc):
+        """keep 策略下把水印颜色换算到图片的色彩空间"""
+        if self.policy != "keep" or not icc or not settings or settings.get("color") is None:
+            return settings
+        if profile_color_space(icc) != "RGB":
+            return settings  # 非 RGB 配置文件的图片加载时已转换到 sRGB
+        adjusted = dict(settings)
+        adjusted["color"] = self.color_in_profile(settings["color"], icc)
+        return adjusted
+
+    def prepare(self, img, settings):
+        """按策略处理图片与水印设置，返回 (图片, 设置)；导出时写入图片 info 中的配置文件"""
+        icc = img.info.get("icc_profile")
+        if not icc:
+            return img, settings
+        if self.policy == "srgb":
+            return self.to_srgb(img, icc), settings
+        return img, self.adjust_settings(settings, icc)
+
+
+_default_manager = None
+_default_lock = threading.Lock()
+
+
+def default_color_manager():
+    """进程内共享的实例（加载阶段使用，变换缓存在所有调用间共享）"""
+    global _default_manager
+    with _default_lock:
+        if _default_manager is None:
+            _default_manager = ColorManager()
+        return _default_manager
+
+
+def to_rgba(img):
+    """转换为 RGBA：带非 RGB 配置文件（CMYK / 灰度）的图片先按配置文件转换到 sRGB"""
+    icc = img.info.get("icc_profile")
+    if icc and profile_color_space(icc) != "RGB":
+        img = default_color_manager().to_srgb(img, icc)
+    return img.convert("RGBA")
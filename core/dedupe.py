@@ -0,0 +1,80 @@
+"""
+源图片去重模块：按内容指纹把同一批次中的重复图片分组。
+三级比较，尽量少读文件：
+1. 文件大小（只需 stat）
+2. 大小相同时：大小 + 头/中/尾采样的哈希
+3. 采样哈希也相同时：完整内容哈希
+依赖：hashlib
+"""
+import hashlib
+import os
+
+SAMPLE_SIZE = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+def sampled_hash(path, size=None):
+    """读取头、中、尾三段采样计算哈希；小文件直接计算完整哈希"""
+    if size is None:
+        size = os.path.getsize(path)
+    if size <= SAMPLE_SIZE * 3:
+        return full_hash(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(size.to_bytes(8, "little"))
+    with open(path, "rb") as f:
+        for offset in (0, (size - SAMPLE_SIZE) // 2, size - SAMPLE_SIZE):
+            f.seek(offset)
+            h.update(f.read(SAMPLE_SIZE))
+    return h.hexdigest()
+
+
+def full_hash(path):
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _split_by(paths, key_func):
+    buckets = {}
+    for p in paths:
+        try:
+            key = key_func(p)
+        except OSError as e:
+            print(f"读取文件失败: {p}: {e}")
+            key = ("error", p)  # 无法读取的文件单独成组
+        buckets.setdefault(key, []).append(p)
+    return list(buckets.values())
+
+
+def group_duplicates(paths):
+    """
+    把内容相同的文件分组。
+    返回 [[代表文件, 重复文件...], ...]，组和组内顺序都保持输入顺序，
+    每个代表文件只需处理一次。
+    """
+    order = {p: i for i, p in enumerate(paths)}
+    sizes = {}
+    for p in paths:
+        try:
+            sizes[p] = os.path.getsize(p)
+        except OSError:
+            sizes[p] = -order[p] - 1  # 不可读文件不与任何文件合并
+
+    groups = []
+    for same_size in _split_by(paths, lambda p: sizes[p]):
+        if len(same_size) == 1:
+            groups.append(same_size)
+            continue
+        for same_sample in _split_by(same_size, lambda p: sampled_hash(p, sizes[p])):
+            if len(same_sample) == 1 or sizes[same_sample[0]] <= SAMPLE_SIZE * 3:
+                # 小文件的采样哈希即完整哈希，无需再算
+                groups.append(same_sample)
+            else:
+                groups.extend(_split_by(same_sample, full_hash))
+
+    for g in groups:
+        g.sort(key=order.get)
+    groups.sort(key=lambda g: order[g[0]])
+    return groups
@@ -0,0 +1,190 @@
+"""
+导出流水线模块：把 ImageLoader → WatermarkEngine → Exporter 串成单张图片的处理流程，
+供 GUI 批量导出、监视文件夹模式和命令行共用。
+依赖：PIL.Image, core.animation, core.color_management, core.image_loader, core.watermark_engine, core.exporter, core.dedupe, core.jpeg_patch,
+      core.invisible_watermark, core.metadata
+"""
+import io
+import os
+from PIL import Image
+from core.color_management import ColorManager
+from core.animation import ANIMATED_FORMATS, is_multi_frame, save_watermarked_frames
+from core.dedupe import group_duplicates
+from core.invisible_watermark import embed as embed_invisible
+from core.jpeg_patch import patch_jpeg, JpegPatchError
+from core.metadata import capture_metadata
+from core.image_loader import ImageLoader
+from core.watermark_engine import WatermarkEngine
+from core.exporter import Exporter
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tiff", ".tif", ".gif", ".webp")
+
+# 输出格式 → 扩展名
+FORMAT_EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", **ANIMATED_FORMATS}
+
+
+def is_image_file(path):
+    """按扩展名判断是否为支持的图片文件"""
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def normalize_settings(settings):
+    """
+    把面板设置或模板整理为引擎使用的格式：
+    - 颜色统一为 (r, g, b, a)，a 由透明度计算（与主窗口 qcolor_to_rgba 一致）
+    - 缺省字体回退为 SimHei
+    """
+    settings = dict(settings or {})
+    opacity = settings.get("opacity", 1.0)
+    color = settings.get("color")
+    if color is not None and len(color) >= 3:
+        settings["color"] = (color[0], color[1], color[2], int(255 * opacity))
+    else:
+        settings["color"] = (255, 255, 255, int(255 * opacity))
+    if not settings.get("font_family"):
+        settings["font_family"] = "SimHei"
+    return settings
+
+
+class ExportPipeline:
+    """单张图片的 加载 → 加水印 → 保存 流程"""
+
+    def __init__(self, image_loader=None, watermark_engine=None, exporter=None, partial_jpeg=False,
+                 keep_animation=True, color_policy="keep"):
+        self.image_loader = image_loader or ImageLoader()
+        self.watermark_engine = watermark_engine or WatermarkEngine()
+        self.exporter = exporter or Exporter()
+        # JPEG → JPEG 时只重编码水印区域的 MCU（源文件不满足条件时自动回退为整图编码）
+        self.partial_jpeg = partial_jpeg
+        # 动图/多页图逐帧加水印并保持原格式（扩展名随之改变），否则只导出第一帧
+        self.keep_animation = keep_animation
+        # 带 ICC 配置文件的图片：keep 保留配置文件（水印颜色换算到图片色彩空间），srgb 转换到 sRGB
+        self.color = ColorManager(color_policy)
+
+    def build_output_path(self, path, folder, prefix="wm_", suffix="_watermarked", fmt="PNG"):
+        """根据原图路径生成输出路径：<前缀><原文件名><后缀>.<扩展名>"""
+        name = os.path.splitext(os.path.basename(path))[0]
+        ext = FORMAT_EXTENSIONS.get(fmt, ".jpg")
+        return os.path.join(folder, f"{prefix}{name}{suffix}{ext}")
+
+    def render(self, img, settings, fmt="PNG"):
+        """给已加载的图片加水印，并转换为目标格式可保存的模式；设置了隐形水印但无法嵌入时返回 None"""
+        img, settings = self.color.prepare(img, settings)
+        watermarked = self.watermark_engine.add_text_watermark(img, settings.get("text", ""), settings=settings)
+        if settings.get("invisible_mark"):
+            watermarked = embed_invisible(watermarked, settings["invisible_mark"], settings.get("invisible_key"))
+            if watermarked is None:
+                return None  # 不导出缺少溯源标记的图片
+        if fmt == "JPEG" and watermarked.mode == "RGBA":
+            watermarked = watermarked.convert("RGB")
+        return watermarked
+
+    def animated_output_format(self, src):
+        """多帧源图需要保持动画/多页时返回输出格式（即源格式），否则返回 None"""
+        if self.keep_animation and src is not None and is_multi_frame(src):
+            return src.format
+        return None
+
+    def encode_animated(self, src, settings, fp, **params):
+        """逐帧加水印并流式写出多帧源图，fp 为路径或二进制文件对象（不嵌入隐形水印：GIF 调色板量化会把它抹掉）"""
+        text = settings.get("text", "")
+        engine = self.watermark_engine
+        if settings.get("auto_position"):
+            # 各帧使用同一位置（按第一帧选出），避免水印在帧间跳动
+            src.seek(0)
+            first = src.convert("RGBA")
+            settings = engine.placement_settings(first, engine.resolve_settings(src.size, settings), text)
+        save_watermarked_frames(
+            src, fp, lambda frame: engine.add_text_watermark(frame.convert("RGBA"), text, settings=settings),
+            **params)
+
+    def process(self, path, settings, folder, prefix="wm_", suffix="_watermarked", fmt="PNG"):
+        """处理单张图片，成功返回输出路径，失败返回 None"""
+        save_path = self.build_output_path(path, folder, prefix, suffix, fmt)
+        if self.partial_jpeg and fmt == "JPEG" and path.lower().endswith((".jpg", ".jpeg")):
+            data = self._patch_jpeg(path, settings)
+            if data is not None:
+                return save_path if self.exporter.save_bytes(data, save_path) else None
+
+        src = self.image_loader.open_image(path)
+        anim_fmt = self.animated_output_format(src)
+        if anim_fmt:
+            save_path = self.build_output_path(path, folder, prefix, suffix, anim_fmt)
+            try:
+                self.encode_animated(src, settings, save_path)
+                return save_path
+            except Exception as e:
+                print(f"保存图片失败: {e}")
+                return None
+            finally:
+                src.close()
+        if src is not None:
+            src.close()
+
+        img = self.image_loader.load_image(path)
+        if img is None:
+            return None
+        watermarked = self.render(img, settings, fmt)
+        if watermarked is None or not self.exporter.save_image(watermarked, save_path):
+            return None
+        return save_path
+
+    def _patch_jpeg(self, path, settings):
+        """尝试局部重编码 JPEG，不适用时返回 None"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        return self.patch_jpeg_bytes(data, settings)
+
+    def patch_jpeg_bytes(self, data, settings):
+        """对内存中的 JPEG 字节做局部重编码，不适用时返回 None"""
+        text = settings.get("text", "")
+        if not text or settings.get("invisible_mark"):
+            return None  # 隐形水印要改动整张图片，回退为整图编码
+        engine = self.watermark_engine
+        try:
+            # 只读文件头：相对字号需要图片尺寸，水印颜色需要换算到图片的色彩空间
+            with Image.open(io.BytesIO(data)) as im:
+                icc = im.info.get("icc_profile")
+                if icc and self.color.policy == "srgb":
+                    return None  # 需要转换整张图片的像素，回退为整图编码
+                meta = capture_metadata(im)
+                if meta and meta.orientation != 1:
+                    return None  # 需要转正像素，回退为整图编码
+                size = im.size
+                settings = engine.resolve_settings(size, self.color.adjust_settings(settings, icc))
+                if settings.get("auto_contrast") or settings.get("auto_position"):
+                    # 自动摆放/对比度只需要低分辨率的像素：按 1/8 尺寸 draft 解码（只解 DC 系数）
+                    im.draft("RGB", (max(1, size[0] // 8), max(1, size[1] // 8)))
+                    settings = engine.placement_settings(im, settings, text, full_size=size)
+                    settings = engine.contrast_settings(im, settings, text, full_size=size)
+            sprite = engine.get_sprite(text, settings)
+            return patch_jpeg(
+                data, sprite,
+                lambda size: engine.get_watermark_position(size, sprite.size, settings=settings),
+                engine.composite_sprite,
+            )
+        except (JpegPatchError, OSError):
+            return None
+
+    def iter_export(self, paths, settings, folder, prefix="wm_", suffix="_watermarked", fmt="PNG",
+                    dedupe=False, hard_link=True):
+        """
+        批量导出，逐张产出 (源路径, 输出路径或 None)。
+        dedupe=True 时内容相同的源图片只处理一次，其余副本通过硬链接/复制得到。
+        """
+        groups = group_duplicates(paths) if dedupe else [[p] for p in paths]
+        for group in groups:
+            primary = group[0]
+            save_path = self.process(primary, settings, folder, prefix, suffix, fmt)
+            yield primary, save_path
+            for dup in group[1:]:
+                dup_path = self.build_output_path(dup, folder, prefix, suffix, fmt)
+                if save_path and dup_path != save_path:
+                    if not self.exporter.link_or_copy(save_path, dup_path, hard_link):
+                        dup_path = None
+                elif not save_path:
+                    dup_path = None
+                yield dup, dup_path
@@ -1,13 +1,119 @@
 """
-图片导出模块，负责保存图片到本地。
-依赖：PIL.Image
+图片导出模块，负责保存图片到本地或写入归档。
+图片 info 中带有加载时取出的元数据原始字节（raw_metadata）时，编码后原样拼接进输出文件。
+大尺寸 PNG 在多核机器上用 core.png_writer 分段并行压缩。
+依赖：PIL.Image, core.archive_sink, core.color_management, core.metadata, core.png_writer
 """
+import io
+import os
+import shutil
+import threading
+from PIL import Image
+from core.archive_sink import ArchiveSink
+from core.color_management import icc_matches_mode
+from core.metadata import splice_metadata
+from core.png_writer import PARALLEL_PNG_MIN_PIXELS, can_write, save_png
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
 class Exporter:
-    def save_image(self, img, path):
-        """保存PIL图片到指定路径"""
+    def __init__(self, png_workers=None):
+        # 并行 PNG 压缩的线程数，默认 CPU 核数；为 1 时始终使用 Pillow
+        self.png_workers = png_workers or os.cpu_count() or 1
+
+    def _parallel_png(self, img, fmt, params):
+        return (fmt == "PNG" and self.png_workers > 1 and img.width * img.height >= PARALLEL_PNG_MIN_PIXELS
+                and can_write(img, params))
+
+    def _save(self, img, fp, fmt, params):
+        params = self._with_icc(img, params)
+        if self._parallel_png(img, fmt, params):
+            save_png(img, fp, workers=self.png_workers, **params)
+        else:
+            img.save(fp, format=fmt, **params)
+
+    @staticmethod
+    def _with_icc(img, params):
+        """
+        图片带 ICC 配置文件时随文件写出（JPEG/WebP 等不会自动写入）；
+        配置文件的色彩空间与像素模式不一致（如 RGB 像素配灰度配置文件）时不写入，按未标记的 sRGB 处理
+        """
+        icc = params.get("icc_profile", img.info.get("icc_profile"))
+        if not icc:
+            return params
+        # 不一致时显式传 None，否则 PNG 等编码器会自动写入 info 中的配置文件
+        return dict(params, icc_profile=icc if icc_matches_mode(icc, img.mode) else None)
+
+    def save_image(self, img, path, **params):
+        """保存PIL图片到指定路径，params 为编码参数（如 quality），可用 format 指定格式（默认按扩展名）"""
+        params = dict(params)
+        fmt = params.pop("format", None) or Image.registered_extensions().get(os.path.splitext(path)[1].lower())
+        if img.info.get("raw_metadata") and fmt in ("JPEG", "PNG"):
+            # 需要在编码结果中拼接元数据：先编码到内存再写出
+            data = self.encode_image(img, fmt, **params)
+            return data is not None and self.save_bytes(data, path)
         try:
-            img.save(path)
+            self._save(img, path, fmt, params)
             return True
         except Exception as e:
             print(f"保存图片失败: {e}")
             return False
+
+    def encode_image(self, img, fmt="PNG", **params):
+        """把PIL图片编码为内存中的字节，失败返回 None"""
+        try:
+            buf = io.BytesIO()
+            self._save(img, buf, fmt, params)
+            return splice_metadata(buf.getvalue(), fmt, img.info.get("raw_metadata"))
+        except Exception as e:
+            print(f"编码图片失败: {e}")
+            return None
+
+    def write_atomic(self, data, path):
+        """先写同目录临时文件再替换，避免留下写了一半的输出文件"""
+        tmp = os.path.join(os.path.dirname(path),
+                           f".{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+                f.write(data)
+            os.replace(tmp, path)
+            return True
+        except Exception as e:
+            print(f"保存图片失败: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+
+    def save_bytes(self, data, path):
+        """保存已编码的图片字节"""
+        try:
+            with open(path, "wb") as f:
+                f.write(data)
+            return True
+        except Exception as e:
+            print(f"保存图片失败: {e}")
+            return False
+
+    def link_or_copy(self, src, dst, hard_link=True):
+        """把已导出的文件复制到新路径，优先使用硬链接（不占额外空间）"""
+        try:
+            if os.path.exists(dst):
+                os.remove(dst)
+            if hard_link:
+                try:
+                    os.link(src, dst)
+                    return True
+                except OSError:
+                    pass  # 跨设备或文件系统不支持硬链接时回退为复制
+            shutil.copyfile(src, dst)
+            return True
+        except Exception as e:
+            print(f"复制图片失败: {e}")
+            return False
+
+    def open_archive(self, path, kind=None, volume_size=None):
+        """打开 ZIP/TAR 归档输出，编码好的图片通过 add(name, data) 直接写入"""
+        return ArchiveSink(path, kind, volume_size)
@@ -0,0 +1,158 @@
+"""
+监视文件夹（热文件夹）模块：持续监视输入文件夹，新图片写入完成后自动加水印并导出。
+- 轮询扫描 + 去抖：文件大小和修改时间在 settle_time 内保持不变才认为写入完成
+- 有界工作队列：队列满时扫描线程阻塞等待（背压），不会无限堆积任务
+- 空闲时线程只在 Event.wait 上休眠，CPU 占用接近 0
+依赖：core.export_pipeline
+"""
+import os
+import queue
+import threading
+import time
+from core.export_pipeline import ExportPipeline, is_image_file
+
+
+class HotFolderWatcher:
+    def __init__(self, input_folders, output_folder, settings, pipeline=None,
+                 prefix="wm_", suffix="_watermarked", fmt="PNG",
+                 poll_interval=1.0, settle_time=2.0, queue_size=16, workers=2,
+                 process_existing=True, on_processed=None, on_error=None):
+        if isinstance(input_folders, str):
+            input_folders = [input_folders]
+        self.input_folders = [os.path.abspath(f) for f in input_folders]
+        self.output_folder = os.path.abspath(output_folder)
+        self.settings = dict(settings)
+        self.pipeline = pipeline or ExportPipeline()
+        self.prefix = prefix
+        self.suffix = suffix
+        self.fmt = fmt
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.workers = max(1, workers)
+        self.process_existing = process_existing
+        self.on_processed = on_processed  # 回调 (src_path, save_path)，在工作线程中调用
+        self.on_error = on_error          # 回调 (src_path, message)，在工作线程中调用
+
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._pending = {}    # path -> (size, mtime_ns, 最近一次变化的时间)
+        self._inflight = set()
+        self._done = {}       # path -> (size, mtime_ns)，已处理版本
+
+    # ---------- 启动 / 停止 ----------
+    def start(self):
+        if self.is_running():
+            return
+        os.makedirs(self.output_folder, exist_ok=True)
+        self._stop_event.clear()
+        if not self.process_existing:
+            # 启动时已存在的文件视为已处理
+            for path, size, mtime in self._iter_files():
+                self._done[path] = (size, mtime)
+        self._threads = [threading.Thread(target=self._scan_loop, name="hot-folder-scan", daemon=True)]
+        for i in range(self.workers):
+            self._threads.append(threading.Thread(target=self._worker_loop, name=f"hot-folder-worker-{i}", daemon=True))
+        for t in self._threads:
+            t.start()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def is_running(self):
+        return any(t.is_alive() for t in self._threads)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    # ---------- 扫描 ----------
+    def _iter_files(self):
+        for folder in self.input_folders:
+            for root, dirs, filenames in os.walk(folder):
+                # 输出目录位于输入目录下时跳过，避免重复处理自己的输出
+                dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != self.output_folder]
+                for f in filenames:
+                    if not is_image_file(f):
+                        continue
+                    path = os.path.join(root, f)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime_ns
+
+    def _scan_loop(self):
+        while not self._stop_event.is_set():
+            self._scan_once()
+            self._stop_event.wait(self.poll_interval)
+
+    def _scan_once(self):
+        now = time.monotonic()
+        ready = []
+        seen = set()
+        for path, size, mtime in self._iter_files():
+            seen.add(path)
+            with self._lock:
+                if self._done.get(path) == (size, mtime) or path in self._inflight:
+                    continue
+            prev = self._pending.get(path)
+            if prev is None or prev[:2] != (size, mtime):
+                # 新文件或仍在写入：重新计时
+                self._pending[path] = (size, mtime, now)
+                continue
+            if size > 0 and now - prev[2] >= self.settle_time:
+                ready.append((path, size, mtime))
+
+        # 已删除的文件不再跟踪
+        for path in list(self._pending):
+            if path not in seen:
+                del self._pending[path]
+
+        for path, size, mtime in ready:
+            if not self._enqueue((path, size, mtime)):
+                return
+            del self._pending[path]
+
+    def _enqueue(self, job):
+        """队列满时阻塞等待（背压），停止时返回 False"""
+        with self._lock:
+            self._inflight.add(job[0])
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(job, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        with self._lock:
+            self._inflight.discard(job[0])
+        return False
+
+    # ---------- 处理 ----------
+    def _worker_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                path, size, mtime = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                save_path = self.pipeline.process(path, self.settings, self.output_folder,
+                                                  self.prefix, self.suffix, self.fmt)
+                if save_path:
+                    if self.on_processed:
+                        self.on_processed(path, save_path)
+                elif self.on_error:
+                    self.on_error(path, "处理失败")
+            except Exception as e:
+                print(f"监视文件夹处理失败: {path}: {e}")
+                if self.on_error:
+                    self.on_error(path, str(e))
+            finally:
+                with self._lock:
+                    # 无论成功与否都记录该版本，文件再次变化时会重新处理
+                    self._done[path] = (size, mtime)
+                    self._inflight.discard(path)
+                self._queue.task_done()
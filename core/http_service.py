@@ -0,0 +1,180 @@
+"""
+本地 HTTP 水印服务：在 WatermarkAPI 外包一层 HTTP，供同机的 Web 后端调用。
+- 每个连接由轻量的连接线程读写，空闲的 keep-alive 连接不占用计算线程；
+  加水印交给固定大小的常驻线程池，字体和水印图层缓存在请求间共享（无每请求进程启动）
+- 启动时预热全部模板的水印图层
+- 记录每个请求的耗时，/metrics 返回最近请求的 p50/p95/p99
+接口：
+    POST /watermark?template=<模板>&text=<文字>&format=JPEG&quality=85   请求体为源图字节，响应为结果图片
+    GET  /metrics   延迟与计数统计（JSON）
+    GET  /health    存活检查
+依赖：http.server, core.watermark_api
+"""
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from core.watermark_api import WatermarkAPI
+
+MAX_BODY_SIZE = 64 * 2 ** 20
+LATENCY_WINDOW = 2048
+
+CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+# 查询参数 → 编码参数及类型
+ENCODER_QUERY_PARAMS = {"quality": int, "compress_level": int, "method": int}
+
+
+class LatencyStats:
+    """最近 LATENCY_WINDOW 个请求的耗时统计（线程安全）"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.started = time.time()
+
+    def record(self, seconds, ok=True):
+        with self._lock:
+            self._samples.append(seconds)
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+
+    @staticmethod
+    def _percentile(ordered, q):
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self):
+        with self._lock:
+            ordered = sorted(self._samples)
+            requests, errors = self.requests, self.errors
+        ms = lambda v: round(v * 1000, 2)
+        return {
+            "requests": requests,
+            "errors": errors,
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "window": len(ordered),
+            "latency_ms": {
+                "p50": ms(self._percentile(ordered, 0.50)),
+                "p95": ms(self._percentile(ordered, 0.95)),
+                "p99": ms(self._percentile(ordered, 0.99)),
+                "max": ms(ordered[-1]) if ordered else 0.0,
+            },
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "WatermarkService/1.0"
+    protocol_version = "HTTP/1.1"
+    timeout = 30  # 空闲的 keep-alive 连接超时后关闭（只占用连接线程）
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type="application/json; charset=utf-8", extra_headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        if status >= 400:
+            # 出错时请求体可能未读完，不再复用连接
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/metrics":
+            self._send_json(200, self.server.stats.snapshot())
+        elif path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/watermark":
+            self._send_json(404, {"error": "not found"})
+            return
+        start = time.perf_counter()
+        ok = False
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length <= 0 or length > MAX_BODY_SIZE:
+                self._send_json(413 if length > MAX_BODY_SIZE else 400, {"error": "invalid body size"})
+                return
+            data = self.rfile.read(length)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            settings = {"text": query["text"]} if query.get("text") else {}
+            params = {}
+            for key, cast in ENCODER_QUERY_PARAMS.items():
+                if key in query:
+                    params[key] = cast(query[key])
+            api = self.server.api
+            fmt = api.output_format(data, query.get("format"))
+            result = self.server.compute(api.watermark_bytes, data, settings, fmt, query.get("template"), **params)
+            if result is None:
+                self._send_json(422, {"error": "watermark failed"})
+                return
+            ok = True
+            elapsed = time.perf_counter() - start
+            self._send(200, result, CONTENT_TYPES.get(fmt, "application/octet-stream"),
+                       {"X-Processing-Time-Ms": f"{elapsed * 1000:.2f}"})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            print(f"处理请求失败: {e}")
+            self._send_json(500, {"error": "internal error"})
+        finally:
+            self.server.stats.record(time.perf_counter() - start, ok)
+
+
+class WatermarkHTTPServer(ThreadingHTTPServer):
+    """
+    连接线程只负责收发（等待 keep-alive 连接的下一个请求也在这里），
+    加水印在常驻线程池中计算，同时计算的请求数不超过 workers
+    """
+    daemon_threads = True
+
+    def __init__(self, address, api=None, workers=4, verbose=False):
+        super().__init__(address, _Handler)
+        self.api = api or WatermarkAPI()
+        self.stats = LatencyStats()
+        self.verbose = verbose
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="watermark-http")
+
+    def compute(self, fn, *args, **kwargs):
+        """在计算线程池中执行 fn 并等待结果"""
+        return self._pool.submit(fn, *args, **kwargs).result()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+
+def serve(host="127.0.0.1", port=8765, templates_file="templates.json", workers=4, verbose=False):
+    """启动服务并阻塞，直到 Ctrl+C"""
+    api = WatermarkAPI(templates_file)
+    warmed = api.warm_up()
+    server = WatermarkHTTPServer((host, port), api, workers, verbose)
+    print(f"水印服务已启动: http://{host}:{server.server_address[1]}（{workers} 个工作线程，"
+          f"已预热 {warmed} 个模板，Ctrl+C 退出）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
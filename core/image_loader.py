@@ -1,15 +1,46 @@
 """
 图片加载与缩略图生成模块。
-依赖：PIL.Image
+加载时取出源文件的元数据原始字节（存入 info["raw_metadata"]，导出时原样写回），并按 EXIF 方向转正像素。
+依赖：PIL.Image, core.color_management, core.metadata
 """
+import io
 from PIL import Image
+from core.color_management import to_rgba
+from core.metadata import capture_metadata, normalize_orientation
+
+
+def _decode(img):
+    """转为 RGBA（方向已转正），元数据随 info 传递"""
+    meta = capture_metadata(img)
+    img = to_rgba(normalize_orientation(img, meta))
+    if meta:
+        img.info["raw_metadata"] = meta
+    return img
+
 
 class ImageLoader:
     def load_image(self, path):
         """加载图片为PIL.Image对象"""
         try:
             img = Image.open(path)
-            return img.convert("RGBA")
+            return _decode(img)
+        except Exception as e:
+            print(f"加载图片失败: {e}")
+            return None
+
+    def open_image(self, source):
+        """打开图片但不解码像素（source 为路径或文件字节），多帧图片可按帧 seek"""
+        try:
+            return Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+        except Exception as e:
+            print(f"加载图片失败: {e}")
+            return None
+
+    def load_bytes(self, data):
+        """从内存中的文件字节加载图片（流水线读取阶段已读入的数据）"""
+        try:
+            img = Image.open(io.BytesIO(data))
+            return _decode(img)
         except Exception as e:
             print(f"加载图片失败: {e}")
             return None
@@ -0,0 +1,189 @@
+"""
+批处理作业描述模块：用一个 JSON 文件声明 文件集（通配符/文件夹）→ 模板、输出格式、输出位置，
+一次调度完成整个作业。
+- 输入根目录只遍历一次，每个文件按规则顺序匹配，第一条命中的规则生效
+- 同一模板的图片归为一组连续处理，共用同一个引擎的字体与水印图层缓存
+作业文件示例：
+    {
+      "input": "./incoming",
+      "templates_file": "templates.json",
+      "defaults": {"format": "JPEG", "prefix": "wm_", "suffix": ""},
+      "rules": [
+        {"match": "acme/*.jpg", "template": "acme", "output": "./out/acme"},
+        {"folder": "beta", "template": "beta", "format": "PNG", "output": "./out/beta"},
+        {"match": "*", "text": "© 示例", "output": "./out/other"}
+      ]
+    }
+match 为相对输入根目录的通配符（"*" 可跨越子目录），folder 为相对输入根目录的子文件夹。
+输出保留子目录结构（相对规则的 folder，未设置 folder 时相对输入根目录），不同文件夹下的同名文件不会互相覆盖。
+依赖：core.export_pipeline, core.staged_pipeline, core.template_manager
+"""
+import fnmatch
+import json
+import os
+from core.export_pipeline import ExportPipeline, is_image_file, normalize_settings
+from core.staged_pipeline import StagedExportPipeline
+from core.template_manager import TemplateManager
+
+RULE_OUTPUT_KEYS = ("format", "prefix", "suffix", "output")
+DEFAULT_OUTPUT = {"format": "PNG", "prefix": "wm_", "suffix": "_watermarked"}
+
+
+class JobRule:
+    def __init__(self, index, match=None, folder=None, template=None, text=None,
+                 format="PNG", prefix="wm_", suffix="_watermarked", output=None):
+        self.index = index
+        self.match = match
+        self.folder = folder.strip("/\\").replace("\\", "/") if folder else None
+        self.template = template
+        self.text = text
+        self.format = format.upper()
+        self.prefix = prefix
+        self.suffix = suffix
+        self.output = output
+
+    def matches(self, rel_path):
+        """rel_path 为相对输入根目录、以 / 分隔的路径"""
+        if self.folder is not None and not rel_path.startswith(self.folder + "/"):
+            return False
+        if self.match is not None and not fnmatch.fnmatch(rel_path, self.match):
+            return False
+        return True
+
+    def describe(self):
+        source = self.match or (f"{self.folder}/" if self.folder else "*")
+        return f"规则 {self.index + 1}（{source} → {self.template or self.text}）"
+
+
+class JobSpec:
+    def __init__(self, input_root, rules, templates_file="templates.json", base_dir="."):
+        self.input_root = input_root
+        self.rules = rules
+        self.templates_file = templates_file
+        self.base_dir = base_dir
+
+
+def load_job_spec(path):
+    """读取作业文件，相对路径按作业文件所在目录解析；格式错误时返回 None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(path))
+        resolve = lambda p: p if os.path.isabs(p) else os.path.normpath(os.path.join(base_dir, p))
+        defaults = dict(DEFAULT_OUTPUT)
+        defaults.update({k: v for k, v in data.get("defaults", {}).items() if k in RULE_OUTPUT_KEYS})
+        rules = []
+        for i, item in enumerate(data["rules"]):
+            options = dict(defaults)
+            options.update({k: v for k, v in item.items() if k in RULE_OUTPUT_KEYS})
+            if not options.get("output"):
+                raise ValueError(f"规则 {i + 1} 缺少 output")
+            if not item.get("template") and not item.get("text"):
+                raise ValueError(f"规则 {i + 1} 缺少 template 或 text")
+            options["output"] = resolve(options["output"])
+            rules.append(JobRule(i, item.get("match"), item.get("folder"),
+                                 item.get("template"), item.get("text"), **options))
+        return JobSpec(resolve(data["input"]), rules,
+                       resolve(data.get("templates_file", "templates.json")), base_dir)
+    except Exception as e:
+        print(f"加载作业文件失败: {e}")
+        return None
+
+
+def assign_files(spec):
+    """
+    遍历输入根目录一次，把图片分配给第一条匹配的规则。
+    返回 ({规则序号: [路径]}, 未匹配的路径列表)
+    """
+    assigned = {rule.index: [] for rule in spec.rules}
+    unmatched = []
+    for dirpath, dirnames, filenames in os.walk(spec.input_root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if not is_image_file(name):
+                continue
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, spec.input_root).replace(os.sep, "/")
+            for rule in spec.rules:
+                if rule.matches(rel):
+                    assigned[rule.index].append(path)
+                    break
+            else:
+                unmatched.append(path)
+    return assigned, unmatched
+
+
+def _rule_settings(rule, templates):
+    settings = {}
+    if rule.template:
+        settings = templates.get_template(rule.template)
+        if settings is None:
+            print(f"模板不存在: {rule.template}")
+            return None
+    settings = dict(settings)
+    if rule.text:
+        settings["text"] = rule.text
+    return normalize_settings(settings)
+
+
+def run_job(spec, workers=1, dedupe=False, on_result=None, metrics=None):
+    """
+    执行作业，返回 {"processed": n, "failed": n, "unmatched": n}。
+    所有规则共用一个流水线（引擎缓存共享），同一模板的规则相邻执行。
+    on_result(规则, 源路径, 输出路径或 None) 每张图片完成后回调。
+    metrics 为 BatchMetrics 时整个作业作为一个批次统计。
+    """
+    assigned, unmatched = assign_files(spec)
+    templates = TemplateManager(spec.templates_file)
+    staged = StagedExportPipeline(ExportPipeline(), compute_workers=workers)
+    if metrics is not None:
+        metrics.total = sum(len(paths) for paths in assigned.values())
+        metrics.start()
+    try:
+        processed, failed = _run_rules(spec, assigned, templates, staged, dedupe, on_result, metrics)
+    finally:
+        if metrics is not None:
+            metrics.stop()
+    return {"processed": processed, "failed": failed, "unmatched": len(unmatched)}
+
+
+def _output_dirs(spec, rule, paths):
+    """按源文件所在子目录分组，返回 [(输出目录, [路径])]，保持原顺序"""
+    base = os.path.join(spec.input_root, rule.folder) if rule.folder else spec.input_root
+    groups = {}
+    for path in paths:
+        rel = os.path.relpath(os.path.dirname(path), base)
+        groups.setdefault(os.path.normpath(os.path.join(rule.output, rel)), []).append(path)
+    return list(groups.items())
+
+
+def _run_rules(spec, assigned, templates, staged, dedupe, on_result, metrics):
+    """按规则执行导出，返回 (成功张数, 失败张数)"""
+    processed = failed = 0
+    # 同一模板的规则排在一起，水印图层与字体缓存连续命中
+    for rule in sorted(spec.rules, key=lambda r: (r.template or "", r.text or "", r.index)):
+        paths = assigned[rule.index]
+        if not paths:
+            continue
+        settings = _rule_settings(rule, templates)
+        if settings is None:
+            failed += len(paths)
+            for path in paths:
+                if metrics is not None:
+                    metrics.record(None)
+                if on_result:
+                    on_result(rule, path, None)
+            continue
+        for out_dir, group in _output_dirs(spec, rule, paths):
+            os.makedirs(out_dir, exist_ok=True)
+            for src, dst in staged.run(group, settings, out_dir, rule.prefix, rule.suffix,
+                                       rule.format, dedupe=dedupe, metrics=metrics):
+                if dst:
+                    processed += 1
+                else:
+                    failed += 1
+                if metrics is not None:
+                    metrics.record(dst)
+                if on_result:
+                    on_result(rule, src, dst)
+    return processed, failed
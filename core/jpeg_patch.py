@@ -0,0 +1,482 @@
+"""
+JPEG 局部重编码模块：只解码、合成并重新编码水印所在区域的 MCU，其余熵编码数据原样复制。
+
+做法：
+- 解析基线（baseline）Huffman JPEG 的量化表、Huffman 表、帧与扫描头
+- 依赖重启间隔（DRI）：每个重启间隔的 DC 预测独立，可以单独解码/编码，
+  与水印不相交的间隔按字节原样拷贝
+- 水印覆盖的间隔解出量化系数，仅对被水印改动的块做 反量化 → IDCT → 合成 →
+  DCT → 用原量化表量化，再用原 Huffman 表编码
+- 未改动的块系数不变，重新编码后比特完全一致
+
+不满足条件（渐进式、算术编码、多扫描、无 DRI、原 Huffman 表缺少所需码字等）时抛出
+JpegPatchError，由调用方回退为整图重新编码。
+依赖：numpy, PIL.Image
+"""
+import re
+import numpy as np
+from PIL import Image
+
+# 之字形顺序 → 自然顺序（行优先）的下标
+ZIGZAG = np.array([
+    0, 1, 8, 16, 9, 2, 3, 10,
+    17, 24, 32, 25, 18, 11, 4, 5,
+    12, 19, 26, 33, 40, 48, 41, 34,
+    27, 20, 13, 6, 7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36,
+    29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46,
+    53, 60, 61, 54, 47, 55, 62, 63,
+])
+
+# 正交 DCT-II 矩阵，与 JPEG 定义的 8x8 DCT 缩放一致
+_k = np.arange(8)
+DCT_MATRIX = np.cos((2 * _k[None, :] + 1) * _k[:, None] * np.pi / 16) * 0.5
+DCT_MATRIX[0, :] = np.sqrt(1 / 8)
+
+_RST_RE = re.compile(rb"\xff[\xd0-\xd7]")
+_MARKER_RE = re.compile(rb"\xff+[^\x00\xd0-\xd7\xff]")
+
+_UNSUPPORTED_SOF = {0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class JpegPatchError(Exception):
+    """源文件不适合局部重编码"""
+
+
+# ---------- Huffman 表 ----------
+class _HuffmanTable:
+    def __init__(self, counts, symbols):
+        self.codes = {}  # 符号 -> (码字, 码长)
+        code = 0
+        k = 0
+        for length in range(1, 17):
+            for _ in range(counts[length - 1]):
+                self.codes[symbols[k]] = (code, length)
+                code += 1
+                k += 1
+            code <<= 1
+        self._lookup = None
+
+    @property
+    def lookup(self):
+        """16 位前瞻查找表：peek 值 -> (符号, 码长)，首次使用时构建"""
+        if self._lookup is None:
+            table = [(0, 0)] * 65536
+            for sym, (code, length) in self.codes.items():
+                start = code << (16 - length)
+                span = 1 << (16 - length)
+                table[start:start + span] = [(sym, length)] * span
+            self._lookup = table
+        return self._lookup
+
+
+# ---------- 头部解析 ----------
+class _JpegInfo:
+    def __init__(self, data):
+        if data[:2] != b"\xff\xd8":
+            raise JpegPatchError("不是 JPEG 文件")
+        self.qtables = {}
+        self.dc_tables = {}
+        self.ac_tables = {}
+        self.restart_interval = 0
+        self.adobe_transform = None
+        self.width = self.height = 0
+        self.components = []  # [(id, h, v, tq)]
+        self.scan = []        # [(comp_index, td, ta)]
+
+        pos = 2
+        n = len(data)
+        while True:
+            if pos >= n or data[pos] != 0xFF:
+                raise JpegPatchError("标记解析失败")
+            while pos < n and data[pos] == 0xFF:
+                pos += 1
+            marker = data[pos]
+            pos += 1
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                continue
+            length = int.from_bytes(data[pos:pos + 2], "big")
+            seg = data[pos + 2:pos + length]
+            if marker == 0xDB:
+                self._parse_dqt(seg)
+            elif marker == 0xC4:
+                self._parse_dht(seg)
+            elif marker in (0xC0, 0xC1):
+                self._parse_sof(seg)
+            elif marker in _UNSUPPORTED_SOF:
+                raise JpegPatchError("仅支持基线 Huffman 编码的 JPEG")
+            elif marker == 0xDD:
+                self.restart_interval = int.from_bytes(seg[:2], "big")
+            elif marker == 0xEE and seg[:5] == b"Adobe" and len(seg) >= 12:
+                self.adobe_transform = seg[11]
+            elif marker == 0xDA:
+                self._parse_sos(seg)
+                self.scan_start = pos + length
+                break
+            elif marker == 0xD9:
+                raise JpegPatchError("缺少扫描数据")
+            pos += length
+
+        m = _MARKER_RE.search(data, self.scan_start)
+        if m is None:
+            raise JpegPatchError("缺少 EOI")
+        self.scan_end = m.start()
+        tail = data[self.scan_end:].lstrip(b"\xff")
+        if not tail.startswith(b"\xd9"):
+            raise JpegPatchError("仅支持单次扫描的 JPEG")
+
+    def _parse_dqt(self, seg):
+        i = 0
+        while i < len(seg):
+            pq, tq = seg[i] >> 4, seg[i] & 15
+            i += 1
+            if pq == 0:
+                values = list(seg[i:i + 64])
+                i += 64
+            else:
+                values = [int.from_bytes(seg[i + 2 * k:i + 2 * k + 2], "big") for k in range(64)]
+                i += 128
+            natural = np.zeros(64)
+            natural[ZIGZAG] = values
+            self.qtables[tq] = natural.reshape(8, 8)
+
+    def _parse_dht(self, seg):
+        i = 0
+        while i < len(seg):
+            tc, th = seg[i] >> 4, seg[i] & 15
+            counts = list(seg[i + 1:i + 17])
+            total = sum(counts)
+            symbols = list(seg[i + 17:i + 17 + total])
+            i += 17 + total
+            (self.dc_tables if tc == 0 else self.ac_tables)[th] = _HuffmanTable(counts, symbols)
+
+    def _parse_sof(self, seg):
+        if seg[0] != 8:
+            raise JpegPatchError("仅支持 8 位精度")
+        self.height = int.from_bytes(seg[1:3], "big")
+        self.width = int.from_bytes(seg[3:5], "big")
+        nf = seg[5]
+        if nf not in (1, 3):
+            raise JpegPatchError("仅支持灰度或 YCbCr 图片")
+        for k in range(nf):
+            cid, hv, tq = seg[6 + 3 * k:9 + 3 * k]
+            self.components.append((cid, hv >> 4, hv & 15, tq))
+
+    def _parse_sos(self, seg):
+        ns = seg[0]
+        ids = [c[0] for c in self.components]
+        for k in range(ns):
+            cid, t = seg[1 + 2 * k], seg[2 + 2 * k]
+            self.scan.append((ids.index(cid), t >> 4, t & 15))
+        ss, se, a = seg[1 + 2 * ns:4 + 2 * ns]
+        if ns != len(self.components) or ss != 0 or se != 63 or a != 0:
+            raise JpegPatchError("仅支持单次交织扫描")
+
+    # ---------- MCU 几何 ----------
+    def layout(self):
+        if self.height == 0:
+            raise JpegPatchError("不支持 DNL 标记")
+        if len(self.components) == 1:
+            # 单分量扫描不交织，MCU 就是一个 8x8 块
+            self.sampling = [(1, 1)]
+            self.hmax = self.vmax = 1
+        else:
+            if self.adobe_transform == 0:
+                raise JpegPatchError("不支持 RGB 编码的 JPEG")
+            self.sampling = [(c[1], c[2]) for c in self.components]
+            self.hmax = max(h for h, _ in self.sampling)
+            self.vmax = max(v for _, v in self.sampling)
+            if any(self.hmax % h or self.vmax % v for h, v in self.sampling):
+                raise JpegPatchError("不支持非整数倍的色度采样")
+        self.mcu_w = 8 * self.hmax
+        self.mcu_h = 8 * self.vmax
+        self.mcus_x = -(-self.width // self.mcu_w)
+        self.mcus_y = -(-self.height // self.mcu_h)
+
+
+# ---------- 熵解码 / 编码 ----------
+def _decode_interval(data, n_mcus, plan):
+    """
+    解码一个重启间隔。plan: [(每 MCU 块数, DC 表, AC 表)]，按扫描分量顺序。
+    返回 MCU 列表，每个 MCU 是块列表，块为 64 个之字形顺序的系数（DC 为绝对值）。
+    """
+    data = data.replace(b"\xff\x00", b"\xff")
+    n = len(data)
+    acc = nbits = pos = 0
+    preds = [0] * len(plan)
+    lookups = [(dc.lookup, ac.lookup) for _, dc, ac in plan]
+    mcus = []
+    for _ in range(n_mcus):
+        blocks = []
+        for ci, (count, _, _) in enumerate(plan):
+            dc_lookup, ac_lookup = lookups[ci]
+            for _ in range(count):
+                coef = [0] * 64
+                # DC
+                while nbits < 16:
+                    acc = ((acc & ((1 << nbits) - 1)) << 8) | (data[pos] if pos < n else 0xFF)
+                    pos += 1
+                    nbits += 8
+                s, length = dc_lookup[(acc >> (nbits - 16)) & 0xFFFF]
+                if length == 0:
+                    raise JpegPatchError("熵编码数据损坏")
+                nbits -= length
+                diff = 0
+                if s:
+                    while nbits < s:
+                        acc = ((acc & ((1 << nbits) - 1)) << 8) | (data[pos] if pos < n else 0xFF)
+                        pos += 1
+                        nbits += 8
+                    diff = (acc >> (nbits - s)) & ((1 << s) - 1)
+                    nbits -= s
+                    if diff < (1 << (s - 1)):
+                        diff -= (1 << s) - 1
+                preds[ci] += diff
+                coef[0] = preds[ci]
+                # AC
+                k = 1
+                while k < 64:
+                    while nbits < 16:
+                        acc = ((acc & ((1 << nbits) - 1)) << 8) | (data[pos] if pos < n else 0xFF)
+                        pos += 1
+                        nbits += 8
+                    rs, length = ac_lookup[(acc >> (nbits - 16)) & 0xFFFF]
+                    if length == 0:
+                        raise JpegPatchError("熵编码数据损坏")
+                    nbits -= length
+                    r, s = rs >> 4, rs & 15
+                    if s == 0:
+                        if r != 15:
+                            break
+                        k += 16
+                        continue
+                    k += r
+                    if k > 63:
+                        raise JpegPatchError("熵编码数据损坏")
+                    while nbits < s:
+                        acc = ((acc & ((1 << nbits) - 1)) << 8) | (data[pos] if pos < n else 0xFF)
+                        pos += 1
+                        nbits += 8
+                    v = (acc >> (nbits - s)) & ((1 << s) - 1)
+                    nbits -= s
+                    if v < (1 << (s - 1)):
+                        v -= (1 << s) - 1
+                    coef[k] = v
+                    k += 1
+                blocks.append(coef)
+        mcus.append(blocks)
+    return mcus
+
+
+def _encode_interval(mcus, plan):
+    """用原 Huffman 表编码一个重启间隔，末尾按标准用 1 填充到字节边界"""
+    out = bytearray()
+    acc = nbits = 0
+    preds = [0] * len(plan)
+    codes = [(dc.codes, ac.codes) for _, dc, ac in plan]
+
+    def put(code, length):
+        nonlocal acc, nbits
+        acc = (acc << length) | code
+        nbits += length
+        while nbits >= 8:
+            nbits -= 8
+            b = (acc >> nbits) & 0xFF
+            out.append(b)
+            if b == 0xFF:
+                out.append(0)
+        acc &= (1 << nbits) - 1
+
+    try:
+        for blocks in mcus:
+            bi = 0
+            for ci, (count, _, _) in enumerate(plan):
+                dc_codes, ac_codes = codes[ci]
+                for _ in range(count):
+                    coef = blocks[bi]
+                    bi += 1
+                    diff = coef[0] - preds[ci]
+                    preds[ci] = coef[0]
+                    s = abs(diff).bit_length()
+                    put(*dc_codes[s])
+                    if s:
+                        put(diff if diff > 0 else diff + (1 << s) - 1, s)
+                    run = 0
+                    for k in range(1, 64):
+                        v = coef[k]
+                        if v == 0:
+                            run += 1
+                            continue
+                        while run > 15:
+                            put(*ac_codes[0xF0])
+                            run -= 16
+                        s = abs(v).bit_length()
+                        put(*ac_codes[(run << 4) | s])
+                        put(v if v > 0 else v + (1 << s) - 1, s)
+                        run = 0
+                    if run:
+                        put(*ac_codes[0x00])
+    except KeyError:
+        raise JpegPatchError("原 Huffman 表缺少所需码字")
+    if nbits:
+        put((1 << (8 - nbits)) - 1, 8 - nbits)
+    return bytes(out)
+
+
+# ---------- 像素变换 ----------
+def _idct(coefs, qtable):
+    """之字形量化系数 (n, 64) → 像素块 (n, 8, 8)，已加回 128 电平偏移"""
+    natural = np.zeros((len(coefs), 64))
+    natural[:, ZIGZAG] = coefs
+    freq = natural.reshape(-1, 8, 8) * qtable
+    return DCT_MATRIX.T @ freq @ DCT_MATRIX + 128
+
+
+def _fdct(pixels, qtable):
+    """像素块 (n, 8, 8) → 之字形量化系数 (n, 64)"""
+    freq = DCT_MATRIX @ (pixels - 128) @ DCT_MATRIX.T
+    q = np.rint(freq / qtable).astype(np.int64).reshape(-1, 64)
+    return q[:, ZIGZAG]
+
+
+def _ycc_to_rgb(y, cb, cr):
+    cb = cb - 128
+    cr = cr - 128
+    return np.stack([y + 1.402 * cr, y - 0.344136 * cb - 0.714136 * cr, y + 1.772 * cb], axis=-1)
+
+
+def _rgb_to_ycc(rgb):
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    y = 0.299 * r + 0.587 * g + 0.114 * b
+    cb = -0.168736 * r - 0.331264 * g + 0.5 * b + 128
+    cr = 0.5 * r - 0.418688 * g - 0.081312 * b + 128
+    return y, cb, cr
+
+
+# ---------- 主流程 ----------
+def patch_jpeg(data, sprite, pos, composite):
+    """
+    在 JPEG 字节流 data 中把 sprite 合成到 pos 处，返回新的 JPEG 字节流。
+    pos 可以是 (x, y)，也可以是根据图片尺寸计算位置的函数 pos((w, h)) -> (x, y)。
+    composite(region_rgba, sprite, rel_pos) 负责实际合成（与整图导出使用同一函数）。
+    """
+    info = _JpegInfo(data)
+    info.layout()
+    if callable(pos):
+        pos = pos((info.width, info.height))
+    ri = info.restart_interval
+    if ri <= 0:
+        raise JpegPatchError("没有重启间隔（DRI），无法局部重编码")
+
+    # 水印包围盒 → MCU 矩形
+    x0 = max(0, pos[0])
+    y0 = max(0, pos[1])
+    x1 = min(info.width, pos[0] + sprite.width)
+    y1 = min(info.height, pos[1] + sprite.height)
+    if x0 >= x1 or y0 >= y1:
+        return data
+    mx0, mx1 = x0 // info.mcu_w, (x1 - 1) // info.mcu_w
+    my0, my1 = y0 // info.mcu_h, (y1 - 1) // info.mcu_h
+
+    # 按 RST 标记切分重启间隔
+    scan = data[info.scan_start:info.scan_end]
+    total_mcus = info.mcus_x * info.mcus_y
+    bounds = [0]
+    markers = []
+    for m in _RST_RE.finditer(scan):
+        bounds.append(m.start())
+        bounds.append(m.end())
+        markers.append(m.group())
+    bounds.append(len(scan))
+    intervals = [scan[bounds[i]:bounds[i + 1]] for i in range(0, len(bounds), 2)]
+    if len(intervals) != -(-total_mcus // ri):
+        raise JpegPatchError("重启间隔数量与图片尺寸不符")
+
+    # 扫描计划：每个分量每 MCU 的块数与 Huffman 表
+    plan = []
+    for ci, td, ta in info.scan:
+        if td not in info.dc_tables or ta not in info.ac_tables:
+            raise JpegPatchError("缺少 Huffman 表")
+        h, v = info.sampling[ci]
+        plan.append((h * v, info.dc_tables[td], info.ac_tables[ta]))
+
+    # 解码受影响的重启间隔
+    affected = sorted({(my * info.mcus_x + mx) // ri
+                       for my in range(my0, my1 + 1) for mx in range(mx0, mx1 + 1)})
+    decoded = {}
+    for idx in affected:
+        n_mcus = min(ri, total_mcus - idx * ri)
+        decoded[idx] = _decode_interval(intervals[idx], n_mcus, plan)
+
+    def mcu_blocks(mx, my):
+        index = my * info.mcus_x + mx
+        return decoded[index // ri][index % ri]
+
+    # 组装矩形区域各分量平面
+    nx, ny = mx1 - mx0 + 1, my1 - my0 + 1
+    planes = []
+    block_offsets = []  # 每个分量在 MCU 块列表中的起始下标
+    offset = 0
+    for ci, _, _ in info.scan:
+        h, v = info.sampling[ci]
+        block_offsets.append(offset)
+        coefs = []
+        for my in range(my0, my1 + 1):
+            for mx in range(mx0, mx1 + 1):
+                coefs.extend(mcu_blocks(mx, my)[offset:offset + h * v])
+        offset += h * v
+        pix = _idct(np.array(coefs), info.qtables[info.components[ci][3]])
+        # (ny, nx, v, h, 8, 8) → (ny*v*8, nx*h*8)
+        plane = pix.reshape(ny, nx, v, h, 8, 8).transpose(0, 2, 4, 1, 3, 5).reshape(ny * v * 8, nx * h * 8)
+        planes.append(plane)
+
+    def upsample(plane, ci):
+        h, v = info.sampling[ci]
+        return plane.repeat(info.vmax // v, axis=0).repeat(info.hmax // h, axis=1)
+
+    if len(planes) == 3:
+        rgb = _ycc_to_rgb(*(upsample(p, ci) for ci, p in enumerate(planes)))
+    else:
+        rgb = np.repeat(planes[0][..., None], 3, axis=2)
+    before = np.clip(np.rint(rgb), 0, 255).astype(np.uint8)
+
+    region = Image.fromarray(before, "RGB").convert("RGBA")
+    rel_pos = (pos[0] - mx0 * info.mcu_w, pos[1] - my0 * info.mcu_h)
+    after = np.asarray(composite(region, sprite, rel_pos).convert("RGB"))
+    changed = np.any(after != before, axis=2)
+    if not changed.any():
+        return data
+
+    if len(planes) == 3:
+        new_planes = _rgb_to_ycc(after.astype(np.float64))
+    else:
+        new_planes = (0.299 * after[..., 0] + 0.587 * after[..., 1] + 0.114 * after[..., 2],)
+
+    # 只替换被水印改动的块
+    for ci, new_plane in enumerate(new_planes):
+        h, v = info.sampling[ci]
+        fy, fx = info.vmax // v, info.hmax // h
+        # 色度平面按采样因子取块平均下采样
+        sub = new_plane.reshape(new_plane.shape[0] // fy, fy, new_plane.shape[1] // fx, fx).mean(axis=(1, 3))
+        mask = changed.reshape(changed.shape[0] // (8 * fy), 8 * fy, changed.shape[1] // (8 * fx), 8 * fx).any(axis=(1, 3))
+        by, bx = np.nonzero(mask)
+        if len(by) == 0:
+            continue
+        pix = np.stack([sub[r * 8:r * 8 + 8, c * 8:c * 8 + 8] for r, c in zip(by, bx)])
+        coefs = _fdct(pix, info.qtables[info.components[ci][3]])
+        for (r, c), coef in zip(zip(by, bx), coefs):
+            my, bv = my0 + r // v, r % v
+            mx, bh = mx0 + c // h, c % h
+            mcu_blocks(mx, my)[block_offsets[ci] + bv * h + bh] = [int(x) for x in coef]
+
+    for idx in affected:
+        intervals[idx] = _encode_interval(decoded[idx], plan)
+
+    out = bytearray(data[:info.scan_start])
+    for i, chunk in enumerate(intervals):
+        out += chunk
+        if i < len(markers):
+            out += markers[i]
+    out += data[info.scan_end:]
+    return bytes(out)
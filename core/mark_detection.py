@@ -0,0 +1,202 @@
+"""
+已加水印检测模块：导出前检查源图在预期位置是否已经带有当前模板的水印，避免重复加水印。
+- 只看缩小的图片：JPEG 按 draft 解码到水印高度约 MATCH_SPRITE_HEIGHT 像素的尺寸（只解 DC/低频系数），
+  其他格式解码后缩小；方向按 EXIF 转正
+- 图片和模板都先减去局部背景均值（高通），背景的明暗起伏与大块纹理不参与匹配
+- 模板按引擎的合成方式（图层先以自身 alpha 为蒙版贴到透明底上，再叠到图片上）计算水印造成的亮度变化，
+  背景亮度取图中预期位置的平均亮度：同一水印在亮、暗背景上的明暗方向可能相反；
+  自动对比度时每种预设外观各一个模板
+- 在预期位置附近 ±MATCH_SEARCH 像素内用归一化互相关（NCC）匹配，滑动窗口一次性向量化计算；
+  自动摆放时在所有候选位置上匹配
+- 整体匹配只说明"这里有一行差不多的字"：字形相近、顺序不同的文字（如 "© ACME Studio" 与 "© Studio ACME"）
+  整体得分也不低。因此在整体最佳位置上再按字形逐段计算 NCC（按图层 alpha 的空白列切分），
+  匹配分取整体分与最差字形分中的较小者，每个字形都对得上才算已有水印
+- 匹配分达到 MATCH_THRESHOLD 才视为已有水印，临界的得分按未加水印处理（宁可重复加水印，也不漏加）
+依赖：numpy, PIL.Image, core.metadata, core.placement, core.watermark_engine
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from core.metadata import ORIENTATION_TRANSPOSE, capture_metadata, oriented_size
+from core.placement import candidate_ratios
+from core.watermark_engine import AUTO_CONTRAST_VARIANTS
+
+MATCH_SPRITE_HEIGHT = 48     # 匹配时水印图层缩小到的大致高度（像素）
+MATCH_SEARCH = 2             # 在预期位置周围搜索的范围（缩小后的像素）
+MATCH_BACKGROUND_RADIUS = 2  # 局部背景均值的方框半径（缩小后的像素），与缩小后的笔画宽度相当
+MATCH_GLYPH_MIN_WIDTH = 3    # 字形段的最小宽度（缩小后的像素），更窄的段并入相邻段
+# 1600×1200 的平坦 / 低频起伏 / 纹理 / 类照片背景，模板 "© ACME Studio"（70% 白字，右下角）：
+# 未加水印及带 "© Beta Photo"、"© Studio ACME"、"Copyright 2024" 水印的图片得分不超过 0.1，
+# 带当前水印的图片约八成达到阈值（没达到的是几乎看不出的淡水印）
+MATCH_THRESHOLD = 0.25
+
+
+def high_pass(a, radius=MATCH_BACKGROUND_RADIUS):
+    """减去 (2r+1)² 方框内的局部均值（积分图计算，边缘按边界值延伸），返回 float32 数组"""
+    k = 2 * radius + 1
+    padded = np.pad(a.astype(np.float64), radius, mode="edge")
+    integral = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1))
+    integral[1:, 1:] = padded.cumsum(axis=0).cumsum(axis=1)
+    sums = integral[k:, k:] - integral[:-k, k:] - integral[k:, :-k] + integral[:-k, :-k]
+    return (a - sums / (k * k)).astype(np.float32)
+
+
+def _sprite_terms(sprite, scale):
+    """
+    水印图层按引擎的合成方式贴到亮度为 L 的背景上时，亮度变化为 A·C − L·A（A、C 为贴好后图层的 alpha 与亮度）。
+    返回按 scale 缩小后的 (A·C, A)，缩小是线性的，可以先缩小再代入背景亮度
+    """
+    size = (max(1, round(sprite.width * scale)), max(1, round(sprite.height * scale)))
+    layer = Image.new("RGBA", sprite.size, (0, 0, 0, 0))
+    layer.paste(sprite, (0, 0), sprite)
+    alpha = np.asarray(layer.getchannel("A"), dtype=np.float32) / 255
+    luma = np.asarray(layer.convert("RGB").convert("L"), dtype=np.float32)
+    return tuple(np.asarray(Image.fromarray(a, "F").resize(size, Image.BOX)) for a in (alpha * luma, alpha))
+
+
+def _template(terms, level):
+    """背景亮度为 level 时水印造成的亮度变化（高通、零均值、单位范数），几乎没有变化时返回 None"""
+    covered, alpha = terms
+    t = high_pass(covered - level * alpha)
+    t -= t.mean()
+    norm = np.sqrt((t * t).sum())
+    return t / norm if norm > 1e-3 else None
+
+
+def glyph_spans(alpha, min_width=MATCH_GLYPH_MIN_WIDTH):
+    """按图层 alpha 的空白列把模板切成字形段，返回 [(起始列, 结束列)]；过窄的段并入前一段"""
+    columns = alpha.sum(axis=0)
+    filled = columns > 0.05 * columns.max()
+    spans = []
+    start = None
+    for x, on in enumerate(filled):
+        if on and start is None:
+            start = x
+        elif not on and start is not None:
+            spans.append([start, x])
+            start = None
+    if start is not None:
+        spans.append([start, len(filled)])
+    merged = []
+    for span in spans:
+        if merged and (span[1] - span[0] < min_width or merged[-1][1] - merged[-1][0] < min_width):
+            merged[-1][1] = span[1]
+        else:
+            merged.append(span)
+    return [tuple(span) for span in merged]
+
+
+def _ncc(a, b):
+    """两个同尺寸数组的归一化互相关，任一方没有纹理时为 0"""
+    a = a - a.mean()
+    b = b - b.mean()
+    norm = np.sqrt((a * a).sum() * (b * b).sum())
+    return float((a * b).sum() / norm) if norm > 1e-6 else 0.0
+
+
+def ncc_search(region, template):
+    """region 中每个与 template 同尺寸窗口的归一化互相关（向量化），返回二维数组"""
+    windows = np.lib.stride_tricks.sliding_window_view(region, template.shape)
+    n = template.size
+    sums = windows.sum(axis=(2, 3))
+    sq = (windows * windows).sum(axis=(2, 3))
+    dots = np.einsum("ijkl,kl->ij", windows, template)  # template 已零均值，点积即协方差
+    std = np.sqrt(np.maximum(sq - sums * sums / n, 1e-6))
+    return dots / std
+
+
+class MarkDetector:
+    def __init__(self, engine, threshold=MATCH_THRESHOLD):
+        self.engine = engine
+        self.threshold = threshold
+
+    def _open_reduced(self, path, sprite_height):
+        """打开源图并缩小到水印高度约 MATCH_SPRITE_HEIGHT 的尺寸，返回 (亮度图, 原图转正后的尺寸)"""
+        with Image.open(path) as im:
+            meta = capture_metadata(im)
+            orientation = meta.orientation if meta else 1
+            full = oriented_size(im.size, orientation)
+            scale = min(1.0, MATCH_SPRITE_HEIGHT / max(1, sprite_height))
+            if im.format == "JPEG":
+                im.draft("L", (max(1, int(im.width * scale)), max(1, int(im.height * scale))))
+            img = im.convert("L")
+        if orientation != 1:
+            img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+        target = (max(1, round(full[0] * scale)), max(1, round(full[1] * scale)))
+        if img.size != target:
+            img = img.resize(target, Image.BOX)
+        return img, full
+
+    def _header_size(self, path):
+        with Image.open(path) as im:
+            meta = capture_metadata(im)
+            return oriented_size(im.size, meta.orientation if meta else 1)
+
+    def score(self, path, settings):
+        """
+        源图在预期位置与当前水印的匹配分（0~1）：整体 NCC 最高的位置上，整体分与各字形分中的最小值。
+        无法判断时返回 None
+        """
+        engine = self.engine
+        text = settings.get("text", "")
+        if not text:
+            return None
+        try:
+            resolved = engine.resolve_settings(self._header_size(path), settings)
+            variants = [resolved]
+            if resolved.get("auto_contrast"):
+                variants = [engine.variant_settings(resolved, name) for name in AUTO_CONTRAST_VARIANTS]
+            sprites = [engine.get_sprite(text, v) for v in variants]
+            img, full = self._open_reduced(path, sprites[0].height)
+        except Exception as e:
+            print(f"检测已有水印失败: {path}: {e}")
+            return None
+        scale = img.width / full[0]
+        luma = np.asarray(img, dtype=np.float32)
+        detail = high_pass(luma)
+        if resolved.get("auto_position"):
+            ratios = candidate_ratios()
+        else:
+            ratios = [resolved.get("_pos_override") or resolved.get("position")]
+        best = None  # (整体分, 模板, 缩小后的图层 alpha, 模板在 detail 中的左上角)
+        for sprite, variant in zip(sprites, variants):
+            terms = _sprite_terms(sprite, scale)
+            th, tw = terms[1].shape
+            for ratio in ratios:
+                x, y = engine.get_watermark_position(full, sprite.size, settings=dict(variant, _pos_override=ratio))
+                x0 = max(0, round(x * scale) - MATCH_SEARCH)
+                y0 = max(0, round(y * scale) - MATCH_SEARCH)
+                window = (slice(y0, y0 + th + 2 * MATCH_SEARCH), slice(x0, x0 + tw + 2 * MATCH_SEARCH))
+                region = detail[window]
+                if region.shape[0] < th or region.shape[1] < tw:
+                    continue
+                template = _template(terms, float(luma[window].mean()))
+                if template is None:
+                    continue
+                scores = ncc_search(region, template)
+                iy, ix = np.unravel_index(scores.argmax(), scores.shape)
+                if best is None or scores[iy, ix] > best[0]:
+                    best = (float(scores[iy, ix]), template, terms[1], (y0 + iy, x0 + ix))
+        if best is None:
+            return 0.0
+        whole, template, alpha, (y, x) = best
+        th, tw = template.shape
+        matched = detail[y:y + th, x:x + tw]
+        glyphs = [_ncc(matched[:, a:b], template[:, a:b]) for a, b in glyph_spans(alpha)]
+        return max(0.0, min([whole] + glyphs))
+
+    def is_marked(self, path, settings):
+        score = self.score(path, settings)
+        return score is not None and score >= self.threshold
+
+    def scan(self, paths, settings, workers=None):
+        """并行检查，按输入顺序逐个产出 (路径, 匹配分或 None, 是否已有水印)"""
+        workers = workers or os.cpu_count() or 2
+
+        def check(path):
+            score = self.score(path, settings)
+            return path, score, score is not None and score >= self.threshold
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(check, paths)
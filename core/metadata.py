@@ -0,0 +1,176 @@
+"""
+元数据直通模块：加载时把源文件的 EXIF / XMP / IPTC 原始字节取出，导出时原样拼接进输出文件，
+版权与拍摄信息在加水印后得以保留，且不经过 Pillow 的 EXIF 对象（不重新解析、不重新序列化）。
+- JPEG 源：直接使用 Pillow 打开文件时已读出的 APP 段（applist），EXIF 为 APP1、XMP 为 APP1、IPTC 为 APP13
+- PNG / WebP 源：使用 Pillow 读出的 eXIf / XMP 原始块
+- 方向：加载时按 EXIF Orientation 把像素转正，并把原始 EXIF 中的 Orientation 字段就地改为 1
+- 输出 JPEG 时在 SOI（及 JFIF APP0）之后插入 APP 段；输出 PNG 时在 IHDR 之后插入 eXIf / iTXt 块
+  （PNG 没有标准的 IPTC 块，IPTC 只写入 JPEG）
+依赖：PIL.Image
+"""
+import struct
+import zlib
+from PIL import Image
+
+EXIF_HEADER = b"Exif\x00\x00"
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+IPTC_HEADER = b"Photoshop 3.0\x00"
+JPEG_SEGMENT_MAX = 65533  # APP 段数据的最大长度（长度字段 2 字节，含自身）
+ORIENTATION_TAG = 0x0112
+
+# EXIF Orientation → 转正像素所需的变换（与 ImageOps.exif_transpose 一致）
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+class RawMetadata:
+    """源文件的元数据原始字节；exif 为 TIFF 结构（不含 Exif 头），iptc 为 Photoshop APP13 段数据"""
+
+    __slots__ = ("exif", "xmp", "iptc", "orientation")
+
+    def __init__(self, exif=None, xmp=None, iptc=None, orientation=1):
+        self.exif = exif
+        self.xmp = xmp
+        self.iptc = iptc
+        self.orientation = orientation
+
+    def __bool__(self):
+        return bool(self.exif or self.xmp or self.iptc)
+
+    def __getstate__(self):
+        return self.exif, self.xmp, self.iptc, self.orientation
+
+    def __setstate__(self, state):
+        self.exif, self.xmp, self.iptc, self.orientation = state
+
+
+# ---------- EXIF Orientation（只定位 IFD0 中的一个字段） ----------
+def _orientation_entry(tiff):
+    """返回 (Orientation 值的偏移, 字节序)，没有该字段时返回 (None, 字节序)"""
+    if len(tiff) < 8 or tiff[:2] not in (b"II", b"MM"):
+        return None, "<"
+    order = "<" if tiff[:2] == b"II" else ">"
+    ifd = struct.unpack_from(order + "I", tiff, 4)[0]
+    if ifd + 2 > len(tiff):
+        return None, order
+    count = struct.unpack_from(order + "H", tiff, ifd)[0]
+    for i in range(count):
+        entry = ifd + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        if struct.unpack_from(order + "H", tiff, entry)[0] == ORIENTATION_TAG:
+            return entry + 8, order
+    return None, order
+
+
+def read_orientation(tiff):
+    offset, order = _orientation_entry(tiff)
+    if offset is None:
+        return 1
+    value = struct.unpack_from(order + "H", tiff, offset)[0]
+    return value if value in ORIENTATION_TRANSPOSE else 1
+
+
+def reset_orientation(tiff):
+    """把 Orientation 字段就地改为 1（其余字节不动），返回新的 EXIF 字节"""
+    offset, order = _orientation_entry(tiff)
+    if offset is None:
+        return tiff
+    patched = bytearray(tiff)
+    struct.pack_into(order + "H", patched, offset, 1)
+    return bytes(patched)
+
+
+# ---------- 读取 ----------
+def capture_metadata(img):
+    """从刚打开（尚未转换）的图片取出元数据原始字节，没有元数据时返回 None"""
+    exif = xmp = iptc = None
+    for marker, data in getattr(img, "applist", ()):
+        if marker == "APP1" and data.startswith(EXIF_HEADER) and exif is None:
+            exif = data[len(EXIF_HEADER):]
+        elif marker == "APP1" and data.startswith(XMP_HEADER) and xmp is None:
+            xmp = data[len(XMP_HEADER):]
+        elif marker == "APP13" and data.startswith(IPTC_HEADER) and iptc is None:
+            iptc = data
+    if not hasattr(img, "applist"):
+        exif = img.info.get("exif")
+        if isinstance(exif, bytes) and exif.startswith(EXIF_HEADER):
+            exif = exif[len(EXIF_HEADER):]
+        xmp = img.info.get("xmp")
+        if isinstance(xmp, str):
+            xmp = xmp.encode("utf-8")
+    meta = RawMetadata(exif if isinstance(exif, bytes) else None, xmp or None, iptc)
+    if meta.exif:
+        meta.orientation = read_orientation(meta.exif)
+    return meta if meta else None
+
+
+def oriented_size(size, orientation):
+    """按 Orientation 转正后的尺寸"""
+    return (size[1], size[0]) if orientation in (5, 6, 7, 8) else tuple(size)
+
+
+def normalize_orientation(img, meta):
+    """按元数据中的方向转正像素，并把元数据中的方向改为 1；返回转正后的图片"""
+    if meta is None or meta.orientation == 1:
+        return img
+    img = img.transpose(ORIENTATION_TRANSPOSE[meta.orientation])
+    meta.exif = reset_orientation(meta.exif)
+    meta.orientation = 1
+    return img
+
+
+# ---------- 写入 ----------
+def _jpeg_segment(marker, data):
+    return struct.pack(">BBH", 0xFF, marker, len(data) + 2) + data
+
+
+def _splice_jpeg(data, meta):
+    segments = []
+    if meta.exif and len(EXIF_HEADER) + len(meta.exif) <= JPEG_SEGMENT_MAX:
+        segments.append(_jpeg_segment(0xE1, EXIF_HEADER + meta.exif))
+    if meta.xmp and len(XMP_HEADER) + len(meta.xmp) <= JPEG_SEGMENT_MAX:
+        segments.append(_jpeg_segment(0xE1, XMP_HEADER + meta.xmp))
+    if meta.iptc and len(meta.iptc) <= JPEG_SEGMENT_MAX:
+        segments.append(_jpeg_segment(0xED, meta.iptc))
+    if not segments or data[:2] != b"\xff\xd8":
+        return data
+    pos = 2
+    if data[2:4] == b"\xff\xe0":  # JFIF APP0 必须紧跟 SOI
+        pos = 4 + struct.unpack_from(">H", data, 4)[0]
+    return data[:pos] + b"".join(segments) + data[pos:]
+
+
+def _png_chunk(kind, body):
+    return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+
+def _splice_png(data, meta):
+    chunks = []
+    if meta.exif:
+        chunks.append(_png_chunk(b"eXIf", meta.exif))
+    if meta.xmp:
+        # iTXt：关键字、未压缩、语言与翻译关键字为空
+        chunks.append(_png_chunk(b"iTXt", b"XML:com.adobe.xmp\x00\x00\x00\x00\x00" + meta.xmp))
+    if not chunks or data[:8] != b"\x89PNG\r\n\x1a\n":
+        return data
+    pos = 8 + 12 + struct.unpack_from(">I", data, 8)[0]  # IHDR 之后
+    return data[:pos] + b"".join(chunks) + data[pos:]
+
+
+def splice_metadata(data, fmt, meta):
+    """把元数据原始字节拼接进已编码的 JPEG / PNG 字节，其他格式原样返回"""
+    if not meta:
+        return data
+    if fmt == "JPEG":
+        return _splice_jpeg(data, meta)
+    if fmt == "PNG":
+        return _splice_png(data, meta)
+    return data
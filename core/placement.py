@@ -0,0 +1,77 @@
+"""
+自动摆放模块：在缩小的副本上计算显著性（边缘能量）图，选择水印覆盖显著性最低的位置，
+避免水印压在人脸、商品等细节丰富的区域上。
+- 显著性 = 梯度幅值 + 与全图平均亮度的偏差（少量权重），全部为 NumPy 向量运算
+- 用积分图一次求出所有候选位置的覆盖总和，候选为九宫格锚点加更细的网格
+- 统计在最长边 SALIENCY_MAX_SIDE 像素的副本上进行（先抽样再平均），开销与原图尺寸基本无关
+位置以比例坐标 (rx, ry) 返回，与模板中的 position 含义相同。
+依赖：numpy, PIL.Image
+"""
+import numpy as np
+from PIL import Image
+
+SALIENCY_MAX_SIDE = 256
+CONTRAST_WEIGHT = 0.25
+DEFAULT_LATTICE = 5
+# 覆盖显著性与最小值相差不到此比例的候选视为一样好，按偏好顺序取第一个
+# （平坦区域之间的差别只是浮点误差，不应让水印落到网格中间的任意位置）
+TIE_TOLERANCE = 0.02
+
+# 九宫格锚点，按偏好排列（显著性相近时靠前者优先：右下 → 左下 → 右上 → 左上 → 其余）
+GRID_ANCHORS = [(1.0, 1.0), (0.0, 1.0), (1.0, 0.0), (0.0, 0.0),
+                (0.5, 1.0), (0.5, 0.0), (0.0, 0.5), (1.0, 0.5), (0.5, 0.5)]
+
+
+def candidate_ratios(lattice=DEFAULT_LATTICE):
+    """九宫格锚点 + lattice×lattice 网格（去重，锚点在前）"""
+    ratios = list(GRID_ANCHORS)
+    if lattice and lattice > 1:
+        steps = [i / (lattice - 1) for i in range(lattice)]
+        ratios += [(x, y) for y in steps for x in steps if (x, y) not in GRID_ANCHORS]
+    return ratios
+
+
+def saliency_map(img, max_side=SALIENCY_MAX_SIDE):
+    """缩小后的显著性图（float32 二维数组）"""
+    if max(img.size) > max_side:
+        scale = max_side / max(img.size)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        if scale < 0.5:
+            # 先最近邻抽样到目标的 2 倍再平均：比整图 BOX 缩小快一个数量级，边缘能量的统计足够稳定
+            img = img.resize((size[0] * 2, size[1] * 2), Image.NEAREST)
+        img = img.resize(size, Image.BOX)
+    gray = np.asarray(img.convert("L"), dtype=np.float32)
+    energy = np.zeros_like(gray)
+    energy[:, :-1] += np.abs(np.diff(gray, axis=1))
+    energy[:-1, :] += np.abs(np.diff(gray, axis=0))
+    energy += CONTRAST_WEIGHT * np.abs(gray - gray.mean())
+    return energy
+
+
+def integral_image(values):
+    """带一行一列零填充的积分图，区域和 = I[y1,x1] - I[y0,x1] - I[y1,x0] + I[y0,x0]"""
+    out = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(values, axis=0), axis=1, out=out[1:, 1:])
+    return out
+
+
+def best_ratio(img, sprite_size, full_size=None, lattice=DEFAULT_LATTICE):
+    """
+    返回水印覆盖显著性最低的比例坐标。
+    img 可以是缩小的副本（如 JPEG draft 解码），此时 full_size 为原图尺寸，sprite_size 按原图计。
+    """
+    full_size = full_size or img.size
+    energy = saliency_map(img)
+    h, w = energy.shape
+    sx, sy = w / full_size[0], h / full_size[1]
+    bw = min(w, max(1, round(sprite_size[0] * sx)))
+    bh = min(h, max(1, round(sprite_size[1] * sy)))
+    ratios = candidate_ratios(lattice)
+    r = np.array(ratios, dtype=np.float64)
+    x0 = (r[:, 0] * (w - bw)).astype(np.intp)
+    y0 = (r[:, 1] * (h - bh)).astype(np.intp)
+    x1, y1 = x0 + bw, y0 + bh
+    table = integral_image(energy)
+    cost = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+    best = cost.min()
+    return ratios[int(np.argmax(cost <= best + TIE_TOLERANCE * best + 1e-6))]
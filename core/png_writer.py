@@ -0,0 +1,142 @@
+"""
+并行 PNG 写出模块：大尺寸无损导出时，把过滤后的扫描线切成若干段分别 deflate（pigz 方式），
+多线程并行压缩后拼成一个合法的 zlib 数据流写入 IDAT，压缩耗时随核数下降。
+- 过滤：与 libpng/Pillow 相同的自适应选择（每行在 None/Sub/Up/Average/Paeth 中取绝对值和最小者），NumPy 向量运算
+- 每段用原始 deflate 压缩，以前一段末尾 32 KB 过滤后的数据作为预置字典（压缩率接近整图压缩），
+  非最后一段以 Z_SYNC_FLUSH 结束（字节对齐，可直接拼接），最后一段以 Z_FINISH 结束
+- 校验和：各段分别计算 Adler-32，再按 zlib 的 adler32_combine 公式合并
+- 每段压缩好后按顺序写成一个 IDAT 块，不需要先把整个压缩流拼在内存中
+- zlib 与 NumPy 的大数组运算都会释放 GIL，线程池即可并行
+只处理 8 位的 L / LA / RGB / RGBA；其他模式与编码参数由调用方回退为 Pillow 保存。
+依赖：numpy, zlib, concurrent.futures
+"""
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+PARALLEL_PNG_MIN_PIXELS = 4_000_000  # 小于此像素数时并行收益不明显，交给 Pillow
+CHUNK_BYTES = 1 << 20                # 每段压缩前的数据量（约 1 MB）
+WINDOW_BYTES = 32768                 # deflate 窗口大小，也是预置字典的长度
+IDAT_MAX = 1 << 30
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# 模式 → (每像素字节数, PNG 颜色类型)
+PNG_MODES = {"L": (1, 0), "LA": (2, 4), "RGB": (3, 2), "RGBA": (4, 6)}
+
+
+def can_write(img, params=None):
+    """是否由本模块写出（模式受支持且没有本模块不认识的编码参数）"""
+    extra = set(params or ()) - {"compress_level", "icc_profile"}
+    return img.mode in PNG_MODES and not extra
+
+
+def _chunk(kind, body):
+    return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+
+def adler32_combine(adler1, adler2, len2):
+    """合并两段数据的 Adler-32（与 zlib 的 adler32_combine 相同）"""
+    base = 65521
+    rem = len2 % base
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % base
+    sum1 += (adler2 & 0xFFFF) + base - 1
+    sum2 += ((adler1 >> 16) & 0xFFFF) + ((adler2 >> 16) & 0xFFFF) + base - rem
+    if sum1 >= base:
+        sum1 -= base
+    if sum1 >= base:
+        sum1 -= base
+    if sum2 >= base << 1:
+        sum2 -= base << 1
+    if sum2 >= base:
+        sum2 -= base
+    return sum1 | (sum2 << 16)
+
+
+# ---------- 扫描线过滤 ----------
+def filter_rows(pixels, start, stop, bpp):
+    """
+    对第 start..stop 行做自适应过滤，返回带过滤类型字节的数据（bytes）。
+    pixels 为 (高, 行字节数) 的 uint8 数组；第 start-1 行作为上一行参与 Up/Average/Paeth。
+    """
+    x = pixels[start:stop].astype(np.int16)
+    b = pixels[start - 1:stop - 1].astype(np.int16) if start > 0 else np.zeros_like(x)
+    if start == 0 and stop > 1:
+        b[1:] = x[:-1]
+    a = np.zeros_like(x)
+    a[:, bpp:] = x[:, :-bpp]
+    c = np.zeros_like(x)
+    c[:, bpp:] = b[:, :-bpp]
+    pa = np.abs(b - c)
+    pb = np.abs(a - c)
+    pc = np.abs(a + b - 2 * c)
+    paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+    candidates = np.stack([x, x - a, x - b, x - ((a + b) >> 1), x - paeth]).astype(np.uint8)
+    # 启发式：按有符号字节的绝对值和选择每行的过滤方式
+    signed = candidates.view(np.int8).astype(np.int16)
+    cost = np.abs(signed).sum(axis=2)
+    best = cost.argmin(axis=0)
+    rows = candidates[best, np.arange(x.shape[0])]
+    out = np.empty((x.shape[0], x.shape[1] + 1), dtype=np.uint8)
+    out[:, 0] = best
+    out[:, 1:] = rows
+    return out.tobytes()
+
+
+def _compress_band(pixels, start, stop, bpp, level, prime_rows, last):
+    """压缩一段扫描线，返回 (压缩数据, Adler-32, 未压缩长度)"""
+    data = filter_rows(pixels, start, stop, bpp)
+    if start > 0:
+        # 预置字典：重新过滤前一段末尾几行（结果与前一段中的完全相同）
+        zdict = filter_rows(pixels, max(0, start - prime_rows), start, bpp)[-WINDOW_BYTES:]
+        comp = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+    body = comp.compress(data) + comp.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return body, zlib.adler32(data), len(data)
+
+
+def save_png(img, fp, compress_level=6, icc_profile=None, workers=None):
+    """并行压缩写出 PNG，fp 为路径或二进制文件对象"""
+    bpp, color_type = PNG_MODES[img.mode]
+    width, height = img.size
+    pixels = np.asarray(img).reshape(height, width * bpp)
+    row_bytes = width * bpp + 1
+    rows_per_band = max(1, CHUNK_BYTES // row_bytes)
+    prime_rows = -(-WINDOW_BYTES // row_bytes)
+    bands = [(s, min(height, s + rows_per_band)) for s in range(0, height, rows_per_band)]
+    workers = workers or os.cpu_count() or 1
+
+    close = isinstance(fp, str)
+    f = open(fp, "wb") if close else fp
+    try:
+        f.write(PNG_SIGNATURE)
+        f.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)))
+        if icc_profile:
+            f.write(_chunk(b"iCCP", b"ICC Profile\x00\x00" + zlib.compress(icc_profile)))
+        # zlib 头：CM=8、窗口 32K，FLEVEL 按压缩级别，校验位使头部能被 31 整除
+        flevel = 0 if compress_level < 2 else 1 if compress_level < 6 else 2 if compress_level == 6 else 3
+        cmf, flg = 0x78, flevel << 6
+        flg |= 31 - ((cmf << 8) | flg) % 31
+        pending = bytes([cmf, flg])
+        adler = 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_compress_band, pixels, s, e, bpp, compress_level, prime_rows,
+                                   i == len(bands) - 1)
+                       for i, (s, e) in enumerate(bands)]
+            for i, fut in enumerate(futures):
+                body, band_adler, length = fut.result()
+                futures[i] = None  # 及时释放已写出的段
+                adler = adler32_combine(adler, band_adler, length)
+                pending += body
+                if i == len(futures) - 1:
+                    pending += struct.pack(">I", adler)
+                while pending:
+                    f.write(_chunk(b"IDAT", pending[:IDAT_MAX]))
+                    pending = pending[IDAT_MAX:]
+        f.write(_chunk(b"IEND", b""))
+    finally:
+        if close:
+            f.close()
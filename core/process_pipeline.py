@@ -0,0 +1,259 @@
+"""
+多进程导出模块：解码、合成、编码分别作为独立任务在进程池中执行，
+图片像素通过共享内存在各阶段之间传递（见 core.shm_transport），进程间只传描述符。
+- 主进程只读文件头，按尺寸预先分配共享段；解码任务直接把像素写进共享段
+- 水印图层在主进程按设置（及相对字号下的图片尺寸）渲染一次放进共享段，所有合成任务共用
+- 合成任务在共享段上原地贴水印，只改动水印所在区域；自动摆放/自动对比度需要看像素，也在合成任务中决定
+- 编码任务直接从共享段编码并原子写出
+- 同时在处理中的图片数受 max_in_flight 限制，控制共享内存占用
+依赖：concurrent.futures, core.shm_transport, core.export_pipeline, core.color_management,
+      core.invisible_watermark, core.metadata, core.placement, core.watermark_engine, core.watermark_geometry
+"""
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from core.color_management import SRGB_ICC, default_color_manager, profile_color_space
+from core.exporter import Exporter
+from core.export_pipeline import ExportPipeline
+from core.invisible_watermark import embed as embed_invisible
+from core.metadata import (ORIENTATION_TRANSPOSE, capture_metadata, oriented_size, reset_orientation,
+                           splice_metadata)
+from core.placement import best_ratio
+from core.shm_transport import SharedImageRegistry, attached_image
+from core.watermark_engine import AUTO_CONTRAST_VARIANTS, pick_contrast_variant, region_luminance
+from core.watermark_geometry import sprite_position
+
+_DONE = object()
+
+# 子进程内缓存的水印图层映射：段名 → (上下文, 图像视图)
+_worker_sprites = {}
+
+
+def _worker_sprite(sprite_ref):
+    entry = _worker_sprites.get(sprite_ref.name)
+    if entry is None:
+        ctx = attached_image(sprite_ref)
+        entry = (ctx, ctx.__enter__())
+        _worker_sprites[sprite_ref.name] = entry
+    return entry[1]
+
+
+# ---------- 子进程任务（只接收描述符） ----------
+def _stage_decode(path, ref, to_srgb=False, orientation=1):
+    """解码源图并写入预先分配的共享段（按 EXIF 方向转正；to_srgb 时按配置文件转换到 sRGB）"""
+    try:
+        with Image.open(path) as src, attached_image(ref) as view:
+            if oriented_size(src.size, orientation) != ref.size:
+                raise ValueError(f"尺寸与文件头不一致: {src.size} != {ref.size}")
+            img = src.transpose(ORIENTATION_TRANSPOSE[orientation]) if orientation != 1 else src
+            img = default_color_manager().to_srgb(img) if to_srgb else img
+            view.paste(img.convert(ref.mode), (0, 0))
+        return True
+    except Exception as e:
+        print(f"加载图片失败: {path}: {e}")
+        return False
+
+
+def _stage_composite(ref, candidates, layout):
+    """
+    在共享段上原地贴水印图层。candidates 为 {外观: 图层描述符}，layout 为 _layout 给出的摆放信息：
+    自动摆放时按本图的显著性图选位置，自动对比度时按水印覆盖区域的亮度选外观，否则只有 None 一项；
+    贴好水印后按需嵌入隐形水印，无法嵌入时本图失败。
+    """
+    try:
+        with attached_image(ref) as view:
+            ratio = layout["ratio"]
+            base = layout["base"]
+            if layout["auto_position"]:
+                ratio = best_ratio(view, base)
+            variant = None
+            if layout["auto_contrast"]:
+                x, y = sprite_position(view.size, base, ratio)
+                box = (max(0, x), max(0, y), min(view.width, x + base[0]), min(view.height, y + base[1]))
+                if box[2] > box[0] and box[3] > box[1]:
+                    variant = pick_contrast_variant(*region_luminance(view, box))
+            sprite_ref = candidates[variant]
+            view.alpha_composite(_worker_sprite(sprite_ref), sprite_position(view.size, sprite_ref.size, ratio))
+            if layout["invisible"]:
+                marked = embed_invisible(view, *layout["invisible"])
+                if marked is None:
+                    return False
+                view.paste(marked, (0, 0))
+        return True
+    except Exception as e:
+        print(f"添加水印失败: {e}")
+        return False
+
+
+def _stage_encode(ref, save_path, fmt, icc=None, meta=None):
+    """从共享段编码并写出（icc 为要写入的配置文件，meta 为要原样写回的元数据），成功返回输出路径"""
+    exporter = Exporter(png_workers=1)  # 各编码任务已在不同进程中并行
+    params = {"icc_profile": icc} if icc else {}
+    with attached_image(ref) as view:
+        img = view.convert("RGB") if fmt == "JPEG" else view
+        data = exporter.encode_image(img, fmt, **params)
+    if data is not None and meta:
+        data = splice_metadata(data, fmt, meta)
+    if data is None or not exporter.write_atomic(data, save_path):
+        return None
+    return save_path
+
+
+class ProcessExportPipeline:
+    def __init__(self, pipeline=None, processes=None, max_in_flight=None):
+        self.pipeline = pipeline or ExportPipeline()
+        self.processes = processes or os.cpu_count() or 2
+        # 同时驻留在共享内存中的图片数（每张图片在 解码 → 合成 → 编码 期间占用一个段）
+        self.max_in_flight = max_in_flight or self.processes * 2
+
+    @staticmethod
+    def _read_header(path):
+        """
+        只读文件头，返回 (转正后的尺寸, ICC 配置文件, 元数据, 方向)，失败返回 None。
+        输出的像素由解码任务转正，元数据中的方向在这里改为 1。
+        """
+        try:
+            with Image.open(path) as im:
+                meta = capture_metadata(im)
+                orientation = meta.orientation if meta else 1
+                if orientation != 1:
+                    meta.exif = reset_orientation(meta.exif)
+                    meta.orientation = 1
+                return oriented_size(im.size, orientation), im.info.get("icc_profile"), meta, orientation
+        except Exception as e:
+            print(f"读取图片信息失败: {path}: {e}")
+            return None
+
+    def _placements(self, registry, sprites, size, settings, icc=None):
+        """
+        按图片尺寸（及色彩空间）得到候选水印图层 {外观: 描述符} 与摆放信息。
+        位置与外观要看过像素才能决定时（自动摆放/自动对比度），各候选都预先渲染，由合成进程选择。
+        """
+        engine = self.pipeline.watermark_engine
+        text = settings.get("text", "")
+        resolved = engine.resolve_settings(size, self.pipeline.color.adjust_settings(settings, icc))
+        base = self._sprite_ref(registry, sprites, text, resolved)
+        candidates = {None: base}
+        if resolved.get("auto_contrast"):
+            for name in AUTO_CONTRAST_VARIANTS:
+                candidates[name] = self._sprite_ref(registry, sprites, text, engine.variant_settings(resolved, name))
+        layout = {
+            "ratio": resolved.get("_pos_override") or resolved.get("position"),
+            "auto_position": bool(resolved.get("auto_position")),
+            "auto_contrast": bool(resolved.get("auto_contrast")),
+            "base": base.size,
+            "invisible": (resolved["invisible_mark"], resolved.get("invisible_key")) if resolved.get("invisible_mark") else None,
+        }
+        return candidates, layout
+
+    def _sprite_ref(self, registry, sprites, text, resolved):
+        """同一外观的图层只渲染并放入共享内存一次，返回描述符"""
+        engine = self.pipeline.watermark_engine
+        key = engine.sprite_key(text, resolved)
+        entry = sprites.get(key)
+        if entry is None:
+            sprite = engine.get_sprite(text, resolved)
+            # 与引擎合成方式一致：图层先以自身 alpha 为蒙版贴到透明底上
+            layer = Image.new("RGBA", sprite.size, (0, 0, 0, 0))
+            layer.paste(sprite, (0, 0), sprite)
+            entry = sprites[key] = registry.put(layer)
+        return entry
+
+    def run(self, paths, settings, folder, prefix="wm_", suffix="_watermarked", fmt="PNG", metrics=None):
+        """
+        多进程导出，按完成顺序逐张产出 (源路径, 输出路径或 None)。
+        传入 BatchMetrics 时报告读写字节数（按文件大小）与处理中的图片数。
+        """
+        results = queue.Queue()
+        slots = threading.Semaphore(self.max_in_flight)
+        registry = SharedImageRegistry()
+        sprites = {}
+        pending = [0]
+        lock = threading.Lock()
+        p = self.pipeline
+
+        def finish(path, ref, dst):
+            registry.release(ref)
+            slots.release()
+            if metrics is not None and dst:
+                try:
+                    metrics.add_written(os.path.getsize(dst))
+                except OSError:
+                    pass
+            results.put((path, dst))
+            with lock:
+                pending[0] -= 1
+                if pending[0] == 0:
+                    results.put(_DONE)
+
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            def chain(path, ref, candidates, layout, save_path, to_srgb, icc, meta, orientation):
+                def submit(callback, fn, *args):
+                    try:
+                        pool.submit(fn, *args).add_done_callback(callback)
+                    except RuntimeError:  # 进程池已关闭（生成器被提前关闭）
+                        finish(path, ref, None)
+
+                def after_decode(fut):
+                    if not _ok(fut):
+                        return finish(path, ref, None)
+                    submit(after_composite, _stage_composite, ref, candidates, layout)
+
+                def after_composite(fut):
+                    if not _ok(fut):
+                        return finish(path, ref, None)
+                    submit(after_encode, _stage_encode, ref, save_path, fmt, icc, meta)
+
+                def after_encode(fut):
+                    finish(path, ref, fut.result() if fut.exception() is None else None)
+
+                submit(after_decode, _stage_decode, path, ref, to_srgb, orientation)
+
+            with lock:
+                pending[0] = 1  # 提交阶段自身占一个计数，避免提前结束
+            if metrics is not None:
+                metrics.gauge("in_flight", lambda: pending[0])  # 含提交阶段自身的 1 个计数
+            try:
+                for path in paths:
+                    header = self._read_header(path)
+                    if header is None:
+                        results.put((path, None))
+                        continue
+                    size, icc, meta, orientation = header
+                    if metrics is not None:
+                        metrics.add_read(os.path.getsize(path))
+                    # 非 RGB 配置文件（灰度 / CMYK）的像素转为 RGBA 后只能转换到 sRGB
+                    to_srgb = bool(icc) and (p.color.policy == "srgb" or profile_color_space(icc) != "RGB")
+                    slots.acquire()
+                    ref = registry.create("RGBA", size)
+                    candidates, layout = self._placements(registry, sprites, size, settings,
+                                                          None if to_srgb else icc)
+                    save_path = p.build_output_path(path, folder, prefix, suffix, fmt)
+                    with lock:
+                        pending[0] += 1
+                    chain(path, ref, candidates, layout, save_path, to_srgb, SRGB_ICC if to_srgb else icc,
+                          meta, orientation)
+                    while not results.empty():
+                        item = results.get()
+                        if item is not _DONE:
+                            yield item
+                with lock:
+                    pending[0] -= 1
+                    if pending[0] == 0:
+                        results.put(_DONE)
+                while True:
+                    item = results.get()
+                    if item is _DONE:
+                        break
+                    yield item
+            finally:
+                pool.shutdown(wait=True, cancel_futures=True)
+                registry.close()
+                if metrics is not None:
+                    metrics.remove_gauge("in_flight")
+
+
+def _ok(fut):
+    return fut.exception() is None and fut.result()
@@ -0,0 +1,165 @@
+"""
+小样（联系表）生成模块：把一批图片的带水印缩略图按网格排成若干页，供客户挑片。
+- 不做整图解码：JPEG 按 draft 直接解码到略大于格子的尺寸（只解 DC/低频系数），其他格式解码后用 reduce 缩小
+- 缩略图上的水印使用引擎缓存的水印图层（相对字号按缩略图尺寸换算、绝对字号按缩放比例换算，都分档，
+  同一档字号的缩略图共用同一个图层），只在缩略图上合成
+- 页面画布只分配一次：缩略图直接贴到画布的格子里，写出一页后用背景色清空再排下一页
+- 缩略图在线程池中并行解码（预读两页），按输入顺序排版
+- 方向按 EXIF 转正，带 ICC 配置文件的图片转换到 sRGB
+依赖：PIL.Image, PIL.ImageDraw, PIL.ImageFont, core.export_pipeline, core.metadata, core.color_management,
+      core.watermark_engine
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
+from core.color_management import default_color_manager, to_rgba
+from core.export_pipeline import ExportPipeline, FORMAT_EXTENSIONS
+from core.metadata import ORIENTATION_TRANSPOSE, capture_metadata, oriented_size
+from core.watermark_engine import quantize_font_size
+
+
+class ProofSheetLayout:
+    def __init__(self, columns=6, rows=5, tile=320, gap=16, margin=40, label_size=14,
+                 background=(255, 255, 255), label_color=(64, 64, 64)):
+        self.columns = columns
+        self.rows = rows
+        self.tile = tile              # 格子边长（像素），缩略图等比缩放到格子内
+        self.gap = gap
+        self.margin = margin
+        self.label_size = label_size  # 文件名字号，0 表示不标注文件名
+        self.background = background
+        self.label_color = label_color
+
+    @property
+    def per_page(self):
+        return self.columns * self.rows
+
+    @property
+    def label_height(self):
+        return self.label_size + 6 if self.label_size else 0
+
+    @property
+    def page_size(self):
+        cell_h = self.tile + self.label_height
+        return (2 * self.margin + self.columns * self.tile + (self.columns - 1) * self.gap,
+                2 * self.margin + self.rows * cell_h + (self.rows - 1) * self.gap)
+
+    def cell_origin(self, index):
+        """页内第 index 个格子的左上角"""
+        row, col = divmod(index, self.columns)
+        return (self.margin + col * (self.tile + self.gap),
+                self.margin + row * (self.tile + self.label_height + self.gap))
+
+
+def load_thumbnail(path, box):
+    """解码为不超过 box 的 RGBA 缩略图（方向已转正、sRGB），返回 (缩略图, 原图转正后的尺寸)"""
+    with Image.open(path) as im:
+        meta = capture_metadata(im)
+        orientation = meta.orientation if meta else 1
+        full = oriented_size(im.size, orientation)
+        stored_box = (box[1], box[0]) if full != im.size else box
+        im.draft("RGB", stored_box)  # 只对 JPEG 生效
+        img = default_color_manager().to_srgb(im)
+        if img.mode == "P":
+            img = img.convert("RGBA")
+        # 先缩小再转 RGBA，模式转换只作用于缩略图
+        img.thumbnail(stored_box, Image.BICUBIC, reducing_gap=2.0)
+        img = to_rgba(img)
+    if orientation != 1:
+        img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+    return img, full
+
+
+class ProofSheetBuilder:
+    def __init__(self, layout=None, pipeline=None):
+        self.layout = layout or ProofSheetLayout()
+        self.pipeline = pipeline or ExportPipeline()
+
+    def _label_font(self):
+        try:
+            return ImageFont.load_default(self.layout.label_size)
+        except Exception:
+            return ImageFont.load_default()
+
+    def watermark_thumbnail(self, thumb, full_size, settings):
+        """在缩略图上合成缓存的水印图层（就地修改）"""
+        engine = self.pipeline.watermark_engine
+        text = settings.get("text", "")
+        if not text:
+            return thumb
+        if settings.get("font_size_ratio"):
+            scaled = engine.resolve_settings(thumb.size, settings)
+        else:
+            scaled = dict(settings)
+            scaled["font_size"] = quantize_font_size(settings.get("font_size", 36) * thumb.width / full_size[0])
+        scaled = engine.contrast_settings(thumb, engine.placement_settings(thumb, scaled, text), text)
+        sprite = engine.get_sprite(text, scaled)
+        x, y = engine.get_watermark_position(thumb.size, sprite.size, settings=scaled)
+        thumb.alpha_composite(sprite, dest=(max(0, x), max(0, y)))
+        return thumb
+
+    def _tile(self, path, settings):
+        tile = self.layout.tile
+        try:
+            thumb, full = load_thumbnail(path, (tile, tile))
+            return self.watermark_thumbnail(thumb, full, settings)
+        except Exception as e:
+            print(f"生成缩略图失败: {path}: {e}")
+            return None
+
+    def _tiles(self, paths, settings, workers):
+        """按输入顺序产出 (路径, 缩略图或 None)，最多预读两页"""
+        window = 2 * self.layout.per_page
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for path in paths:
+                pending.append((path, pool.submit(self._tile, path, settings)))
+                if len(pending) >= window:
+                    path0, fut = pending.popleft()
+                    yield path0, fut.result()
+            while pending:
+                path0, fut = pending.popleft()
+                yield path0, fut.result()
+
+    def build(self, paths, settings, folder, prefix="proof_", fmt="JPEG", workers=None, **params):
+        """
+        生成小样页，写到 folder/<前缀><页码>.<扩展名>。
+        逐页产出 (页面路径或 None, 本页包含的源图路径列表)；缩略图生成失败的图片留空格子。
+        """
+        layout = self.layout
+        workers = workers or os.cpu_count() or 2
+        if fmt == "JPEG" and not params:
+            params = {"quality": 85}
+        os.makedirs(folder, exist_ok=True)
+        page = Image.new("RGB", layout.page_size, layout.background)
+        draw = ImageDraw.Draw(page)
+        font = self._label_font() if layout.label_size else None
+        ext = FORMAT_EXTENSIONS.get(fmt, ".jpg")
+        page_no = 0
+        members = []
+
+        def flush():
+            save_path = os.path.join(folder, f"{prefix}{page_no + 1:03d}{ext}")
+            ok = self.pipeline.exporter.save_image(page, save_path, **params)
+            page.paste(layout.background, (0, 0, *page.size))
+            return save_path if ok else None
+
+        for path, thumb in self._tiles(paths, settings, workers):
+            x, y = layout.cell_origin(len(members))
+            members.append(path)
+            if thumb is not None:
+                offset = (x + (layout.tile - thumb.width) // 2, y + (layout.tile - thumb.height) // 2)
+                page.paste(thumb, offset, thumb)
+            if font is not None:
+                name = os.path.basename(path)
+                while len(name) > 1 and draw.textlength(name, font=font) > layout.tile:
+                    name = name[:-2] + "…"
+                draw.text((x + layout.tile // 2, y + layout.tile + 3), name, fill=layout.label_color,
+                          font=font, anchor="ma")
+            if len(members) == layout.per_page:
+                yield flush(), members
+                page_no += 1
+                members = []
+        if members:
+            yield flush(), members
@@ -0,0 +1,115 @@
+"""
+多规格输出模块：一次解码，输出多个尺寸/格式的带水印版本（原图、网页图、缩略图等）。
+- 每张源图只解码一次
+- 规格按尺寸从大到小处理，每一级从上一级缩小得到，缩放成本逐级降低
+- 字号按缩放比例（再乘以规格的 font_scale）换算并分档，不同分辨率的源图落在同一档时共用缓存的水印图层；
+  相对字号的模板按各规格尺寸自动换算（同样分档）
+导出配置文件（JSON）示例：
+    {"renditions": [
+        {"name": "full", "format": "JPEG", "preset": "jpeg-high"},
+        {"name": "web", "max_size": 2048, "format": "JPEG", "preset": "jpeg-web"},
+        {"name": "thumb", "max_size": 400, "format": "JPEG", "preset": "jpeg-thumb", "font_scale": 1.5}
+    ]}
+依赖：core.export_pipeline, core.watermark_engine, PIL.Image
+"""
+import json
+import os
+from PIL import Image
+from core.export_pipeline import ExportPipeline
+from core.watermark_engine import quantize_font_size
+
+# 编码预设：格式 → 保存参数
+ENCODER_PRESETS = {
+    "jpeg-high": {"quality": 92, "subsampling": 0, "optimize": True},
+    "jpeg-web": {"quality": 82, "progressive": True, "optimize": True},
+    "jpeg-thumb": {"quality": 75},
+    "png-fast": {"compress_level": 1},
+    "png-small": {"compress_level": 9, "optimize": True},
+    "webp-web": {"quality": 80, "method": 4},
+}
+
+
+class Rendition:
+    def __init__(self, name, max_size=None, format="JPEG", preset=None, font_scale=1.0):
+        self.name = name
+        self.max_size = max_size      # 长边像素上限，None 表示保持原尺寸
+        self.format = format
+        self.preset = preset
+        self.font_scale = font_scale  # 在按比例缩放的字号基础上再乘的系数（小图可适当放大水印）
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data.get("max_size"), data.get("format", "JPEG"),
+                   data.get("preset"), data.get("font_scale", 1.0))
+
+    def encoder_params(self):
+        return dict(ENCODER_PRESETS.get(self.preset, {}))
+
+    def target_size(self, size):
+        """按长边上限等比缩放后的尺寸（不放大）"""
+        w, h = size
+        if not self.max_size or max(w, h) <= self.max_size:
+            return w, h
+        scale = self.max_size / max(w, h)
+        return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+DEFAULT_RENDITIONS = [
+    Rendition("full", None, "JPEG", "jpeg-high"),
+    Rendition("web", 2048, "JPEG", "jpeg-web"),
+    Rendition("thumb", 400, "JPEG", "jpeg-thumb"),
+]
+
+
+def load_profile(path):
+    """从 JSON 导出配置加载规格列表"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return [Rendition.from_dict(r) for r in data.get("renditions", [])]
+    except Exception as e:
+        print(f"加载导出配置失败: {e}")
+        return None
+
+
+class RenditionExporter:
+    def __init__(self, renditions=None, pipeline=None):
+        self.renditions = renditions or DEFAULT_RENDITIONS
+        self.pipeline = pipeline or ExportPipeline()
+
+    def export(self, path, settings, folder, prefix="wm_", suffix="_watermarked"):
+        """
+        导出一张源图的全部规格，每个规格写到 folder/<规格名>/ 下。
+        返回 [(规格名, 输出路径或 None)]。
+        """
+        p = self.pipeline
+        img = p.image_loader.load_image(path)
+        if img is None:
+            return [(r.name, None) for r in self.renditions]
+
+        orig_w = img.width
+        base_font = settings.get("font_size", 36)
+        results = {}
+        current = img
+        # 从大到小处理，每一级从上一级缩小
+        for r in sorted(self.renditions, key=lambda r: r.target_size(img.size)[0], reverse=True):
+            size = r.target_size(img.size)
+            if size != current.size:
+                current = current.resize(size, Image.LANCZOS, reducing_gap=3.0)
+            scaled = dict(settings)
+            if settings.get("font_size_ratio"):
+                # 相对字号随图片尺寸自动换算，只需乘以规格系数
+                scaled["font_size_ratio"] = settings["font_size_ratio"] * r.font_scale
+            else:
+                scaled_font = base_font * size[0] / orig_w * r.font_scale
+                # 未缩放的规格保持用户设置的字号，其余分档，避免每种源图宽度各渲染一个图层
+                scaled["font_size"] = base_font if scaled_font == base_font else quantize_font_size(scaled_font)
+
+            out_dir = os.path.join(folder, r.name)
+            os.makedirs(out_dir, exist_ok=True)
+            save_path = p.build_output_path(path, out_dir, prefix, suffix, r.format)
+            watermarked = p.render(current, scaled, r.format)
+            ok = watermarked is not None and p.exporter.save_image(watermarked, save_path, format=r.format,
+                                                                    **r.encoder_params())
+            results[r.name] = save_path if ok else None
+        return [(r.name, results[r.name]) for r in self.renditions]
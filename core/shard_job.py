@@ -0,0 +1,343 @@
+"""
+分片批处理模块：把大批量图片拆成确定性的分片，多台机器上的无界面 worker
+通过共享文件系统上的锁文件认领分片并处理，无需任何协调服务。
+
+作业目录结构：
+    manifest.json        作业清单（水印设置、输出参数、分片列表）
+    shards/00000.json    每个分片包含的输入文件（相对 input_root 的路径）
+    locks/00000.lock     认领锁，O_CREAT|O_EXCL 原子创建，内容记录持有者，处理中定期刷新修改时间；
+    locks/00000.lock.takeover  删除锁（接管超时锁、释放锁）前 O_EXCL 创建的接管标记，持有标记时核对持有者后才删除锁，
+                         锁文件在核对期间始终留在原处
+    done/00000.json      完成记录
+依赖：core.export_pipeline, core.color_management
+"""
+import json
+import os
+import socket
+import time
+from core.color_management import ColorManager
+from core.export_pipeline import ExportPipeline, is_image_file
+
+MANIFEST_NAME = "manifest.json"
+TAKEOVER_MARKER_TIMEOUT = 60  # 接管标记只在核对、删除锁的瞬间存在，超过该秒数视为持有者已崩溃
+TAKEOVER_MARKER_WAIT = 5      # 等待其他 worker 释放接管标记的最长秒数
+
+
+# ---------- 工具函数 ----------
+def _write_json_atomic(path, data):
+    """先写临时文件再替换，保证其他节点不会读到写了一半的文件"""
+    tmp = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _shard_id(index):
+    return f"{index:05d}"
+
+
+def collect_images(input_root):
+    """递归收集图片，返回排序后的相对路径（保证分片结果确定）"""
+    files = []
+    for root, _, filenames in os.walk(input_root):
+        for f in filenames:
+            if is_image_file(f):
+                rel = os.path.relpath(os.path.join(root, f), input_root)
+                files.append(rel.replace(os.sep, "/"))
+    files.sort()
+    return files
+
+
+# ---------- 创建作业 ----------
+def create_job(job_dir, input_root, output_root, settings, shard_size=1000,
+               prefix="wm_", suffix="_watermarked", fmt="PNG", files=None, partial_jpeg=False,
+               color_policy="keep"):
+    """
+    创建分片作业。相同的输入集合与 shard_size 总是得到相同的分片。
+    返回 manifest 字典。
+    """
+    if os.path.exists(os.path.join(job_dir, MANIFEST_NAME)):
+        raise FileExistsError(f"作业已存在: {job_dir}")
+    if files is None:
+        files = collect_images(input_root)
+    else:
+        files = sorted(files)
+    shard_size = max(1, int(shard_size))
+
+    for sub in ("shards", "locks", "done"):
+        os.makedirs(os.path.join(job_dir, sub), exist_ok=True)
+
+    shards = []
+    for index, start in enumerate(range(0, len(files), shard_size)):
+        shard_files = files[start:start + shard_size]
+        sid = _shard_id(index)
+        _write_json_atomic(os.path.join(job_dir, "shards", f"{sid}.json"), shard_files)
+        shards.append({"id": sid, "count": len(shard_files)})
+
+    manifest = {
+        "version": 1,
+        "created": time.time(),
+        "input_root": os.path.abspath(input_root),
+        "output_root": os.path.abspath(output_root),
+        "settings": settings,
+        "prefix": prefix,
+        "suffix": suffix,
+        "format": fmt,
+        "partial_jpeg": partial_jpeg,
+        "color_policy": color_policy,
+        "shard_size": shard_size,
+        "total": len(files),
+        "shards": shards,
+    }
+    # manifest 最后写入：它存在即表示作业已完整创建
+    _write_json_atomic(os.path.join(job_dir, MANIFEST_NAME), manifest)
+    return manifest
+
+
+def load_manifest(job_dir):
+    return _read_json(os.path.join(job_dir, MANIFEST_NAME))
+
+
+def job_status(job_dir):
+    """统计作业进度：总分片数、已完成、处理中、待处理"""
+    manifest = load_manifest(job_dir)
+    done = locked = 0
+    processed = failed = 0
+    for shard in manifest["shards"]:
+        sid = shard["id"]
+        done_path = os.path.join(job_dir, "done", f"{sid}.json")
+        if os.path.exists(done_path):
+            done += 1
+            record = _read_json(done_path)
+            processed += record.get("processed", 0)
+            failed += len(record.get("failed", []))
+        elif os.path.exists(os.path.join(job_dir, "locks", f"{sid}.lock")):
+            locked += 1
+    total = len(manifest["shards"])
+    return {
+        "shards": total,
+        "done": done,
+        "in_progress": locked,
+        "pending": total - done - locked,
+        "images": manifest["total"],
+        "processed": processed,
+        "failed": failed,
+    }
+
+
+# ---------- Worker ----------
+class ShardWorker:
+    """
+    分片 worker：循环认领未完成的分片并处理。
+    lease_timeout 秒内未刷新的锁视为所属 worker 已失效，可以被其他 worker 接管。
+    """
+
+    def __init__(self, job_dir, worker_id=None, pipeline=None, lease_timeout=600, heartbeat=30):
+        self.job_dir = job_dir
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.pipeline = pipeline or ExportPipeline()
+        self.lease_timeout = lease_timeout
+        self.heartbeat = heartbeat
+        self.manifest = load_manifest(job_dir)
+        if self.manifest.get("partial_jpeg"):
+            self.pipeline.partial_jpeg = True
+        self.pipeline.color = ColorManager(self.manifest.get("color_policy", "keep"))
+
+    def _lock_path(self, sid):
+        return os.path.join(self.job_dir, "locks", f"{sid}.lock")
+
+    def _done_path(self, sid):
+        return os.path.join(self.job_dir, "done", f"{sid}.json")
+
+    def _try_claim(self, sid):
+        if os.path.exists(self._done_path(sid)):
+            return False
+        lock_path = self._lock_path(sid)
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._break_stale_lock(lock_path):
+                return False
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"worker": self.worker_id, "claimed": time.time()}, f)
+        # 加锁期间其他 worker 可能刚好完成了该分片
+        if os.path.exists(self._done_path(sid)):
+            self._release(sid)
+            return False
+        return True
+
+    @staticmethod
+    def _lock_info(path):
+        """读取锁文件的 (持有者, 修改时间)，文件不存在时返回 None"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                mtime = os.fstat(f.fileno()).st_mtime
+                try:
+                    owner = json.load(f).get("worker")
+                except ValueError:
+                    owner = None  # 刚创建、尚未写入内容
+            return owner, mtime
+        except OSError:
+            return None
+
+    @staticmethod
+    def _acquire_marker(marker):
+        """O_EXCL 创建接管标记；标记被占用时等待，超时的标记（持有者崩溃）直接清除"""
+        deadline = time.time() + TAKEOVER_MARKER_WAIT
+        while True:
+            try:
+                os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(marker) >= TAKEOVER_MARKER_TIMEOUT:
+                        os.remove(marker)
+                        continue
+                except OSError:
+                    continue  # 标记刚被释放
+            except OSError:
+                return False
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def _remove_lock_if(self, lock_path, check):
+        """
+        持有接管标记期间核对锁文件：check(持有者, 修改时间) 为真才删除。
+        所有删除锁的操作都先持有标记，核对与删除之间不会有别人删掉或换掉这把锁；
+        锁文件一直留在原处，其他 worker 也无法趁机认领该分片。
+        返回 True 表示锁已删除或本来就不存在。
+        """
+        marker = f"{lock_path}.takeover"
+        if not self._acquire_marker(marker):
+            return False
+        try:
+            info = self._lock_info(lock_path)
+            if info is None:
+                return True
+            if not check(*info):
+                return False
+            os.remove(lock_path)
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+        finally:
+            try:
+                os.remove(marker)
+            except OSError:
+                pass
+
+    def _break_stale_lock(self, lock_path):
+        """锁超时则接管：持有接管标记后再次确认仍是同一个持有者且仍然超时，才删除"""
+        info = self._lock_info(lock_path)
+        if info is None:
+            return True  # 锁刚被释放
+        owner, mtime = info
+        if time.time() - mtime < self.lease_timeout:
+            return False
+        return self._remove_lock_if(
+            lock_path, lambda o, m: o == owner and time.time() - m >= self.lease_timeout)
+
+    def _release(self, sid):
+        """只删除本 worker 持有的锁"""
+        self._remove_lock_if(self._lock_path(sid), lambda owner, _: owner == self.worker_id)
+
+    def _renew(self, sid):
+        """刷新锁的修改时间；锁已不属于本 worker（超时后被接管）时返回 False"""
+        try:
+            with open(self._lock_path(sid), "r", encoding="utf-8") as f:
+                try:
+                    owner = json.load(f).get("worker")
+                except ValueError:
+                    owner = None
+                if owner != self.worker_id:
+                    return False
+                os.utime(f.fileno())  # 按已打开的文件刷新，不会碰到期间换上的其他锁
+            return True
+        except OSError:
+            return False
+
+    def claim_next(self):
+        """认领下一个可用分片，没有则返回 None"""
+        for shard in self.manifest["shards"]:
+            if self._try_claim(shard["id"]):
+                return shard["id"]
+        return None
+
+    def process_shard(self, sid):
+        m = self.manifest
+        files = _read_json(os.path.join(self.job_dir, "shards", f"{sid}.json"))
+        start = time.time()
+        last_beat = start
+        processed = 0
+        failed = []
+        for rel in files:
+            src = os.path.join(m["input_root"], rel)
+            # 保留子目录结构，避免不同文件夹下的同名文件互相覆盖
+            out_dir = os.path.join(m["output_root"], os.path.dirname(rel))
+            try:
+                os.makedirs(out_dir, exist_ok=True)
+                if self.pipeline.process(src, m["settings"], out_dir, m["prefix"], m["suffix"], m["format"]):
+                    processed += 1
+                else:
+                    failed.append(rel)
+            except Exception as e:
+                print(f"分片 {sid} 处理失败: {rel}: {e}")
+                failed.append(rel)
+            now = time.time()
+            if now - last_beat >= self.heartbeat:
+                # 刷新锁的修改时间，表明 worker 仍然存活
+                if not self._renew(sid):
+                    print(f"分片 {sid} 的锁已被其他 worker 接管，停止处理")
+                    return processed, failed
+                last_beat = now
+
+        _write_json_atomic(self._done_path(sid), {
+            "worker": self.worker_id,
+            "processed": processed,
+            "failed": failed,
+            "started": start,
+            "finished": time.time(),
+        })
+        self._release(sid)
+        return processed, failed
+
+    def run(self, max_shards=None, on_shard_done=None):
+        """持续处理直到没有可认领的分片，返回处理的分片数"""
+        count = 0
+        while max_shards is None or count < max_shards:
+            sid = self.claim_next()
+            if sid is None:
+                break
+            processed, failed = self.process_shard(sid)
+            count += 1
+            if on_shard_done:
+                on_shard_done(sid, processed, failed)
+        return count
+
+
+def _run_worker_process(job_dir, worker_id):
+    return ShardWorker(job_dir, worker_id=worker_id).run()
+
+
+def run_local_workers(job_dir, workers=2):
+    """在本机启动多个 worker 进程（用于本地测试或单机多核运行），返回各 worker 处理的分片数"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_worker_process, job_dir, f"{socket.gethostname()}-{os.getpid()}-local{i}")
+                   for i in range(workers)]
+        return [f.result() for f in futures]
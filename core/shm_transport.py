@@ -0,0 +1,142 @@
+"""
+共享内存传输模块：多进程导出时，解码后的像素和水印图层放在 multiprocessing.shared_memory 段中，
+进程之间只传递很小的描述符（段名、模式、尺寸），不再 pickle 整张图片。
+- 段由主进程创建并登记引用计数，使用方通过 retain/release 增减引用，计数归零时立即释放（unlink）
+- 子进程按描述符映射出 PIL 图像视图（Image.frombuffer），读写都直接作用于共享内存，没有像素拷贝
+- 水印图层只在主进程渲染一次，各子进程映射后缓存复用
+依赖：multiprocessing.shared_memory, PIL.Image
+"""
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from PIL import Image
+
+# PIL 模式 → 每像素字节数（只支持 frombuffer 可直接映射的格式）
+SHARED_MODE_BYTES = {"RGBA": 4, "L": 1}
+
+
+class SharedImageRef:
+    """共享内存中图像的描述符，可廉价地在进程间传递"""
+
+    __slots__ = ("name", "mode", "size")
+
+    def __init__(self, name, mode, size):
+        self.name = name
+        self.mode = mode
+        self.size = tuple(size)
+
+    @property
+    def nbytes(self):
+        return self.size[0] * self.size[1] * SHARED_MODE_BYTES[self.mode]
+
+    def __getstate__(self):
+        return self.name, self.mode, self.size
+
+    def __setstate__(self, state):
+        self.name, self.mode, self.size = state
+
+    def __repr__(self):
+        return f"SharedImageRef({self.name!r}, {self.mode!r}, {self.size})"
+
+
+def _view(shm, ref):
+    """把共享内存段映射为可写的 PIL 图像（不拷贝）"""
+    img = Image.frombuffer(ref.mode, ref.size, shm.buf, "raw", ref.mode, 0, 1)
+    img.readonly = 0  # frombuffer 默认只读，写入时会先复制；共享段需要原地写入
+    return img
+
+
+def _attach(name):
+    """映射已有的共享段；Python 3.13+ 不让附加方的 resource_tracker 接管释放"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+@contextmanager
+def attached_image(ref):
+    """
+    在任意进程中映射描述符对应的图像，退出时解除映射（不释放段，释放由登记方负责）。
+    with 块内得到的图像视图不能带出块外使用。
+    """
+    shm = _attach(ref.name)
+    img = _view(shm, ref)
+    try:
+        yield img
+    finally:
+        img.close()
+        del img
+        shm.close()
+
+
+class SharedImageRegistry:
+    """主进程侧：创建共享段并按引用计数释放"""
+
+    def __init__(self):
+        self._segments = {}  # 段名 → [SharedMemory, 引用计数]
+        self._lock = threading.Lock()
+
+    def create(self, mode, size):
+        """创建未初始化的图像段（引用计数为 1），供子进程直接解码写入"""
+        ref = SharedImageRef(None, mode, size)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, ref.nbytes))
+        ref.name = shm.name
+        with self._lock:
+            self._segments[shm.name] = [shm, 1]
+        return ref
+
+    def put(self, img):
+        """把已有图像拷贝进新段（只在主进程拷贝这一次），返回描述符"""
+        if img.mode not in SHARED_MODE_BYTES:
+            img = img.convert("RGBA")
+        ref = self.create(img.mode, img.size)
+        shm = self._segments[ref.name][0]
+        view = _view(shm, ref)
+        view.paste(img, (0, 0))
+        view.close()
+        del view
+        return ref
+
+    def retain(self, ref):
+        with self._lock:
+            self._segments[ref.name][1] += 1
+        return ref
+
+    def release(self, ref):
+        """引用计数减一，归零时关闭并释放共享段"""
+        with self._lock:
+            entry = self._segments.get(ref.name)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._segments[ref.name]
+        self._free(entry[0])
+
+    @staticmethod
+    def _free(shm):
+        try:
+            shm.close()
+            shm.unlink()
+        except (BufferError, FileNotFoundError) as e:
+            print(f"释放共享内存失败: {e}")
+
+    def live_segments(self):
+        with self._lock:
+            return len(self._segments)
+
+    def close(self):
+        """释放所有剩余的段（出错或提前退出时兜底）"""
+        with self._lock:
+            entries = list(self._segments.values())
+            self._segments.clear()
+        for shm, _ in entries:
+            self._free(shm)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
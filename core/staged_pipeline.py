@@ -0,0 +1,237 @@
+"""
+分阶段流式导出模块：读取、计算、写入三个阶段并行，用有界队列连接。
+- 读取阶段：单线程预读文件字节（网络共享盘上读取与计算重叠）
+- 计算阶段：解码 → 加水印 → 编码到内存（可多线程，Pillow 编解码会释放 GIL）
+- 写入阶段：单线程带缓冲的原子写入（临时文件 + 替换），或写入 ZIP/TAR 归档
+队列深度决定每个阶段最多领先下游多少张图片，同时限制内存占用。
+设置 memory_budget 时先预扫描文件头做规划：大图优先，计算阶段按估计的峰值内存申请预算。
+传入 BatchMetrics 时各阶段报告读写字节数、忙碌时间与队列深度（结果张数由调用方通过 metrics.track 计数）。
+依赖：core.export_pipeline, core.dedupe, core.batch_planner
+"""
+import io
+import os
+import queue
+import threading
+from contextlib import nullcontext
+from core.batch_planner import MemoryBudget, plan_batch
+from core.dedupe import group_duplicates
+from core.export_pipeline import ExportPipeline
+
+_DONE = object()
+
+
+def _common_root(paths):
+    """各源文件所在目录的共同上级目录，无法确定（如不同盘符）时返回 None"""
+    try:
+        return os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths]) if paths else None
+    except ValueError:
+        return None
+
+
+class StagedExportPipeline:
+    def __init__(self, pipeline=None, read_depth=4, write_depth=4, compute_workers=1, memory_budget=None):
+        self.pipeline = pipeline or ExportPipeline()
+        self.read_depth = max(1, read_depth)
+        self.write_depth = max(1, write_depth)
+        self.compute_workers = max(1, compute_workers)
+        self.memory_budget = memory_budget  # 字节，None 表示不限制
+
+    def plan(self, paths, fmt="PNG", progress=None):
+        """预扫描文件头，给出处理顺序与耗时/内存估计（progress 见 plan_batch）"""
+        return plan_batch(paths, self.compute_workers, self.memory_budget, fmt, progress)
+
+    def run(self, paths, settings, folder, prefix="wm_", suffix="_watermarked", fmt="PNG",
+            dedupe=False, hard_link=True, plan=None, sink=None, metrics=None):
+        """
+        流式导出，按完成顺序逐张产出 (源路径, 输出路径或 None)。
+        sink 为 ArchiveSink 时图片写入归档，folder 被忽略：条目按源文件相对各输入共同上级目录的路径命名
+        （不同文件夹下的同名文件不会冲突），结果在条目真正写入归档后才产出，输出路径形如 "分卷路径:条目名"。
+        生成器被提前关闭时各阶段线程会自动停止。
+        """
+        archive_root = None
+        if sink is not None:
+            folder = ""
+            archive_root = _common_root(paths)
+        groups = group_duplicates(paths) if dedupe else [[p] for p in paths]
+        job_memory = {}
+        budget = None
+        if self.memory_budget is not None or plan is not None:
+            if plan is None:
+                plan = self.plan([g[0] for g in groups], fmt)
+            rank = {path: i for i, path in enumerate(plan.order)}
+            groups.sort(key=lambda g: rank.get(g[0], len(rank)))
+            job_memory = {job["path"]: job["memory"] for job in plan.jobs}
+            if self.memory_budget is not None:
+                budget = MemoryBudget(self.memory_budget)
+        read_q = queue.Queue(self.read_depth)
+        write_q = queue.Queue(self.write_depth)
+        result_q = queue.Queue()
+        stop = threading.Event()
+
+        def busy(worker):
+            return metrics.busy(worker) if metrics is not None else nullcontext()
+
+        if metrics is not None:
+            metrics.gauge("read", read_q.qsize)
+            metrics.gauge("write", write_q.qsize)
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.2)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+            return _DONE
+
+        # ---------- 读取阶段 ----------
+        def reader():
+            try:
+                for group in groups:
+                    try:
+                        with busy("reader"), open(group[0], "rb") as f:
+                            data = f.read()
+                    except OSError as e:
+                        print(f"读取图片失败: {group[0]}: {e}")
+                        data = None
+                    if metrics is not None and data is not None:
+                        metrics.add_read(len(data))
+                    if not put(read_q, (group, data)):
+                        return
+            finally:
+                for _ in range(self.compute_workers):
+                    put(read_q, _DONE)
+
+        # ---------- 计算阶段 ----------
+        def compute(worker):
+            p = self.pipeline
+            try:
+                while True:
+                    item = get(read_q)
+                    if item is _DONE:
+                        break
+                    group, data = item
+                    encoded = None
+                    out_fmt = fmt
+                    memory = job_memory.get(group[0], 0)
+                    if budget is not None and not budget.acquire(memory, stop):
+                        return
+                    try:
+                        if data is not None:
+                            with busy(worker):
+                                encoded, out_fmt = self._render_bytes(data, group[0], settings, fmt)
+                    except Exception as e:
+                        print(f"处理图片失败: {group[0]}: {e}")
+                    finally:
+                        if budget is not None:
+                            budget.release(memory)
+                    save_path = p.build_output_path(group[0], folder, prefix, suffix, out_fmt)
+                    if not put(write_q, (group, save_path, encoded, out_fmt)):
+                        return
+            finally:
+                put(write_q, _DONE)
+
+        # ---------- 写入阶段 ----------
+        def writer():
+            exporter = self.pipeline.exporter
+            finished = 0
+            try:
+                while finished < self.compute_workers:
+                    item = get(write_q)
+                    if item is _DONE:
+                        if stop.is_set():
+                            return
+                        finished += 1
+                        continue
+                    group, save_path, encoded, out_fmt = item
+                    if sink is not None:
+                        for src in group:
+                            if encoded is None:
+                                result_q.put((src, None))
+                            else:
+                                sink.add(entry_name(src, out_fmt), encoded, archived(src, len(encoded)))
+                        continue
+                    with busy("writer"):
+                        ok = encoded is not None and exporter.write_atomic(encoded, save_path)
+                    if metrics is not None and ok:
+                        metrics.add_written(len(encoded))
+                    result_q.put((group[0], save_path if ok else None))
+                    for dup in group[1:]:
+                        dup_path = p_build(dup, out_fmt)
+                        if ok and dup_path != save_path:
+                            if not exporter.link_or_copy(save_path, dup_path, hard_link):
+                                dup_path = None
+                        elif not ok:
+                            dup_path = None
+                        result_q.put((dup, dup_path))
+            finally:
+                if sink is not None:
+                    sink.flush()  # 等归档写线程报告完所有条目
+                result_q.put(_DONE)
+
+        def p_build(src, out_fmt):
+            return self.pipeline.build_output_path(src, folder, prefix, suffix, out_fmt)
+
+        def entry_name(src, out_fmt):
+            name = os.path.basename(p_build(src, out_fmt))
+            if archive_root is None:
+                return name
+            rel = os.path.relpath(os.path.dirname(os.path.abspath(src)), archive_root)
+            return name if rel == os.curdir else f"{rel.replace(os.sep, '/')}/{name}"
+
+        def archived(src, size):
+            """归档写线程写完条目后的回调：此时才计入写出字节并产出结果"""
+            def on_written(location):
+                if metrics is not None and location:
+                    metrics.add_written(size)
+                result_q.put((src, location))
+            return on_written
+
+        threads = [threading.Thread(target=reader, name="export-reader", daemon=True),
+                   threading.Thread(target=writer, name="export-writer", daemon=True)]
+        threads += [threading.Thread(target=compute, args=(f"compute-{i}",), name=f"export-compute-{i}", daemon=True)
+                    for i in range(self.compute_workers)]
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                item = result_q.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+            if metrics is not None:
+                metrics.remove_gauge("read")
+                metrics.remove_gauge("write")
+
+    def _render_bytes(self, data, path, settings, fmt):
+        """解码、加水印并编码，返回 (字节或 None, 实际输出格式)；多帧源图保持原格式"""
+        p = self.pipeline
+        if p.partial_jpeg and fmt == "JPEG" and path.lower().endswith((".jpg", ".jpeg")):
+            patched = p.patch_jpeg_bytes(data, settings)
+            if patched is not None:
+                return patched, fmt
+        src = p.image_loader.open_image(data)
+        anim_fmt = p.animated_output_format(src)
+        if anim_fmt:
+            buf = io.BytesIO()
+            p.encode_animated(src, settings, buf)
+            return buf.getvalue(), anim_fmt
+        img = p.image_loader.load_bytes(data)
+        if img is None:
+            return None, fmt
+        watermarked = p.render(img, settings, fmt)
+        if watermarked is None:
+            return None, fmt
+        return p.exporter.encode_image(watermarked, fmt), fmt
@@ -1,49 +1,246 @@
 # template_manager.py
+"""
+模板存储：
+- JSON 文件（默认 templates.json）：修改时加文件锁，先重新读取磁盘上的最新内容再写回，
+  写入采用 临时文件 + 替换 的原子方式，多个界面/命令行进程同时修改也不会互相覆盖或写坏文件；
+  读取时按文件修改时间判断是否需要重新加载
+- SQLite（扩展名 .db / .sqlite）：按名称建主键索引，读取单个模板不需要解析全部模板，
+  适合成千上万个客户模板；WAL 模式下多进程可同时读取
+依赖：json, sqlite3, fcntl/msvcrt（文件锁）
+"""
 import json
 import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+
+@contextmanager
+def file_lock(path):
+    """跨进程的排他锁（锁文件为 path + ".lock"）"""
+    lock_path = path + ".lock"
+    with open(lock_path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class JsonTemplateStore:
+    def __init__(self, path):
+        self.path = path
+        self._data = {}
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def _reload_if_changed(self):
+        """文件变化（修改时间/大小）时才重新解析"""
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        data = {}
+        if stamp is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"加载模板失败: {e}")
+                return  # 保留上次成功加载的内容
+        self._data = data
+        self._stamp = stamp
+
+    def _write(self, data):
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self._data = data
+        self._stamp = self._file_stamp()
+
+    def _modify(self, func):
+        """加锁 → 读取最新内容 → 修改 → 原子写回；func 返回 False 时不写"""
+        with self._lock, file_lock(self.path):
+            self._stamp = None  # 强制重新读取，合并其他进程的修改
+            self._reload_if_changed()
+            data = dict(self._data)
+            if func(data) is False:
+                return False
+            self._write(data)
+            return True
+
+    def all(self):
+        with self._lock:
+            self._reload_if_changed()
+            return dict(self._data)
+
+    def get(self, name):
+        with self._lock:
+            self._reload_if_changed()
+            return self._data.get(name)
+
+    def names(self):
+        with self._lock:
+            self._reload_if_changed()
+            return list(self._data.keys())
+
+    def put(self, name, properties):
+        def update(data):
+            data[name] = properties
+        return self._modify(update)
+
+    def put_many(self, templates):
+        def update(data):
+            data.update(templates)
+        return self._modify(update)
+
+    def delete(self, name):
+        def remove(data):
+            if name not in data:
+                return False
+            del data[name]
+        return self._modify(remove)
+
+
+class SqliteTemplateStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS templates ("
+                         "name TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def _conn(self):
+        """每个线程一个连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def all(self):
+        rows = self._conn().execute("SELECT name, data FROM templates ORDER BY rowid").fetchall()
+        return {name: json.loads(data) for name, data in rows}
+
+    def get(self, name):
+        row = self._conn().execute("SELECT data FROM templates WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def names(self):
+        return [r[0] for r in self._conn().execute("SELECT name FROM templates ORDER BY rowid")]
+
+    def put(self, name, properties):
+        return self.put_many({name: properties})
+
+    def put_many(self, templates):
+        conn = self._conn()
+        now = time.time()
+        with conn:  # 单个事务
+            conn.executemany(
+                "INSERT INTO templates (name, data, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+                [(name, json.dumps(props, ensure_ascii=False), now) for name, props in templates.items()])
+        return True
+
+    def delete(self, name):
+        conn = self._conn()
+        with conn:
+            return conn.execute("DELETE FROM templates WHERE name = ?", (name,)).rowcount > 0
+
+
+def open_template_store(path):
+    """按扩展名选择存储后端"""
+    if path.lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteTemplateStore(path)
+    return JsonTemplateStore(path)
+
 
 class TemplateManager:
     def __init__(self, template_file="templates.json", default_template="test1"):
         self.template_file = template_file
         self.default_template = default_template
-        self.templates = self._load_templates()
+        self.store = open_template_store(template_file)
 
         # 启动时加载默认模板
-        self.current_template = self.templates.get(self.default_template, {})
+        self.current_template = self.get_template(self.default_template) or {}
 
-    def _load_templates(self):
-        if not os.path.exists(self.template_file):
-            return {}
-        try:
-            with open(self.template_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"加载模板失败: {e}")
-            return {}
+    @property
+    def templates(self):
+        """全部模板（会读取整个存储，按名称查找请用 get_template）"""
+        return self.store.all()
 
     def save_template(self, name, properties):
-        self.templates[name] = properties
         try:
-            with open(self.template_file, 'w', encoding='utf-8') as f:
-                json.dump(self.templates, f, ensure_ascii=False, indent=2)
-            return True
+            return self.store.put(name, properties)
         except Exception as e:
             print(f"保存模板失败: {e}")
             return False
 
+    def import_templates(self, templates):
+        """批量写入模板（单次加锁/单个事务）"""
+        try:
+            return self.store.put_many(templates)
+        except Exception as e:
+            print(f"导入模板失败: {e}")
+            return False
+
     def get_template(self, name):
-        return self.templates.get(name)
+        try:
+            return self.store.get(name)
+        except Exception as e:
+            print(f"加载模板失败: {e}")
+            return None
 
     def list_templates(self):
-        return list(self.templates.keys())
+        try:
+            return self.store.names()
+        except Exception as e:
+            print(f"加载模板失败: {e}")
+            return []
 
     def delete_template(self, name):
-        if name in self.templates:
-            del self.templates[name]
-            try:
-                with open(self.template_file, 'w', encoding='utf-8') as f:
-                    json.dump(self.templates, f, ensure_ascii=False, indent=2)
-                return True
-            except Exception as e:
-                print(f"删除模板失败: {e}")
-        return False
+        try:
+            return self.store.delete(name)
+        except Exception as e:
+            print(f"删除模板失败: {e}")
+            return False
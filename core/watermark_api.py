@@ -0,0 +1,142 @@
+"""
+库调用接口：源图字节 + 模板/设置 → 编码后的带水印图片字节，不经过文件系统和界面。
+供 Web 后端在进程内直接调用，也是本地 HTTP 服务的处理核心。
+    from core.watermark_api import watermark_bytes
+    out = watermark_bytes(upload_bytes, {"text": "© 示例"}, fmt="JPEG", quality=85)
+依赖：PIL.Image, core.export_pipeline, core.template_manager, core.watermark_engine
+"""
+import io
+import threading
+from PIL import Image
+from core.export_pipeline import ExportPipeline, normalize_settings
+from core.template_manager import TemplateManager
+from core.watermark_engine import AUTO_CONTRAST_VARIANTS, SPRITE_CACHE_SIZE
+
+# 源图格式 → 默认输出格式（未指定 fmt 时尽量保持原格式）
+SOURCE_OUTPUT_FORMATS = {"JPEG": "JPEG", "PNG": "PNG", "WEBP": "WEBP"}
+
+# 各输出格式的默认编码参数（调用方传入的参数优先）
+DEFAULT_ENCODER_PARAMS = {"JPEG": {"quality": 90}, "PNG": {"compress_level": 6}, "WEBP": {"quality": 85}}
+
+# 预热相对字号模板时假定的常见上传尺寸（相对字号按每张图的短边换算，只能按预计的尺寸预热）
+WARM_UP_SIZES = ((6000, 4000), (4032, 3024), (1920, 1080))
+
+
+class WatermarkAPI:
+    """
+    线程安全的字节接口。实例内的流水线（字体表、水印图层缓存）在所有调用间共享，
+    同一模板的后续请求不再重新渲染文字。
+    """
+
+    def __init__(self, templates_file="templates.json", pipeline=None):
+        self.pipeline = pipeline or ExportPipeline()
+        self.templates_file = templates_file
+        self._templates = None
+        self._lock = threading.Lock()
+
+    # ---------- 模板 ----------
+    def _template_manager(self):
+        with self._lock:
+            if self._templates is None:
+                self._templates = TemplateManager(self.templates_file)
+            return self._templates
+
+    def resolve_settings(self, template=None, settings=None):
+        """模板设置与调用方设置合并（后者覆盖前者），整理为引擎格式；模板不存在时返回 None"""
+        merged = {}
+        if template:
+            found = self._template_manager().get_template(template)
+            if found is None:
+                print(f"模板不存在: {template}")
+                return None
+            merged.update(found)
+        merged.update(settings or {})
+        return normalize_settings(merged)
+
+    def warm_up(self, templates=None, sizes=WARM_UP_SIZES):
+        """
+        预先渲染模板的水印图层（并加载字体），避免首个请求承担这部分耗时。
+        相对字号（font_size_ratio）的模板按 sizes 中的图片尺寸换算出实际字号再渲染；
+        开启自动对比度的模板同时渲染各预设外观。预热的图层数不超过引擎缓存容量，以免互相挤出。
+        返回图层全部预热完成的模板数（没有文字的模板、达到缓存容量时未预热完的模板不计入）。
+        """
+        manager = self._template_manager()
+        names = manager.list_templates() if templates is None else templates
+        engine = self.pipeline.watermark_engine
+        warmed = set()
+        count = 0
+        for name in names:
+            settings = self.resolve_settings(name)
+            if not settings or not settings.get("text"):
+                continue
+            candidates = [engine.resolve_settings(size, settings) for size in sizes] \
+                if settings.get("font_size_ratio") else [settings]
+            for resolved in candidates:
+                if resolved.get("auto_contrast"):
+                    variants = [engine.variant_settings(resolved, v) for v in AUTO_CONTRAST_VARIANTS]
+                else:
+                    variants = [resolved]
+                for variant in variants:
+                    key = engine.sprite_key(settings["text"], variant)
+                    if key in warmed:
+                        continue
+                    if len(warmed) >= SPRITE_CACHE_SIZE:
+                        return count
+                    engine.get_sprite(settings["text"], variant)
+                    warmed.add(key)
+            count += 1
+        return count
+
+    # ---------- 处理 ----------
+    def output_format(self, data, fmt=None):
+        """确定输出格式：指定的 fmt，否则按源图格式（只读文件头）"""
+        if fmt:
+            return fmt.upper()
+        try:
+            with Image.open(io.BytesIO(data)) as im:
+                source = im.format
+        except Exception:
+            source = None
+        return SOURCE_OUTPUT_FORMATS.get(source, "PNG")
+
+    def watermark_bytes(self, data, settings=None, fmt=None, template=None, **encoder_params):
+        """
+        给内存中的图片加水印并编码。
+        settings 为面板/模板格式的设置（可只含 text），template 为模板名称；
+        fmt 为 None 时保持源格式（无法识别时输出 PNG）。失败返回 None。
+        """
+        settings = self.resolve_settings(template, settings)
+        if settings is None:
+            return None
+        if not settings.get("text"):
+            print("未设置水印文字")
+            return None
+        p = self.pipeline
+        fmt = self.output_format(data, fmt)
+        img = p.image_loader.load_bytes(data)
+        if img is None:
+            return None
+        watermarked = p.render(img, settings, fmt)
+        if watermarked is None:
+            return None
+        params = dict(DEFAULT_ENCODER_PARAMS.get(fmt, {}))
+        params.update(encoder_params)
+        return p.exporter.encode_image(watermarked, fmt, **params)
+
+
+_default_api = None
+_default_lock = threading.Lock()
+
+
+def get_default_api():
+    """进程内共享的默认实例（读取当前目录的 templates.json）"""
+    global _default_api
+    with _default_lock:
+        if _default_api is None:
+            _default_api = WatermarkAPI()
+        return _default_api
+
+
+def watermark_bytes(data, settings=None, fmt=None, template=None, **encoder_params):
+    """使用默认实例的便捷函数，参数见 WatermarkAPI.watermark_bytes"""
+    return get_default_api().watermark_bytes(data, settings, fmt, template, **encoder_params)
@@ -1,5 +1,60 @@
 from PIL import Image, ImageDraw, ImageFont
+from collections import OrderedDict
+import math
 import os
+import threading
+import numpy as np
+from core.placement import best_ratio
+from core.watermark_geometry import sprite_position
+
+SPRITE_CACHE_SIZE = 32
+
+# 相对字号（font_size_ratio，占图片短边的比例）换算出的像素字号按几何级数分档：
+# 相邻档位相差约 8%，肉眼几乎看不出差别，混合分辨率的批次只需渲染少量不同尺寸的图层
+FONT_SIZE_MIN = 8
+FONT_SIZE_BUCKET_STEP = 1.08
+
+
+# 自动对比度：按水印下方区域的亮度，从几种预设外观中选择（每种外观的图层各自缓存）
+AUTO_CONTRAST_VARIANTS = {
+    "light": {"color": (255, 255, 255), "outline": None},        # 暗背景：白字
+    "dark": {"color": (20, 20, 20), "outline": None},            # 亮背景：黑字
+    "outlined": {"color": (255, 255, 255), "outline": (0, 0, 0)},  # 明暗混杂：白字黑边
+}
+AUTO_CONTRAST_DARK = 90     # 平均亮度低于此值视为暗背景
+AUTO_CONTRAST_BRIGHT = 165  # 平均亮度高于此值视为亮背景
+AUTO_CONTRAST_BUSY_STD = 55  # 亮度标准差高于此值视为明暗混杂
+AUTO_CONTRAST_SAMPLE = 48   # 统计前把区域缩小到的最大边长
+
+
+def region_luminance(img, box):
+    """区域 box 在缩小后的副本上的平均亮度与标准差（Rec.709 系数）"""
+    region = img.crop(box)
+    if max(region.size) > AUTO_CONTRAST_SAMPLE:
+        scale = AUTO_CONTRAST_SAMPLE / max(region.size)
+        region = region.resize((max(1, round(region.width * scale)), max(1, round(region.height * scale))),
+                               Image.BOX)
+    rgb = np.asarray(region.convert("RGB"), dtype=np.float32)
+    lum = rgb @ np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+    return float(lum.mean()), float(lum.std())
+
+
+def pick_contrast_variant(mean, std):
+    if std > AUTO_CONTRAST_BUSY_STD:
+        return "outlined"
+    if mean > AUTO_CONTRAST_BRIGHT:
+        return "dark"
+    if mean < AUTO_CONTRAST_DARK:
+        return "light"
+    return "outlined"
+
+
+def quantize_font_size(size):
+    """把任意像素字号归到最近的档位"""
+    if size <= FONT_SIZE_MIN:
+        return FONT_SIZE_MIN
+    bucket = round(math.log(size / FONT_SIZE_MIN) / math.log(FONT_SIZE_BUCKET_STEP))
+    return int(round(FONT_SIZE_MIN * FONT_SIZE_BUCKET_STEP ** bucket))
 
 
 class WatermarkEngine:
@@ -10,12 +65,18 @@ class WatermarkEngine:
     - 支持 RGBA 透明度
     - 支持中英文混排
     - 斜体效果自然
-    - 水印居中
+    - 水印居中或按比例坐标定位
+    - 水印图层按设置缓存，批量导出时只渲染一次
+    - 字号可按图片短边的比例设置（分档后缓存）
+    - 自动对比度：按水印下方区域亮度选择预设的颜色/描边
+    - 自动摆放：选择画面显著性最低的位置（见 core.placement）
     - 兼容 Pillow 8/9+
     """
 
     def __init__(self):
         self.font_paths = self._init_font_paths()
+        self._sprite_cache = OrderedDict()
+        self._sprite_lock = threading.Lock()
 
     def _init_font_paths(self):
         """初始化常见字体映射表"""
@@ -106,12 +167,8 @@ class WatermarkEngine:
 
         return ImageFont.load_default()
 
-    def add_text_watermark(self, img: Image.Image, text: str, settings: dict = None, custom_pos: tuple = None) -> Image.Image:
-        """添加文字水印"""
-        if img is None or not text:
-            return img
-
-        img = img.copy()
+    def render_text_sprite(self, text: str, settings: dict = None) -> Image.Image:
+        """渲染水印文字图层（四周留 10px 边距，斜体已做仿射），不含位置信息"""
         if settings is None:
             settings = {}
 
@@ -121,6 +178,8 @@ class WatermarkEngine:
         italic = settings.get("italic", False)
         color = settings.get("color", (255, 255, 255, 255))
         opacity = settings.get("opacity", 1.0)
+        outline = settings.get("outline")
+        stroke_width = max(1, font_size // 18) if outline else 0
 
         if len(color) == 3:
             color = (*color, int(255 * opacity))
@@ -129,15 +188,10 @@ class WatermarkEngine:
         else:
             color = (255, 255, 255, int(255 * opacity))
 
-        if img.mode != "RGBA":
-            img = img.convert("RGBA")
-
-        # 新建透明图层
-        text_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(text_layer)
+        draw = ImageDraw.Draw(Image.new("RGBA", (1, 1), (0, 0, 0, 0)))
 
         # ---------- 中英文混排绘制 ----------
-        x_offset, y_offset = 0, 0
+        x_offset = 0
         max_h = 0
         char_sizes = []
 
@@ -167,7 +221,9 @@ class WatermarkEngine:
             if bold:
                 offsets += [(1, 0), (0, 1), (1, 1)]
             for dx, dy in offsets:
-                draw_single.text((x_cursor + dx, 10 + dy), char, font=char_font, fill=color)
+                draw_single.text((x_cursor + dx, 10 + dy), char, font=char_font, fill=color,
+                                 stroke_width=stroke_width,
+                                 stroke_fill=(*outline[:3], color[3]) if outline else None)
             x_cursor += w
 
         # 斜体仿射
@@ -180,14 +236,137 @@ class WatermarkEngine:
                 (1, shear, 0, 0, 1, 0),
                 resample=Image.BICUBIC
             )
+        return single_layer
 
-        # ---------- 水印位置 ----------
+    # ---------- 相对字号 ----------
+    @staticmethod
+    def resolve_settings(img_size, settings: dict = None) -> dict:
+        """
+        设置中有 font_size_ratio 时，按图片短边换算并分档得到本图使用的 font_size；
+        否则原样返回（font_size 为绝对像素字号）
+        """
+        ratio = settings.get("font_size_ratio") if settings else None
+        if not ratio or not img_size:
+            return settings
+        resolved = dict(settings)
+        resolved["font_size"] = quantize_font_size(ratio * min(img_size))
+        return resolved
+
+    # ---------- 水印图层缓存 ----------
+    def sprite_key(self, text: str, settings: dict = None):
+        """影响水印图层外观的全部参数"""
+        settings = settings or {}
+        color = settings.get("color", (255, 255, 255, 255))
+        return (
+            text,
+            settings.get("font_family", "SimHei"),
+            settings.get("font_size", 36),
+            bool(settings.get("bold", False)),
+            bool(settings.get("italic", False)),
+            tuple(color) if color is not None else None,
+            settings.get("opacity", 1.0),
+            tuple(settings["outline"]) if settings.get("outline") else None,
+        )
+
+    def get_sprite(self, text: str, settings: dict = None) -> Image.Image:
+        """获取（缓存的）水印图层。返回的图层被共享，调用方不要修改它"""
+        key = self.sprite_key(text, settings)
+        with self._sprite_lock:
+            sprite = self._sprite_cache.get(key)
+            if sprite is not None:
+                self._sprite_cache.move_to_end(key)
+                return sprite
+        sprite = self.render_text_sprite(text, settings)
+        with self._sprite_lock:
+            self._sprite_cache[key] = sprite
+            while len(self._sprite_cache) > SPRITE_CACHE_SIZE:
+                self._sprite_cache.popitem(last=False)
+        return sprite
+
+    # ---------- 自动摆放 ----------
+    def placement_settings(self, img, settings: dict, text: str = None, full_size=None) -> dict:
+        """
+        settings 开启 auto_position 时，按本图的显著性图选出位置写入 _pos_override 并关闭 auto_position
+        （结果可直接复用，如动图各帧沿用第一帧选出的位置）；否则原样返回。
+        img 可以是缩小的副本，此时 full_size 为原图尺寸。
+        """
+        if not settings or not settings.get("auto_position"):
+            return settings
+        text = settings.get("text", "") if text is None else text
+        sprite = self.get_sprite(text, settings)
+        placed = dict(settings)
+        placed["_pos_override"] = best_ratio(img, sprite.size, full_size)
+        placed["auto_position"] = False
+        return placed
+
+    # ---------- 自动对比度 ----------
+    @staticmethod
+    def variant_settings(settings: dict, name: str) -> dict:
+        """套用自动对比度的某种预设外观，透明度沿用原设置"""
+        variant = AUTO_CONTRAST_VARIANTS[name]
+        color = settings.get("color", (255, 255, 255, 255))
+        alpha = color[3] if color is not None and len(color) == 4 else int(255 * settings.get("opacity", 1.0))
+        chosen = dict(settings)
+        chosen["color"] = (*variant["color"], alpha)
+        chosen["outline"] = variant["outline"]
+        return chosen
+
+    def contrast_box(self, img_size, settings: dict, text: str = None):
+        """自动对比度统计的区域：按原设置渲染的水印在图中覆盖的范围（已裁到图片内），为空时返回 None"""
+        text = settings.get("text", "") if text is None else text
+        sprite = self.get_sprite(text, settings)
+        x, y = self.get_watermark_position(img_size, sprite.size, settings=settings)
+        box = (max(0, x), max(0, y), min(img_size[0], x + sprite.width), min(img_size[1], y + sprite.height))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return None
+        return box
+
+    def contrast_settings(self, img, settings: dict, text: str = None, full_size=None) -> dict:
+        """
+        settings 开启 auto_contrast 时，统计水印将覆盖区域的亮度并返回选定外观的设置；
+        否则原样返回。img 可以是缩小的副本（如 JPEG draft 解码），此时 full_size 为原图尺寸。
+        """
+        if not settings or not settings.get("auto_contrast"):
+            return settings
+        full_size = full_size or img.size
+        box = self.contrast_box(full_size, settings, text)
+        if box is None:
+            return settings
+        sx, sy = img.width / full_size[0], img.height / full_size[1]
+        box = (int(box[0] * sx), int(box[1] * sy),
+               max(int(box[0] * sx) + 1, math.ceil(box[2] * sx)), max(int(box[1] * sy) + 1, math.ceil(box[3] * sy)))
+        return self.variant_settings(settings, pick_contrast_variant(*region_luminance(img, box)))
+
+    def get_watermark_position(self, img_size, sprite_size, custom_pos: tuple = None, settings: dict = None):
+        """
+        水印图层左上角在原图中的像素坐标，优先级：
+        custom_pos 像素坐标 > 设置中的比例坐标（_pos_override / position）> 居中
+        """
         if custom_pos and isinstance(custom_pos, tuple):
-            final_x, final_y = custom_pos
-        else:
-            final_x = (img.width - single_layer.width) // 2
-            final_y = (img.height - single_layer.height) // 2
+            return custom_pos
+        ratio = (settings.get("_pos_override") or settings.get("position")) if settings else None
+        return sprite_position(img_size, sprite_size, ratio)
 
-        text_layer.paste(single_layer, (final_x, final_y), single_layer)
-        combined = Image.alpha_composite(img, text_layer)
-        return combined
+    @staticmethod
+    def composite_sprite(img: Image.Image, sprite: Image.Image, pos) -> Image.Image:
+        """把水印图层贴到 RGBA 图片的 pos 处"""
+        text_layer = Image.new("RGBA", img.size, (0, 0, 0, 0))
+        text_layer.paste(sprite, pos, sprite)
+        return Image.alpha_composite(img, text_layer)
+
+    def add_text_watermark(self, img: Image.Image, text: str, settings: dict = None, custom_pos: tuple = None) -> Image.Image:
+        """添加文字水印"""
+        if img is None or not text:
+            return img
+
+        img = img.copy()
+        if img.mode != "RGBA":
+            img = img.convert("RGBA")
+
+        settings = self.resolve_settings(img.size, settings)
+        settings = self.contrast_settings(img, self.placement_settings(img, settings, text), text)
+        single_layer = self.get_sprite(text, settings)
+
+        # ---------- 水印位置 ----------
+        pos = self.get_watermark_position(img.size, single_layer.size, custom_pos, settings)
+        return self.composite_sprite(img, single_layer, pos)
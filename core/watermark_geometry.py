@@ -0,0 +1,72 @@
+"""
+水印几何模型：根据引擎实际渲染的水印图层尺寸计算水印位置，
+预览控件的命中测试/拖拽与导出使用同一套计算，保证预览位置与导出像素一致。
+
+比例坐标 (rx, ry) ∈ [0, 1]，表示水印左上角在可移动范围 (图宽-水印宽, 图高-水印高) 内的位置。
+依赖：core.watermark_engine（实例由调用方传入）
+"""
+
+
+def ratio_to_pixel(img_size, sprite_size, ratio):
+    """比例坐标 → 水印图层左上角的原图像素坐标"""
+    movable_w = max(0, img_size[0] - sprite_size[0])
+    movable_h = max(0, img_size[1] - sprite_size[1])
+    rx = min(max(ratio[0], 0.0), 1.0)
+    ry = min(max(ratio[1], 0.0), 1.0)
+    return int(rx * movable_w), int(ry * movable_h)
+
+
+def sprite_position(img_size, sprite_size, ratio=None):
+    """按比例坐标定位水印图层，没有比例坐标时居中"""
+    if ratio:
+        return ratio_to_pixel(img_size, sprite_size, ratio)
+    return (img_size[0] - sprite_size[0]) // 2, (img_size[1] - sprite_size[1]) // 2
+
+
+def pixel_to_ratio(img_size, sprite_size, pos):
+    """原图像素坐标 → 比例坐标（超出范围时截断；水印比图片大的方向取 0）"""
+    movable_w = max(0, img_size[0] - sprite_size[0])
+    movable_h = max(0, img_size[1] - sprite_size[1])
+    rx = min(max(pos[0] / movable_w, 0.0), 1.0) if movable_w > 0 else 0.0
+    ry = min(max(pos[1] / movable_h, 0.0), 1.0) if movable_h > 0 else 0.0
+    return rx, ry
+
+
+class WatermarkGeometry:
+    """
+    缓存当前设置下的水印图层及其尺寸。设置变化时才重新获取图层（引擎内部也有缓存），
+    鼠标事件中的尺寸查询、命中测试都只是简单算术。
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.key = None
+        self.sprite = None
+
+    def update(self, text, settings, img_size=None):
+        """设置（或相对字号下的图片尺寸）变化时更新水印图层，返回是否发生变化"""
+        settings = self.engine.resolve_settings(img_size, settings)
+        key = self.engine.sprite_key(text, settings) if text else None
+        if key == self.key:
+            return False
+        self.key = key
+        self.sprite = self.engine.get_sprite(text, settings) if text else None
+        return True
+
+    @property
+    def size(self):
+        return self.sprite.size if self.sprite is not None else (0, 0)
+
+    def pixel_pos(self, img_size, ratio):
+        return ratio_to_pixel(img_size, self.size, ratio)
+
+    def ratio_from_pixel(self, img_size, pos):
+        return pixel_to_ratio(img_size, self.size, pos)
+
+    def contains(self, img_size, ratio, point):
+        """原图像素坐标 point 是否落在水印图层内"""
+        if self.sprite is None or ratio is None:
+            return False
+        x, y = self.pixel_pos(img_size, ratio)
+        w, h = self.size
+        return x <= point[0] <= x + w and y <= point[1] <= y + h
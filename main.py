@@ -1,12 +1,18 @@
 """
 主入口文件，负责启动 PyQt 应用和主窗口。
-依赖：ui.main_window
+带子命令参数时进入命令行模式（见 cli.py），例如：python main.py watch ...
+依赖：ui.main_window, cli
 """
 import sys
-from PyQt6.QtWidgets import QApplication
-from ui.main_window import MainWindow
 
 def main():
+    if len(sys.argv) > 1:
+        from cli import run_cli
+        sys.exit(run_cli(sys.argv[1:]))
+
+    from PyQt6.QtWidgets import QApplication
+    from ui.main_window import MainWindow
+
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
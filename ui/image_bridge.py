@@ -0,0 +1,49 @@
+# ui/image_bridge.py
+"""
+PIL → Qt 图像转换模块：一次 tobytes，直接按 Qt 期望的字节顺序打包（RGBX8888 / ARGB32 / Grayscale8），
+QImage 直接引用这块缓冲区。QImage 不会持有缓冲区的所有权，这里把缓冲区挂在返回对象上保证生命周期。
+依赖：PyQt6.QtGui, PIL.Image
+"""
+import sys
+from PyQt6.QtGui import QImage
+from PIL import Image
+
+# ARGB32 在内存中是按 32 位整数 0xAARRGGBB 存放的，字节顺序取决于平台端序
+_ARGB32_RAWMODE = "BGRA" if sys.byteorder == "little" else "ARGB"
+
+
+def pil_to_qimage(im):
+    """PIL.Image → QImage（一次拷贝）。返回的 QImage 引用 Python 缓冲区，需要长期保存时请 copy()"""
+    if im.mode == "RGBA":
+        data = im.tobytes("raw", _ARGB32_RAWMODE)
+        fmt = QImage.Format.Format_ARGB32
+        bpl = im.width * 4
+    elif im.mode in ("RGB", "RGBX"):
+        # RGBX 每像素 4 字节、填充字节为 255，Qt 可直接按不透明图处理
+        data = im.tobytes("raw", "RGBX")
+        fmt = QImage.Format.Format_RGBX8888
+        bpl = im.width * 4
+    elif im.mode == "L":
+        data = im.tobytes("raw", "L")
+        fmt = QImage.Format.Format_Grayscale8
+        bpl = im.width
+    else:
+        return pil_to_qimage(im.convert("RGBA"))
+
+    qimg = QImage(data, im.width, im.height, bpl, fmt)
+    qimg._pil_buffer = data  # QImage 不拥有外部内存，保持 bytes 存活
+    return qimg
+
+
+def load_thumbnail_qimage(path, size):
+    """生成缩略图：JPEG 用 draft 按比例缩小解码，不做全分辨率解码"""
+    try:
+        with Image.open(path) as im:
+            im.draft("RGB", (size, size))
+            im.thumbnail((size, size))
+            if im.mode not in ("RGB", "RGBA", "L"):
+                im = im.convert("RGBA")
+            return pil_to_qimage(im)
+    except Exception as e:
+        print(f"生成缩略图失败: {e}")
+        return None
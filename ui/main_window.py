@@ -1,20 +1,30 @@
 # main_window.py
 from PyQt6.QtWidgets import (
-    QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
+    QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QLineEdit, QFileDialog, QLabel,
-    QMessageBox, QComboBox, QProgressBar, QListWidget, QListWidgetItem
+    QMessageBox, QComboBox, QProgressBar, QListWidget, QListWidgetItem, QCheckBox
 )
 from PyQt6.QtGui import QPixmap, QIcon, QColor
-from PyQt6.QtCore import Qt, QSize
+from PyQt6.QtCore import Qt, QSize, pyqtSignal
 from ui.preview_widget import PreviewWidget
 from ui.text_watermark_settings import TextWatermarkSettings
+from ui.image_bridge import load_thumbnail_qimage
 from core.image_loader import ImageLoader
 from core.watermark_engine import WatermarkEngine
 from core.exporter import Exporter
+from core.export_pipeline import ExportPipeline, IMAGE_EXTENSIONS
+from core.hot_folder import HotFolderWatcher
+from core.staged_pipeline import StagedExportPipeline
+from core.batch_metrics import BatchMetrics, default_metrics_dir
+from core.mark_detection import MarkDetector
 import os
+import time
 
 
 class MainWindow(QMainWindow):
+    # 监视文件夹的回调在工作线程中触发，通过信号转回界面线程
+    hot_folder_event = pyqtSignal(str)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("图片水印工具")
@@ -24,11 +34,15 @@ class MainWindow(QMainWindow):
         self.image_loader = ImageLoader()
         self.watermark_engine = WatermarkEngine()
         self.exporter = Exporter()
+        self.pipeline = ExportPipeline(self.image_loader, self.watermark_engine, self.exporter)
+        self.staged_pipeline = StagedExportPipeline(self.pipeline)
+        self.hot_folder_watcher = None
 
         # ---------------- 当前状态 ----------------
         self.image_paths = []
         self.current_image_path = None
         self.watermark_position = None  # tuple=(x,y)
+        self._preview_cache = (None, None)  # (路径, PIL 图片)，设置变化时不重复解码和转换
 
         # ---------------- 中央控件布局 ----------------
         central = QWidget()
@@ -47,7 +61,7 @@ class MainWindow(QMainWindow):
         splitter_layout.addWidget(self.thumbnail_list)
 
         # 右侧预览
-        self.preview = PreviewWidget()
+        self.preview = PreviewWidget(engine=self.watermark_engine)
         self.preview.watermark_moved.connect(self.on_watermark_moved)
         splitter_layout.addWidget(self.preview)
         splitter_layout.setStretch(1, 1)
@@ -75,19 +89,34 @@ class MainWindow(QMainWindow):
         self.format_combo = QComboBox()
         self.format_combo.addItems(["PNG", "JPEG"])
         export_params_layout.addWidget(self.format_combo)
+        self.dedupe_check = QCheckBox("跳过重复图片")
+        self.dedupe_check.setToolTip("内容相同的图片只处理一次，其余副本直接复制导出结果")
+        export_params_layout.addWidget(self.dedupe_check)
+        self.skip_marked_check = QCheckBox("跳过已有水印的图片")
+        self.skip_marked_check.setToolTip("导出前检查原图在预期位置是否已有当前水印（逐字核对，拿不准时照常处理），"
+                                          "已有的不再处理，完成时列出被跳过的文件")
+        export_params_layout.addWidget(self.skip_marked_check)
+        self.partial_jpeg_check = QCheckBox("JPEG仅重编码水印区域")
+        self.partial_jpeg_check.setToolTip("JPEG 原图导出为 JPEG 时只重新编码水印覆盖的区域，其余数据原样保留")
+        self.partial_jpeg_check.toggled.connect(lambda checked: setattr(self.pipeline, "partial_jpeg", checked))
+        export_params_layout.addWidget(self.partial_jpeg_check)
         bottom_layout.addLayout(export_params_layout)
 
         # 第二行：导入/导出按钮
         export_buttons_layout = QHBoxLayout()
-        btn_import_files = QPushButton("导入图片")
-        btn_import_files.clicked.connect(self.import_images)
-        btn_import_folder = QPushButton("导入文件夹")
-        btn_import_folder.clicked.connect(self.import_folder)
+        self.btn_import_files = QPushButton("导入图片")
+        self.btn_import_files.clicked.connect(self.import_images)
+        self.btn_import_folder = QPushButton("导入文件夹")
+        self.btn_import_folder.clicked.connect(self.import_folder)
         self.btn_export = QPushButton("导出所有图片")
         self.btn_export.clicked.connect(self.export_all_images)
-        export_buttons_layout.addWidget(btn_import_files)
-        export_buttons_layout.addWidget(btn_import_folder)
+        export_buttons_layout.addWidget(self.btn_import_files)
+        export_buttons_layout.addWidget(self.btn_import_folder)
         export_buttons_layout.addWidget(self.btn_export)
+        self.btn_watch = QPushButton("监视文件夹")
+        self.btn_watch.setCheckable(True)
+        self.btn_watch.toggled.connect(self.toggle_hot_folder)
+        export_buttons_layout.addWidget(self.btn_watch)
         bottom_layout.addLayout(export_buttons_layout)
 
         # 进度条
@@ -97,6 +126,7 @@ class MainWindow(QMainWindow):
         # 状态栏
         self.status_label = QLabel("")
         main_layout.addWidget(self.status_label)
+        self.hot_folder_event.connect(self.status_label.setText)
 
     # ---------------- 工具函数 ----------------
     def qcolor_to_rgba(self, color, opacity=1.0):
@@ -109,10 +139,17 @@ class MainWindow(QMainWindow):
                 return (color[0], color[1], color[2], int(255 * opacity))
         return (255, 255, 255, int(255 * opacity))
 
+    def _get_export_settings(self):
+        settings = self.text_settings.get_settings()
+        settings["color"] = self.qcolor_to_rgba(settings.get("color"), settings.get("opacity", 1.0))
+        if self.watermark_position:
+            settings["_pos_override"] = self.watermark_position
+        return settings
+
     # ---------------- 图片导入 ----------------
     def import_images(self):
         files, _ = QFileDialog.getOpenFileNames(
-            self, "选择图片", "", "Images (*.png *.jpg *.jpeg *.bmp *.tiff)"
+            self, "选择图片", "", "Images (*.png *.jpg *.jpeg *.bmp *.tiff *.tif *.gif *.webp)"
         )
         if files:
             self.add_images(files)
@@ -124,7 +161,7 @@ class MainWindow(QMainWindow):
         files = []
         for root, _, filenames in os.walk(folder):
             for f in filenames:
-                if f.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".tiff")):
+                if f.lower().endswith(IMAGE_EXTENSIONS):
                     files.append(os.path.join(root, f))
         if files:
             self.add_images(files)
@@ -135,14 +172,10 @@ class MainWindow(QMainWindow):
                 continue
             self.image_paths.append(path)
             item = QListWidgetItem(os.path.basename(path))
-            pixmap = QPixmap(path)
-            if not pixmap.isNull():
-                pixmap = pixmap.scaled(
-                    100, 100,
-                    Qt.AspectRatioMode.KeepAspectRatio,
-                    Qt.TransformationMode.SmoothTransformation,
-                )
-                item.setIcon(QIcon(pixmap))
+            # 缩略图用 PIL 按比例缩小解码，避免全分辨率加载
+            thumb = load_thumbnail_qimage(path, 100)
+            if thumb is not None:
+                item.setIcon(QIcon(QPixmap.fromImage(thumb)))
             item.setData(Qt.ItemDataRole.UserRole, path)
             self.thumbnail_list.addItem(item)
 
@@ -181,7 +214,10 @@ class MainWindow(QMainWindow):
     def update_text_preview(self, settings):
         if not self.current_image_path:
             return
-        img = self.image_loader.load_image(self.current_image_path)
+        cached_path, img = self._preview_cache
+        if cached_path != self.current_image_path:
+            img = self.image_loader.load_image(self.current_image_path)
+            self._preview_cache = (self.current_image_path, img)
         if not img:
             return
 
@@ -220,34 +256,139 @@ class MainWindow(QMainWindow):
 
         prefix = self.prefix_input.text()
         suffix = self.suffix_input.text()
-        settings = self.text_settings.get_settings()
-        settings["color"] = self.qcolor_to_rgba(settings.get("color"), settings.get("opacity", 1.0))
-        if self.watermark_position:
-            settings["_pos_override"] = self.watermark_position
+        settings = self._get_export_settings()
 
         text = settings.get("text", "")
         if not text:
             QMessageBox.warning(self, "错误", "请先设置水印文字")
             return
 
-        fmt = self.format_combo.currentText()
-        self.progress_bar.setMaximum(len(self.image_paths))
-        self.progress_bar.setValue(0)
+        # 导出期间界面仍会处理事件，禁用可再次触发导出或改动批次的控件，防止重入
+        self._set_batch_controls_enabled(False)
+        try:
+            fmt = self.format_combo.currentText()
+            paths = list(self.image_paths)
+            skipped = []
+            if self.skip_marked_check.isChecked():
+                # 检测在线程池中进行，逐张取结果时刷新进度并处理事件，界面不会卡住
+                self.status_label.setText("正在检查已有水印…")
+                self.progress_bar.setMaximum(len(paths))
+                self.progress_bar.setValue(0)
+                QApplication.processEvents()
+                checked = MarkDetector(self.watermark_engine).scan(paths, settings)
+                paths = []
+                for i, (path, score, marked) in enumerate(checked, start=1):
+                    if marked:
+                        skipped.append(f"{path}（匹配度 {score:.2f}）")
+                    else:
+                        paths.append(path)
+                    self._pump_progress(i)
+            self.progress_bar.setMaximum(len(paths))
+            self.progress_bar.setValue(0)
+
+            # 规划要读取每个文件头，同样逐张刷新进度并处理事件
+            self.status_label.setText("正在读取图片信息…")
+            QApplication.processEvents()
+            plan = self.staged_pipeline.plan(paths, fmt, progress=self._pump_progress)
+            self.progress_bar.setValue(0)
+            self.status_label.setText(f"开始导出：{plan.summary()}")
+            QApplication.processEvents()
+
+            # 吞吐指标定期写到指标目录（.prom / .json），供本机监控采集
+            metrics = BatchMetrics.for_directory(default_metrics_dir(), "gui", total=len(paths))
+            results = metrics.track(self.staged_pipeline.run(
+                paths, settings, folder, prefix, suffix, fmt,
+                dedupe=self.dedupe_check.isChecked(), plan=plan, metrics=metrics,
+            ))
+            failed = []
+            last_status = 0.0
+            for i, (path, save_path) in enumerate(results, start=1):
+                if not save_path:
+                    failed.append(path)
+                self.progress_bar.setValue(i)
+                if time.monotonic() - last_status >= 0.5:
+                    last_status = time.monotonic()
+                    self.status_label.setText(self._metrics_text(metrics.snapshot()))
+                QApplication.processEvents()
+            self.status_label.setText("导出完成：" + self._metrics_text(metrics.snapshot()))
+
+            if failed:
+                QMessageBox.warning(self, "错误", "导出图片失败:\n" + "\n".join(failed))
+
+            message = f"已导出 {len(paths)} 张图片"
+            if skipped:
+                # 列出被跳过的文件，便于核对是否误判（被跳过的图片不会带上本次的水印）
+                message += f"，跳过 {len(skipped)} 张已有水印的图片:\n" + "\n".join(skipped)
+            QMessageBox.information(self, "完成", message)
+            self.progress_bar.setValue(0)
+        finally:
+            self._set_batch_controls_enabled(True)
+
+    def _pump_progress(self, value):
+        """长时间的同步扫描中更新进度条并处理界面事件"""
+        self.progress_bar.setValue(value)
+        QApplication.processEvents()
+
+    def _set_batch_controls_enabled(self, enabled):
+        for widget in (self.btn_export, self.btn_import_files, self.btn_import_folder, self.btn_watch,
+                       self.prefix_input, self.suffix_input, self.format_combo, self.dedupe_check,
+                       self.skip_marked_check, self.partial_jpeg_check):
+            widget.setEnabled(enabled)
+
+    @staticmethod
+    def _metrics_text(snap):
+        text = (f"已处理 {snap['images_processed']}/{snap['images_total']}，失败 {snap['images_failed']}，"
+                f"{snap['images_per_second']:.1f} 张/秒")
+        if snap["eta_seconds"] is not None:
+            text += f"，预计剩余 {int(snap['eta_seconds'])} 秒"
+        return text
+
+    # ---------------- 监视文件夹 ----------------
+    def toggle_hot_folder(self, checked):
+        if not checked:
+            if self.hot_folder_watcher:
+                self.hot_folder_watcher.stop()
+                self.hot_folder_watcher = None
+            self.status_label.setText("已停止监视文件夹")
+            return
 
-        for i, path in enumerate(self.image_paths, start=1):
-            img = self.image_loader.load_image(path)
-            if img is None:
-                continue
-            watermarked = self.watermark_engine.add_text_watermark(img, text, settings=settings)
-            name = os.path.splitext(os.path.basename(path))[0]
-            ext = ".png" if fmt == "PNG" else ".jpg"
-            if ext == ".jpg" and watermarked.mode == "RGBA":
-                watermarked = watermarked.convert("RGB")
-            new_name = f"{prefix}{name}{suffix}{ext}"
-            save_path = os.path.join(folder, new_name)
-            if not self.exporter.save_image(watermarked, save_path):
-                QMessageBox.warning(self, "错误", f"保存图片失败: {save_path}")
-            self.progress_bar.setValue(i)
-
-        QMessageBox.information(self, "完成", f"已导出 {len(self.image_paths)} 张图片")
-        self.progress_bar.setValue(0)
+        settings = self._get_export_settings()
+        if not settings.get("text"):
+            QMessageBox.warning(self, "错误", "请先设置水印文字")
+            self._reset_watch_button()
+            return
+
+        input_folder = QFileDialog.getExistingDirectory(self, "选择监视的输入文件夹")
+        if not input_folder:
+            self._reset_watch_button()
+            return
+        output_folder = QFileDialog.getExistingDirectory(self, "选择输出文件夹")
+        if not output_folder:
+            self._reset_watch_button()
+            return
+        if os.path.abspath(output_folder) == os.path.abspath(input_folder):
+            QMessageBox.warning(self, "错误", "输出文件夹不能与原图片所在文件夹相同")
+            self._reset_watch_button()
+            return
+
+        self.hot_folder_watcher = HotFolderWatcher(
+            input_folder, output_folder, settings,
+            pipeline=self.pipeline,
+            prefix=self.prefix_input.text(),
+            suffix=self.suffix_input.text(),
+            fmt=self.format_combo.currentText(),
+            on_processed=lambda src, dst: self.hot_folder_event.emit(f"已自动导出：{os.path.basename(dst)}"),
+            on_error=lambda src, msg: self.hot_folder_event.emit(f"自动导出失败：{os.path.basename(src)}（{msg}）"),
+        )
+        self.hot_folder_watcher.start()
+        self.status_label.setText(f"正在监视：{input_folder}")
+
+    def _reset_watch_button(self):
+        self.btn_watch.blockSignals(True)
+        self.btn_watch.setChecked(False)
+        self.btn_watch.blockSignals(False)
+
+    def closeEvent(self, event):
+        if self.hot_folder_watcher:
+            self.hot_folder_watcher.stop()
+        super().closeEvent(event)
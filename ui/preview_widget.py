@@ -1,14 +1,18 @@
 # ui/preview_widget.py
 from PyQt6.QtWidgets import QLabel, QSizePolicy
-from PyQt6.QtGui import QPixmap, QImage, QPainter, QColor, QFont, QFontMetrics
-from PyQt6.QtCore import Qt, pyqtSignal, QPoint
-from PIL import Image, ImageDraw, ImageFont
+from PyQt6.QtGui import QPixmap, QPainter
+from PyQt6.QtCore import Qt, pyqtSignal, QPoint, QRectF
+from PIL import Image
+from ui.image_bridge import pil_to_qimage
+from core.export_pipeline import is_image_file
+from core.watermark_engine import WatermarkEngine
+from core.watermark_geometry import WatermarkGeometry
 
 
 class PreviewWidget(QLabel):
     watermark_moved = pyqtSignal(tuple)  # 拖拽结束发射比例坐标 (0~1, 0~1)
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, engine=None):
         super().__init__(parent)
         self.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.setMinimumSize(300, 200)
@@ -18,15 +22,16 @@ class PreviewWidget(QLabel):
 
         # 图片和水印属性
         self.image = None
+        self._pixmap = None         # 原图转换后的 QPixmap，只在换图时转换一次
+        self._scaled_pixmap = None  # 按当前控件尺寸缩放后的缓存
+        self._scaled_size = None
         self.hint_text = "将图片拖拽到此处或点击导入按钮加载图片"
 
         self.current_settings = {}
         self.watermark_text = ""
-        self.font_family = "Arial"
-        self.font_size = 36
-        self.bold = False
-        self.italic = False
-        self.color = QColor(255, 255, 255, 180)
+        # 与导出共用引擎的水印图层：尺寸、命中测试和绘制都基于它，预览即导出效果
+        self.geometry = WatermarkGeometry(engine or WatermarkEngine())
+        self._sprite_pixmap = None
 
         self.watermark_pos = None  # 比例坐标 (0~1, 0~1)
         self.dragging = False
@@ -35,6 +40,9 @@ class PreviewWidget(QLabel):
 
     # ------------------- 设置图片 -------------------
     def set_image(self, pil_img):
+        if pil_img is not self.image:
+            self._pixmap = QPixmap.fromImage(self._pil2qimage(pil_img)) if pil_img else None
+            self._scaled_pixmap = None
         self.image = pil_img
         self.watermark_pos = None
         self.update_preview()
@@ -43,16 +51,31 @@ class PreviewWidget(QLabel):
     def update_preview(self):
         if self.current_settings:
             self.watermark_text = self.current_settings.get("text", "")
-            self.font_family = self.current_settings.get("font_family", "Arial")
-            self.font_size = self.current_settings.get("font_size", 36)
-            self.bold = self.current_settings.get("bold", False)
-            self.italic = self.current_settings.get("italic", False)
-            color = self.current_settings.get("color", (255, 255, 255, 180))
-            self.color = QColor(*color)
             self.watermark_pos = self.current_settings.get("position", None)
         else:
             self.watermark_text = ""
 
+        # 设置变化时才重新获取水印图层并转换为 QPixmap
+        img_size = self.image.size if self.image else None
+        settings = self.current_settings
+        engine = self.geometry.engine
+        if self.image and settings.get("auto_position"):
+            # 与导出一致：按当前图片的显著性图选择位置
+            settings = engine.placement_settings(self.image, engine.resolve_settings(img_size, settings))
+            self.watermark_pos = settings["_pos_override"]
+        if self.image and settings.get("auto_contrast"):
+            # 与导出一致：按当前图片水印区域的亮度选择外观
+            settings = engine.contrast_settings(self.image, engine.resolve_settings(img_size, settings))
+        if self.geometry.update(self.watermark_text, settings, img_size):
+            sprite = self.geometry.sprite
+            if sprite is not None:
+                # 与引擎合成方式一致：图层以自身 alpha 为蒙版贴到透明底上，再整体叠加
+                layer = Image.new("RGBA", sprite.size, (0, 0, 0, 0))
+                layer.paste(sprite, (0, 0), sprite)
+                self._sprite_pixmap = QPixmap.fromImage(pil_to_qimage(layer))
+            else:
+                self._sprite_pixmap = None
+
         # 默认居中位置
         if self.image and self.watermark_text and self.watermark_pos is None:
             self.set_watermark_position_preset("center")
@@ -62,6 +85,8 @@ class PreviewWidget(QLabel):
     # ------------------- 拖拽水印 -------------------
     def mousePressEvent(self, event):
         pos = event.position()  # PyQt6 返回 QPointF
+        if self.current_settings and self.current_settings.get("auto_position"):
+            return  # 自动摆放时位置由图片内容决定，不能拖拽
         if self.is_over_watermark(pos):
             self.dragging = True
             # 计算鼠标点击位置与水印左上角的偏移量（在预览控件坐标系中）
@@ -89,25 +114,10 @@ class PreviewWidget(QLabel):
             preview_new_x = pos.x() - self.drag_offset[0]
             preview_new_y = pos.y() - self.drag_offset[1]
 
-            # 转换为原图像素坐标
+            # 转换为原图像素坐标，再转换为比例坐标（自动限制在图片内）
             new_x = (preview_new_x - x_offset) / ratio_w
             new_y = (preview_new_y - y_offset) / ratio_h
-
-            wm_w, wm_h = self.get_watermark_size()
-
-            # 边界限制 - 确保水印完全在图片内
-            new_x = max(0, min(new_x, self.image.width - wm_w))
-            new_y = max(0, min(new_y, self.image.height - wm_h))
-
-            # 转换为比例坐标
-            if self.image.width - wm_w > 0 and self.image.height - wm_h > 0:
-                self.watermark_pos = (
-                    new_x / (self.image.width - wm_w),
-                    new_y / (self.image.height - wm_h)
-                )
-            else:
-                # 如果水印比图片大，放在左上角
-                self.watermark_pos = (0, 0)
+            self.watermark_pos = self.geometry.ratio_from_pixel(self.image.size, (new_x, new_y))
 
             self.update()
 
@@ -128,35 +138,18 @@ class PreviewWidget(QLabel):
         if not self.image or not self.watermark_text or not self.watermark_pos:
             return False
 
-        wm_x_px, wm_y_px = self.get_watermark_pixel_pos()
         scaled_w, scaled_h, x_offset, y_offset = self._get_scaled_geometry()
-        ratio_w = scaled_w / self.image.width
-        ratio_h = scaled_h / self.image.height
-
-        wm_w, wm_h = self.get_watermark_size()
-        preview_wm_w = wm_w * ratio_w
-        preview_wm_h = wm_h * ratio_h
-        preview_wm_x = x_offset + wm_x_px * ratio_w
-        preview_wm_y = y_offset + wm_y_px * ratio_h
-
-        return (preview_wm_x <= x <= preview_wm_x + preview_wm_w and 
-                preview_wm_y <= y <= preview_wm_y + preview_wm_h)
+        # 预览控件坐标 -> 原图像素坐标
+        img_x = (x - x_offset) * self.image.width / scaled_w
+        img_y = (y - y_offset) * self.image.height / scaled_h
+        return self.geometry.contains(self.image.size, self.watermark_pos, (img_x, img_y))
 
     # ------------------- 水印尺寸 -------------------
     def get_watermark_size(self):
-        """使用Qt计算水印文本的实际尺寸，确保与绘制时一致"""
+        """水印图层在原图中的尺寸（与导出时引擎渲染的图层一致）"""
         if not self.watermark_text or not self.image:
             return 0, 0
-        
-        # 使用Qt字体计算文本尺寸，确保与绘制时一致
-        font = QFont(self.font_family, self.font_size)
-        font.setBold(self.bold)
-        font.setItalic(self.italic)
-        
-        font_metrics = QFontMetrics(font)
-        text_rect = font_metrics.boundingRect(self.watermark_text)
-        
-        return text_rect.width(), text_rect.height()
+        return self.geometry.size
 
     # ------------------- 九宫格预设 -------------------
     def set_watermark_position_preset(self, position_name: str):
@@ -178,22 +171,7 @@ class PreviewWidget(QLabel):
         """比例坐标 -> 原图像素坐标"""
         if not self.image or not self.watermark_text or not self.watermark_pos:
             return 0, 0
-            
-        wm_w, wm_h = self.get_watermark_size()
-        img_w, img_h = self.image.width, self.image.height
-
-        # 计算可移动范围
-        movable_width = max(0, img_w - wm_w)
-        movable_height = max(0, img_h - wm_h)
-        
-        # 将比例坐标转换为像素坐标
-        px = self.watermark_pos[0] * movable_width
-        py = self.watermark_pos[1] * movable_height
-
-        # 防止越界
-        px = max(0, min(px, movable_width))
-        py = max(0, min(py, movable_height))
-        return px, py
+        return self.geometry.pixel_pos(self.image.size, self.watermark_pos)
 
     # ------------------- 绘制 -------------------
     def paintEvent(self, event):
@@ -205,15 +183,16 @@ class PreviewWidget(QLabel):
             painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, self.hint_text)
             return
 
-        qimg = self._pil2qimage(self.image)
-        pixmap = QPixmap.fromImage(qimg)
         scaled_w, scaled_h, x_offset, y_offset = self._get_scaled_geometry()
-        scaled_pixmap = pixmap.scaled(
-            int(scaled_w), int(scaled_h),
-            Qt.AspectRatioMode.KeepAspectRatio,
-            Qt.TransformationMode.SmoothTransformation
-        )
-        painter.drawPixmap(int(x_offset), int(y_offset), scaled_pixmap)
+        # 缩放结果按尺寸缓存，拖拽重绘时不再重新缩放整张图
+        if self._scaled_pixmap is None or self._scaled_size != (int(scaled_w), int(scaled_h)):
+            self._scaled_size = (int(scaled_w), int(scaled_h))
+            self._scaled_pixmap = self._pixmap.scaled(
+                int(scaled_w), int(scaled_h),
+                Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.TransformationMode.SmoothTransformation
+            )
+        painter.drawPixmap(int(x_offset), int(y_offset), self._scaled_pixmap)
 
         if self.watermark_text and self.watermark_pos:
             wm_x, wm_y = self.get_watermark_pixel_pos()
@@ -224,33 +203,15 @@ class PreviewWidget(QLabel):
             draw_x = x_offset + wm_x * ratio_w
             draw_y = y_offset + wm_y * ratio_h
 
-            # 创建缩放后的字体
-            font = QFont(self.font_family, max(int(self.font_size * ratio_h), 1))
-            font.setBold(self.bold)
-            font.setItalic(self.italic)
-            painter.setFont(font)
-            painter.setPen(self.color)
-
-            # 使用Qt绘制文本，确保位置准确
-            painter.drawText(int(draw_x), int(draw_y), int(self.image.width * ratio_w), 
-                           int(self.image.height * ratio_h), 
-                           Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, 
-                           self.watermark_text)
+            # 直接绘制引擎渲染的水印图层，与导出像素一致
+            if self._sprite_pixmap is not None:
+                wm_w, wm_h = self.geometry.size
+                painter.drawPixmap(QRectF(draw_x, draw_y, wm_w * ratio_w, wm_h * ratio_h),
+                                   self._sprite_pixmap, QRectF(self._sprite_pixmap.rect()))
 
     # ------------------- PIL -> QImage -------------------
     def _pil2qimage(self, im):
-        if im.mode == "RGB":
-            r, g, b = im.split()
-            im = Image.merge("RGB", (b, g, r))
-            data = im.tobytes("raw", "RGB")
-            return QImage(data, im.width, im.height, QImage.Format.Format_RGB888)
-        elif im.mode == "RGBA":
-            data = im.tobytes("raw", "RGBA")
-            return QImage(data, im.width, im.height, QImage.Format.Format_RGBA8888)
-        else:
-            im = im.convert("RGBA")
-            data = im.tobytes("raw", "RGBA")
-            return QImage(data, im.width, im.height, QImage.Format.Format_RGBA8888)
+        return pil_to_qimage(im)
 
     # ------------------- QLabel 缩放计算 -------------------
     def _get_scaled_geometry(self):
@@ -274,8 +235,7 @@ class PreviewWidget(QLabel):
 
     def dropEvent(self, event):
         urls = event.mimeData().urls()
-        paths = [u.toLocalFile() for u in urls if u.toLocalFile().lower().endswith(
-            ('.png', '.jpg', '.jpeg', '.bmp', '.tiff'))]
+        paths = [u.toLocalFile() for u in urls if is_image_file(u.toLocalFile())]
         if paths:
             top_window = self.window()
             if hasattr(top_window, "add_images"):
@@ -1,10 +1,11 @@
 # ui/text_watermark_settings.py
 from PyQt6.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QSpinBox,
+    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QSpinBox, QDoubleSpinBox, QCheckBox,
     QPushButton, QSlider, QColorDialog, QInputDialog, QMessageBox, QLineEdit
 )
 from PyQt6.QtGui import QColor
 from PyQt6.QtCore import pyqtSignal, Qt
+from core.invisible_watermark import PAYLOAD_BYTES
 from core.template_manager import TemplateManager
 from functools import partial
 
@@ -42,6 +43,18 @@ class TextWatermarkSettings(QWidget):
         self.size_spin.setValue(36)
         line1.addWidget(self.size_spin)
 
+        # 相对字号：按图片短边的百分比，不同分辨率的图片水印观感一致
+        self.relative_size_check = QCheckBox("按短边")
+        self.relative_size_check.setToolTip("字号按图片短边的百分比计算")
+        line1.addWidget(self.relative_size_check)
+        self.size_ratio_spin = QDoubleSpinBox()
+        self.size_ratio_spin.setRange(0.5, 50.0)
+        self.size_ratio_spin.setSingleStep(0.5)
+        self.size_ratio_spin.setValue(5.0)
+        self.size_ratio_spin.setSuffix("%")
+        self.size_ratio_spin.setEnabled(False)
+        line1.addWidget(self.size_ratio_spin)
+
         line1.addWidget(QLabel("样式:"))
         self.bold_btn = QPushButton("B")
         self.bold_btn.setCheckable(True)
@@ -57,6 +70,10 @@ class TextWatermarkSettings(QWidget):
         self.update_color_btn()
         self.color_btn.clicked.connect(self.select_color)
         line1.addWidget(self.color_btn)
+        # 自动对比度：按每张图片水印区域的亮度自动选择白字/黑字/描边
+        self.auto_contrast_check = QCheckBox("自动")
+        self.auto_contrast_check.setToolTip("按水印下方区域的亮度自动选择颜色与描边")
+        line1.addWidget(self.auto_contrast_check)
 
         line1.addWidget(QLabel("透明度:"))
         self.opacity_slider = QSlider(Qt.Orientation.Horizontal)
@@ -73,6 +90,13 @@ class TextWatermarkSettings(QWidget):
         line2.addWidget(QLabel("水印文字:"))
         self.text_input = QLineEdit()
         line2.addWidget(self.text_input)
+        # 隐形水印：用于泄露溯源的不可见标记（如 客户ID:作业ID）
+        line2.addWidget(QLabel("隐形标记:"))
+        self.mark_input = QLineEdit()
+        self.mark_input.setPlaceholderText("客户ID:作业ID（可选）")
+        # 载荷按 UTF-8 字节计长，不能用 setMaxLength（按字符数），由 on_mark_changed 截断
+        self.mark_input.setToolTip(f"最多 {PAYLOAD_BYTES} 字节（UTF-8，中文每字 3 字节）")
+        line2.addWidget(self.mark_input)
         main_layout.addLayout(line2)
 
         # 第三行：九宫格按钮 + 模板选择 + 保存/删除模板
@@ -95,6 +119,10 @@ class TextWatermarkSettings(QWidget):
             btn.clicked.connect(partial(self.set_position_by_grid, btn, coord))
             line3.addWidget(btn)
             self.pos_buttons[name] = btn
+        # 自动摆放：按每张图片的内容把水印放在细节最少的位置
+        self.auto_position_check = QCheckBox("自动")
+        self.auto_position_check.setToolTip("按画面内容把水印放在细节最少的位置（避开主体）")
+        line3.addWidget(self.auto_position_check)
 
         # 模板下拉
         line3.addWidget(QLabel("模板:"))
@@ -116,10 +144,15 @@ class TextWatermarkSettings(QWidget):
         # 信号绑定
         self.font_combo.currentTextChanged.connect(self.emit_settings)
         self.size_spin.valueChanged.connect(self.emit_settings)
+        self.relative_size_check.toggled.connect(self.on_relative_size_toggled)
+        self.auto_contrast_check.toggled.connect(self.on_auto_contrast_toggled)
+        self.auto_position_check.toggled.connect(self.on_auto_position_toggled)
+        self.size_ratio_spin.valueChanged.connect(self.emit_settings)
         self.bold_btn.toggled.connect(self.emit_settings)
         self.italic_btn.toggled.connect(self.emit_settings)
         self.opacity_slider.valueChanged.connect(self.on_opacity_changed)
         self.text_input.textChanged.connect(self.emit_settings)
+        self.mark_input.textChanged.connect(self.on_mark_changed)
 
     # ---------------- 工具方法 ----------------
     def update_color_btn(self):
@@ -134,10 +167,37 @@ class TextWatermarkSettings(QWidget):
             self.update_color_btn()
             self.emit_settings()
 
+    def on_relative_size_toggled(self, checked):
+        self.size_spin.setEnabled(not checked)
+        self.size_ratio_spin.setEnabled(checked)
+        self.emit_settings()
+
+    def on_auto_contrast_toggled(self, checked):
+        self.color_btn.setEnabled(not checked)
+        self.emit_settings()
+
+    def on_auto_position_toggled(self, checked):
+        for btn in self.pos_buttons.values():
+            btn.setEnabled(not checked)
+        self.emit_settings()
+
+    def _font_size_ratio(self):
+        if not self.relative_size_check.isChecked():
+            return None
+        return self.size_ratio_spin.value() / 100.0
+
     def on_opacity_changed(self, value):
         self.opacity_label.setText(f"{value}%")
         self.emit_settings()
 
+    def on_mark_changed(self, text):
+        """隐形标记超过载荷字节数时截掉末尾字符（不截断半个多字节字符）"""
+        data = text.encode("utf-8")
+        if len(data) > PAYLOAD_BYTES:
+            self.mark_input.setText(data[:PAYLOAD_BYTES].decode("utf-8", "ignore"))
+            return  # setText 会再次触发本方法并发出设置
+        self.emit_settings()
+
     # ---------------- 九宫格点击 ----------------
     def set_position_by_grid(self, btn, coord):
         # 清除其他按钮状态
@@ -173,6 +233,10 @@ class TextWatermarkSettings(QWidget):
             "text": self.text_input.text(),
             "font_family": self.font_combo.currentText(),
             "font_size": self.size_spin.value(),
+            "font_size_ratio": self._font_size_ratio(),
+            "auto_contrast": self.auto_contrast_check.isChecked(),
+            "auto_position": self.auto_position_check.isChecked(),
+            "invisible_mark": self.mark_input.text().strip() or None,
             "bold": self.bold_btn.isChecked(),
             "italic": self.italic_btn.isChecked(),
             "color": (
@@ -223,6 +287,10 @@ class TextWatermarkSettings(QWidget):
             "text": settings["text"],
             "font_family": settings["font_family"],
             "font_size": settings["font_size"],
+            "font_size_ratio": settings.get("font_size_ratio"),
+            "auto_contrast": settings.get("auto_contrast", False),
+            "auto_position": settings.get("auto_position", False),
+            "invisible_mark": settings.get("invisible_mark"),
             "bold": settings.get("bold", False),
             "italic": settings.get("italic", False),
             "color": (
@@ -256,11 +324,18 @@ class TextWatermarkSettings(QWidget):
         self.text_input.setText(data.get("text", ""))
         self.font_combo.setCurrentText(data.get("font_family", "Arial"))
         self.size_spin.setValue(data.get("font_size", 36))
+        ratio = data.get("font_size_ratio")
+        if ratio:
+            self.size_ratio_spin.setValue(ratio * 100)
+        self.relative_size_check.setChecked(bool(ratio))
         self.bold_btn.setChecked(data.get("bold", False))
         self.italic_btn.setChecked(data.get("italic", False))
         color = data.get("color", (255, 255, 255, 255))
         self.color = QColor(color[0], color[1], color[2])
         self.update_color_btn()
+        self.auto_contrast_check.setChecked(data.get("auto_contrast", False))
+        self.auto_position_check.setChecked(data.get("auto_position", False))
+        self.mark_input.setText(data.get("invisible_mark") or "")
         self.opacity_slider.setValue(int(data.get("opacity", 1.0) * 100))
 
         # --- 位置处理 ---
@@ -294,10 +369,14 @@ class TextWatermarkSettings(QWidget):
         self.text_input.clear()
         self.font_combo.setCurrentText("Arial")
         self.size_spin.setValue(36)
+        self.relative_size_check.setChecked(False)
         self.bold_btn.setChecked(False)
         self.italic_btn.setChecked(False)
         self.color = QColor("white")
         self.update_color_btn()
+        self.auto_contrast_check.setChecked(False)
+        self.auto_position_check.setChecked(False)
+        self.mark_input.clear()
         self.opacity_slider.setValue(100)
         self.watermark_pos = (0.5, 0.5)
         self.clear_grid_selection()